@@ -1,37 +1,154 @@
 # ========================================================================================
 # === 1. IMPORTS & SETUP =================================================================
 # ========================================================================================
-import websocket
+import time
+STARTUP_T0 = time.perf_counter()
 import json
-import requests
 import threading
-import time
 import os
 import re
 import logging
+import logging.handlers
+import queue
+import contextvars
+import atexit
 import shlex
+import sqlite3
 import sys
+import signal
+import socket
+import socketserver
 import random
+import abc
+import ast
+import operator
+import asyncio
+import concurrent.futures
+from collections import deque, OrderedDict, Counter
+import heapq
+import bisect
 from datetime import datetime, timezone, timedelta
+from fractions import Fraction
 from dotenv import load_dotenv
-from flask import Flask, render_template_string, redirect, url_for, request, session, flash
-from supabase import create_client, Client
+from flask import Flask, render_template_string, redirect, url_for, request, session, flash, jsonify, Response, stream_with_context
+# requests, websocket-client, websockets and supabase are imported where they are first
+# used (get_token, the engines, LazySupabaseClient) to keep them off the cold-start path.
+try:
+    import orjson
+    json_loads, JSON_BACKEND = orjson.loads, "orjson"
+except ImportError:
+    json_loads, JSON_BACKEND = json.loads, "json"
 
 load_dotenv()
 
 # ========================================================================================
 # === 2. LOGGING SETUP ===================================================================
 # ========================================================================================
+# Records are queued and written by a listener thread; LogControl applies per-category levels,
+# sampling and rate limits first. log_context carries the handler and room for JSON output.
+log_context = contextvars.ContextVar('log_context', default=(None, None)) # (handler, room_id)
+LOG_TAG_RE = re.compile(r'[^\[\w]{0,4}\[([A-Za-z]+)')
+
+def parse_log_rules(spec):
+    rules = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(','))):
+        name, _, value = item.partition('=')
+        if name.strip() and value.strip(): rules[name.strip()] = value.strip()
+    return rules
+
+class LogControl(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.level, self.category_levels = logging.INFO, {}
+        self.limits, self.sampling = {}, {} # category -> (tokens per second, burst); category -> keep 1 in n
+        self.buckets, self.seen, self.suppressed, self.stats = {}, Counter(), Counter(), Counter()
+
+    def configure(self, level, limits="", sampling=""):
+        for name, value in parse_log_rules(limits).items():
+            count, _, seconds = value.partition('/')
+            self.limits[name] = (float(count) / float(seconds or 1), float(count))
+        self.sampling.update({name: max(1, int(value)) for name, value in parse_log_rules(sampling).items()})
+        self.set_level(level)
+
+    @staticmethod
+    def parse_level(level):
+        if isinstance(level, int): return level
+        if isinstance(value := logging.getLevelName(str(level).strip().upper()), int): return value
+        raise ValueError(f"unknown log level {level!r}")
+
+    def set_level(self, level, category=None):
+        if category and str(level).lower() == 'default': self.category_levels.pop(category, None)
+        elif category: self.category_levels[category] = self.parse_level(level)
+        else: self.level = self.parse_level(level)
+        logging.getLogger().setLevel(min([self.level, *self.category_levels.values()]))
+
+    def filter(self, record):
+        category = getattr(record, 'category', None)
+        if category is None and isinstance(record.msg, str) and (match := LOG_TAG_RE.match(record.msg)): category = match.group(1)
+        record.category = category
+        if record.levelno < self.category_levels.get(category, self.level): return False
+        if (keep_every := self.sampling.get(category)) and record.levelno < logging.WARNING:
+            self.seen[category] += 1
+            if self.seen[category] % keep_every: self.stats['sampled_out'] += 1; return False
+        if (limit := self.limits.get(category)) is not None:
+            now = time.monotonic()
+            with self.lock:
+                tokens, last = self.buckets.get(category, (limit[1], now))
+                tokens = min(limit[1], tokens + (now - last) * limit[0])
+                if tokens < 1:
+                    self.buckets[category] = (tokens, now); self.suppressed[category] += 1; self.stats['rate_limited'] += 1
+                    return False
+                self.buckets[category] = (tokens - 1, now); suppressed = self.suppressed.pop(category, 0)
+            if suppressed: record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        record.frame_handler, record.room = log_context.get()
+        return True
+
+    def snapshot(self):
+        with self.lock: suppressed = dict(self.suppressed)
+        return {"level": logging.getLevelName(self.level), "categories": {name: logging.getLevelName(level) for name, level in self.category_levels.items()},
+                "rate_limits": {name: f"{burst:g}/{burst / rate:g}s" for name, (rate, burst) in self.limits.items()},
+                "sampling": dict(self.sampling), "suppressed": suppressed, "queued": log_listener.queue.qsize() if log_listener else 0,
+                **{key: self.stats[key] for key in ('dropped', 'sampled_out', 'rate_limited')}}
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record): return record # formatting (and traceback rendering) happens on the listener thread
+    def enqueue(self, record):
+        try: self.queue.put_nowait(record)
+        except queue.Full: log_control.stats['dropped'] += 1
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'), "level": record.levelname, "msg": record.getMessage()}
+        if record.name != 'root': entry["logger"] = record.name
+        for field, attr in (("category", "category"), ("handler", "frame_handler"), ("room", "room")):
+            if (value := getattr(record, attr, None)) is not None: entry[field] = value
+        if record.exc_info: entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+log_control = LogControl()
+log_listener = None
+
+def stop_log_listener():
+    global log_listener
+    if log_listener: log_listener.stop(); log_listener = None
+
 def setup_logging():
-    log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    global log_listener
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
-    handler = logging.StreamHandler(sys.stderr)
-    handler.setFormatter(log_formatter)
-    logger.addHandler(handler)
-    logging.info("Logging system initialized (Server mode).")
+    stop_log_listener()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonLogFormatter() if Config.LOG_FORMAT == 'json' else logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue(Config.LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue); queue_handler.addFilter(log_control)
+    logger.addHandler(queue_handler)
+    log_control.configure(Config.LOG_LEVEL, Config.LOG_CATEGORY_LIMITS, Config.LOG_SAMPLING)
+    log_listener = logging.handlers.QueueListener(log_queue, stream_handler); log_listener.start()
+    logging.info(f"Logging system initialized (Server mode, {Config.LOG_FORMAT} output).")
+
+atexit.register(stop_log_listener)
 
 # ========================================================================================
 # === 3. CONFIGURATION & STATE ===========================================================
@@ -45,98 +162,804 @@ class Config:
     UPTIME_SECRET_KEY = os.getenv("UPTIME_SECRET_KEY", "change-this-secret-key")
     FLASK_SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "a-very-secret-flask-key")
     MASTERS_LIST = os.getenv("MASTERS_LIST", "yasin,amiga")
-    LOGIN_URL = "https://api.howdies.app/api/login"
-    WS_URL = "wss://app.howdies.app/"
-    ROOM_JOIN_DELAY_SECONDS = 2
+    LOGIN_URL = os.getenv("LOGIN_URL", "https://api.howdies.app/api/login")
+    WS_URL = os.getenv("WS_URL", "wss://app.howdies.app/")
+    ROOM_JOIN_DELAY_SECONDS = 0.25 # pacing between pipelined join requests
+    JOIN_TIMEOUT_SECONDS = 10
     REJOIN_ON_KICK_DELAY_SECONDS = 3
-    INITIAL_RECONNECT_DELAY = 10
+    INITIAL_RECONNECT_DELAY = 2
     MAX_RECONNECT_DELAY = 300
+    BOT_ENGINE = os.getenv("BOT_ENGINE", "threaded").strip().lower() # threaded | asyncio
     QUIZ_ANSWER_DELAY_MIN_MS = int(os.getenv("QUIZ_ANSWER_DELAY_MIN_MS", "900"))
     QUIZ_ANSWER_DELAY_MAX_MS = int(os.getenv("QUIZ_ANSWER_DELAY_MAX_MS", "2500"))
+    QUIZ_MAX_EXPRESSION_LENGTH = 200
+    QUIZ_MAX_EXPONENT = 64
+    QUIZ_MAX_RESULT_BITS = 4096 # bounds nested powers such as ((9**64)**64)**64
+    QUIZ_CACHE_SIZE = int(os.getenv("QUIZ_CACHE_SIZE", "2048"))
+    QUIZ_CACHE_FILE = os.getenv("QUIZ_CACHE_FILE") # e.g. solver_cache.json; unset keeps the cache in memory only
+    QUIZ_CACHE_SAVE_EVERY = 25
+    QUIZ_PATTERNS_FILE = os.getenv("QUIZ_PATTERNS_FILE") # optional JSON with extra quiz-bot line patterns
     
     CYCLE_WORK_MIN_SECONDS, CYCLE_WORK_MAX_SECONDS = 900, 1800
     CYCLE_BREAK_MIN_SECONDS, CYCLE_BREAK_MAX_SECONDS = 20, 120
     CYCLE_STOP_COMMANDS = ['.stop', '.q 0', '.pause']
     CYCLE_START_COMMANDS = ['.start', '.q 1', '.play']
 
-    ROAMER_INTERVAL_MIN_SECONDS = 9 * 60
-    ROAMER_INTERVAL_MAX_SECONDS = 11 * 60
+    ROAMER_INTERVAL_MIN_SECONDS = int(os.getenv("ROAMER_INTERVAL_MIN_SECONDS", str(6 * 60))) # each tick fills every free slot: 3 roams per ~9 min is ~20/h
+    ROAMER_INTERVAL_MAX_SECONDS = int(os.getenv("ROAMER_INTERVAL_MAX_SECONDS", str(12 * 60)))
+    ROAMER_CONCURRENCY = int(os.getenv("ROAMER_CONCURRENCY", "3"))
+    ROAMER_HOURLY_BUDGET = int(os.getenv("ROAMER_HOURLY_BUDGET", "20"))
     ROAMER_PAUSE_SECONDS = 4
     ROAMER_LISTEN_SECONDS = 7
     ROAMER_VISITED_EXPIRY_SECONDS = 24 * 60 * 60
+    ROAMER_SELECTION = os.getenv("ROAMER_SELECTION", "bandit").strip().lower() # bandit | uniform
+    ROAMER_SELECTION_INDEX_SIZE = 16 # rooms with the best known yield, always among the candidates
+    ROAMER_SELECTION_EXPLORERS = 4 # random available rooms added to each pick
+    ROAMER_PRIZE_HALF_LIFE_DAYS = 7 # recency prior: a prize this long ago adds half a pseudo-win
+    ROOM_DIRECTORY_TTL_SECONDS = int(os.getenv("ROOM_DIRECTORY_TTL_SECONDS", str(30 * 60))) # drop rooms missing from room lists this long
     SPIN_COMMAND = ".s"
     PRIZE_KEYWORDS = ['won', 'gets', 'prize', 'congratulations', 'unlocked', 'received']
     MASTER_PM_TARGET = MASTERS_LIST.split(',')[0].strip().lower()
 
     BROWSER_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36", "Origin": "https://howdies.app"}
     
+    DISPATCHER_WORKERS = int(os.getenv("DISPATCHER_WORKERS", "4"))
+    DISPATCHER_QUEUE_PER_ROOM = int(os.getenv("DISPATCHER_QUEUE_PER_ROOM", "50"))
+    DISPATCHER_MAX_PENDING = int(os.getenv("DISPATCHER_MAX_PENDING", "1000"))
+    DISPATCHER_OVERFLOW_POLICY = os.getenv("DISPATCHER_OVERFLOW_POLICY", "drop_oldest") # drop_oldest | drop_newest | block
+    DISPATCHER_BLOCK_TIMEOUT_SECONDS = 2
+    COMMAND_USER_RATE_PER_MINUTE = float(os.getenv("COMMAND_USER_RATE_PER_MINUTE", "6")) # non-master commands, per sender
+    COMMAND_USER_BURST = int(os.getenv("COMMAND_USER_BURST", "3"))
+    COMMAND_ROOM_RATE_PER_MINUTE = float(os.getenv("COMMAND_ROOM_RATE_PER_MINUTE", "20")) # non-master commands, per room
+    COMMAND_ROOM_BURST = int(os.getenv("COMMAND_ROOM_BURST", "6"))
+
+    FRAME_PEEK_CHARS = 128
+    SEND_GLOBAL_RATE_PER_SECOND = float(os.getenv("SEND_GLOBAL_RATE_PER_SECOND", "4"))
+    SEND_GLOBAL_BURST = int(os.getenv("SEND_GLOBAL_BURST", "8"))
+    SEND_ROOM_MIN_INTERVAL_SECONDS = float(os.getenv("SEND_ROOM_MIN_INTERVAL_SECONDS", "0.7"))
+    SEND_QUEUE_MAX = 500
+    SEND_TTL_SECONDS = 120
+    SEND_ANSWER_TTL_SECONDS = 20
+
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower() # text | json
+    LOG_QUEUE_SIZE = 10000
+    LOG_CATEGORY_LIMITS = os.getenv("LOG_CATEGORY_LIMITS", "WS=5/60,Frame=10/60,Dispatcher=20/60") # category=count/seconds
+    LOG_SAMPLING = os.getenv("LOG_SAMPLING", "") # category=n keeps 1 in n records below WARNING, e.g. Join=10
+
     SUPABASE_URL = os.getenv("SUPABASE_URL")
     SUPABASE_KEY = os.getenv("SUPABASE_KEY")
     LOG_CLEANUP_INTERVAL_SECONDS = 60 * 60
+    DB_FLUSH_BATCH_SIZE = int(os.getenv("DB_FLUSH_BATCH_SIZE", "20"))
+    DB_FLUSH_INTERVAL_SECONDS = int(os.getenv("DB_FLUSH_INTERVAL_SECONDS", "30"))
+    DB_RETRY_INITIAL_SECONDS, DB_RETRY_MAX_SECONDS = 5, 300
+    DB_MAX_PENDING_LOGS = 5000
+    LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "bot_state.db")
+    ROAM_LOG_SEED_LIMIT = 100
+    ROAM_LOG_BUFFER_SIZE = 200
+    STATUS_REFRESH_SECONDS = 2
+    BOT_SUPERVISOR_SOCKET = os.getenv("BOT_SUPERVISOR_SOCKET") # e.g. /tmp/arcadebot.sock; unset runs the bot inside the panel process
+    BOT_AUTOSTART = os.getenv("BOT_AUTOSTART", "0") == "1"
+    SUPERVISOR_TIMEOUT_SECONDS = 15
+    STATUS_KEEPALIVE_SECONDS = 15
+    STATUS_STREAM_MAX_SECONDS = 25 # each SSE response ends below gunicorn's 30s worker timeout; EventSource reconnects
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_INTERVAL_MS = 10
+    PROFILE_DEFAULT_SECONDS = 10
+    PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "20")) # the panel route blocks for the window; keep it under gunicorn's 30s worker timeout
+    PROFILE_KEEP = 10
+    WARM_START = os.getenv("WARM_START", "1") == "1"
+    WARM_START_MAX_AGE_SECONDS = int(os.getenv("WARM_START_MAX_AGE_SECONDS", str(6 * 60 * 60)))
 
-supabase: Client = None
-if Config.SUPABASE_URL and Config.SUPABASE_KEY:
-    try:
-        supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
-        logging.info("✅ Supabase client initialized.")
-    except Exception as e:
-        logging.error(f"🔴 Failed to initialize Supabase client: {e}")
-else:
-    logging.warning("⚠️ Supabase credentials not found. Roam logs and visited state will be in-memory only.")
+# Created on first use (importing supabase costs ~0.3s); `if supabase:` only checks the credentials.
+class LazySupabaseClient:
+    def __init__(self, url, key):
+        self.url, self.key, self.client, self.failed, self.lock = url, key, None, False, threading.Lock()
+    def __bool__(self): return bool(self.url and self.key) and not self.failed
+    def __getattr__(self, name): return getattr(self.get(), name)
+    def get(self):
+        if self.client is None:
+            with self.lock:
+                if self.client is None and not self.failed:
+                    started = time.perf_counter()
+                    try:
+                        from supabase import create_client
+                        self.client = create_client(self.url, self.key)
+                        logging.info(f"✅ Supabase client initialized in {time.perf_counter() - started:.2f}s.")
+                    except Exception as e:
+                        self.failed = True; logging.error(f"🔴 Failed to initialize Supabase client: {e}")
+        if self.client is None: raise RuntimeError("Supabase client is not available")
+        return self.client
+
+supabase = LazySupabaseClient(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+if not supabase: logging.warning("⚠️ Supabase credentials not found. Roam logs and visited state will be kept in the local store only.")
+
+# --- Startup profile --- Seconds from import to each startup milestone (first occurrence only).
+class StartupProfile:
+    def __init__(self, started): self.started, self.marks = started, {}
+    def mark(self, phase):
+        if phase not in self.marks: self.marks[phase] = time.perf_counter() - self.started
+    def snapshot(self): return {phase: round(seconds, 3) for phase, seconds in self.marks.items()}
+    def summary(self): return ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.marks.items())
+
+startup_profile = StartupProfile(STARTUP_T0)
+startup_profile.mark('imports')
+
+# --- Per-room state --- One RoomState per joined room, indexed by ID and by lower-cased name.
+class RoomState:
+    __slots__ = ('room_id', 'name', 'quiz_bot', 'last_question_id', 'cycle_phase', 'cycle_timer', 'prize_future')
+    def __init__(self, room_id, name):
+        self.room_id, self.name = room_id, name
+        self.quiz_bot = self.last_question_id = None # quiz solver target (lower-cased) and last question answered
+        self.cycle_phase = self.cycle_timer = None # 'work'/'break' while cycle mode runs
+        self.prize_future = None # Future resolved with the prize text while a roam listens here
+
+    def stop_cycle(self):
+        timer, self.cycle_timer, self.cycle_phase = self.cycle_timer, None, None
+        if timer: timer.cancel()
+
+    def snapshot(self):
+        return {"id": self.room_id, "name": self.name, "quiz": self.quiz_bot, "cycle": self.cycle_phase}
+
+class RoomRegistry:
+    def __init__(self):
+        self.lock, self.by_id, self.by_name = threading.Lock(), {}, {}
+
+    def __len__(self): return len(self.by_id)
+    def get(self, room_id): return self.by_id.get(room_id)
+    def find(self, room_name): return self.by_name.get(room_name.lower())
+
+    def add(self, room_id, room_name):
+        with self.lock:
+            if (room := self.by_id.get(room_id)) is None: room = self.by_id[room_id] = RoomState(room_id, room_name)
+            elif room.name.lower() != room_name.lower(): self.by_name.pop(room.name.lower(), None); room.name = room_name
+            if (previous := self.by_name.get(room_name.lower())) is not None and previous is not room:
+                self.by_id.pop(previous.room_id, None); previous.stop_cycle()
+            self.by_name[room_name.lower()] = room
+        return room
+
+    def remove(self, room_id):
+        with self.lock:
+            if (room := self.by_id.pop(room_id, None)) is not None and self.by_name.get(room.name.lower()) is room: del self.by_name[room.name.lower()]
+        if room is not None: room.stop_cycle()
+        return room
+
+    def detach_all(self): # the caller reads what it needs from the rooms, then calls stop_cycle()
+        with self.lock:
+            rooms = list(self.by_id.values()); self.by_id.clear(); self.by_name.clear()
+        return rooms
+
+    def rooms(self):
+        with self.lock: return list(self.by_id.values())
+
+    def snapshot(self):
+        with self.lock: return [room.snapshot() for room in self.by_id.values()]
 
 class BotState:
     def __init__(self):
-        self.bot_user_id, self.token, self.ws_instance = None, None, None
+        self.bot_user_id, self.token, self.ws_instance, self.engine = None, None, None, None
         self.is_connected = False
-        self.masters, self.room_id_to_name, self.room_name_to_id = [], {}, {}
+        self.masters, self.rooms = frozenset(), RoomRegistry()
         self.reconnect_delay = Config.INITIAL_RECONNECT_DELAY
-        self.quiz_solvers, self.processed_question_ids = {}, {}
+        self.token_rejected, self.resume_snapshot, self.disconnected_at, self.last_resume = False, {}, None, None
+        self.reconnects, self.warm_token = 0, False
         self.stop_bot_event = threading.Event()
-        self.cycle_timers, self.break_end_times, self.work_end_times = {}, {}, {}
         
-        self.roamer_thread, self.is_roamer_active = None, False
+        self.roamer_task, self.is_roamer_active = None, False
         self.stop_roamer_event = threading.Event()
-        self.roamable_rooms = set()
-        self.visited_roam_rooms = {} 
         self.roam_lock = threading.Lock()
-        self.listening_for_prize_in_room, self.last_prize_won, self.prize_found_event = None, None, None
+        self.roam_launches = deque()
         self.master_user_id = None
         self.log_cleanup_thread = None
 
 bot_state = BotState()
 bot_thread = None
 
+# ========================================================================================
+# === METRICS ============================================================================
+# ========================================================================================
+# Prometheus text-format metrics for /metrics. Hot-path increments skip locking; gauges are read at scrape time.
+METRICS = []
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_metric_labels(label, value, extra=""):
+    if label is None: return f"{{{extra}}}" if extra else ""
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'{{{label}="{escaped}"{"," + extra if extra else ""}}}'
+
+class MetricCounter:
+    def __init__(self, name, help_text, label=None):
+        self.name, self.help, self.label, self.values = name, help_text, label, {}
+        METRICS.append(self)
+    def inc(self, label_value=None, amount=1): self.values[label_value] = self.values.get(label_value, 0) + amount
+    def render(self):
+        yield f"# HELP {self.name} {self.help}\n# TYPE {self.name} counter"
+        for label_value, value in list(self.values.items()): yield f"{self.name}{format_metric_labels(self.label, label_value)} {value}"
+
+class MetricHistogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, label=None):
+        self.name, self.help, self.buckets, self.label, self.series = name, help_text, buckets, label, {}
+        METRICS.append(self)
+    def observe(self, value, label_value=None):
+        if (series := self.series.get(label_value)) is None: series = self.series.setdefault(label_value, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1; series[1] += value; series[2] += 1
+    def render(self):
+        yield f"# HELP {self.name} {self.help}\n# TYPE {self.name} histogram"
+        for label_value, (counts, total, count) in list(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), list(counts)):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                yield f"{self.name}_bucket{format_metric_labels(self.label, label_value, le)} {cumulative}"
+            yield f"{self.name}_sum{format_metric_labels(self.label, label_value)} {total}"
+            yield f"{self.name}_count{format_metric_labels(self.label, label_value)} {count}"
+
+class MetricCallback:
+    # fn returns a number, or a {label_value: number} dict when label is set.
+    def __init__(self, name, help_text, metric_type, fn, label=None):
+        self.name, self.help, self.type, self.fn, self.label = name, help_text, metric_type, fn, label
+        METRICS.append(self)
+    def render(self):
+        yield f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.type}"
+        values = self.fn()
+        for label_value, value in (values.items() if self.label else [(None, values)]):
+            yield f"{self.name}{format_metric_labels(self.label, label_value)} {value}"
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        try: lines.extend(metric.render())
+        except Exception as e: logging.error(f"[Metrics] Failed to render {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+command_counter = MetricCounter("howdies_commands_total", "Chat commands received, by command.", label="command")
+command_rejections = MetricCounter("howdies_commands_rejected_total", "Chat commands dropped before dispatch, by reason.", label="reason")
+command_seconds = MetricHistogram("howdies_command_seconds", "Command handler run time, by command.", label="command")
+on_message_seconds = MetricHistogram("howdies_on_message_seconds", "Time spent in on_message per inbound frame.",
+                                     buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+quiz_answer_seconds = MetricHistogram("howdies_quiz_answer_seconds", "Time from a quiz line arriving to its answer being queued (includes the human-like delay).")
+supabase_seconds = MetricHistogram("howdies_supabase_call_seconds", "Supabase call latency, by operation.", label="op")
+join_rtt_seconds = MetricHistogram("howdies_join_rtt_seconds", "Round trip from sending joinchatroom to the successful reply.")
+
+def timed_supabase_call(op, query):
+    started = time.perf_counter()
+    try: return query.execute()
+    finally: supabase_seconds.observe(time.perf_counter() - started, op)
+
+# ========================================================================================
+# === MESSAGE DISPATCHER =================================================================
+# ========================================================================================
+# One FIFO per key (e.g. ('quiz', room_id)): a room's work runs in order, different rooms run concurrently.
+class Dispatcher:
+    def __init__(self, num_workers, max_queue_per_key, max_pending, overflow_policy):
+        self.num_workers, self.max_queue_per_key, self.max_pending = num_workers, max_queue_per_key, max_pending
+        self.overflow_policy = overflow_policy
+        self.cond = threading.Condition()
+        self.queues, self.ready, self.active = {}, deque(), set()
+        self.scheduled = set() # keys currently in ready; a key is never queued there twice
+        self.pending = 0
+        self.workers = []
+        self.stats = {'submitted': 0, 'handled': 0, 'dropped': 0, 'errors': 0, 'max_depth': 0,
+                      'wait_total_ms': 0.0, 'run_total_ms': 0.0, 'run_max_ms': 0.0}
+
+    def start(self):
+        with self.cond:
+            self.workers = [w for w in self.workers if w.is_alive()]
+            while len(self.workers) < self.num_workers:
+                worker = threading.Thread(target=self._worker_loop, name=f"dispatcher-{len(self.workers)}", daemon=True)
+                self.workers.append(worker); worker.start()
+
+    def submit(self, key, fn, *args, bounded=True):
+        # bounded=False (due timers) skips the overflow policy: a dropped cycle transition would
+        # strand its room, so those jobs are always queued
+        with self.cond:
+            return self._enqueue_locked(key, fn, args, bounded)
+
+    def clear(self):
+        with self.cond:
+            dropped = self.pending
+            for key in list(self.queues):
+                self.queues[key].clear()
+                if key not in self.active: del self.queues[key]
+            self.ready.clear(); self.scheduled.clear(); self.pending = 0
+            self.cond.notify_all()
+        if dropped: logging.info(f"[Dispatcher] Cleared {dropped} pending jobs.")
+
+    def snapshot(self):
+        with self.cond:
+            snap = dict(self.stats)
+            snap.update(depth=self.pending, active=len(self.active), keys=len(self.queues),
+                        workers=sum(1 for w in self.workers if w.is_alive()))
+        handled = snap['handled'] or 1
+        snap['avg_wait_ms'], snap['avg_run_ms'] = snap['wait_total_ms'] / handled, snap['run_total_ms'] / handled
+        return snap
+
+    def _enqueue_locked(self, key, fn, args, bounded=True):
+        queue = self.queues.setdefault(key, deque())
+        if bounded and (len(queue) >= self.max_queue_per_key or self.pending >= self.max_pending):
+            if self.overflow_policy == 'block':
+                deadline = time.monotonic() + Config.DISPATCHER_BLOCK_TIMEOUT_SECONDS
+                while len(queue) >= self.max_queue_per_key or self.pending >= self.max_pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    self.cond.wait(remaining)
+                    queue = self.queues.setdefault(key, deque())
+            if len(queue) >= self.max_queue_per_key or self.pending >= self.max_pending:
+                if self.overflow_policy == 'drop_oldest' and queue:
+                    queue.popleft(); self.pending -= 1
+                else:
+                    self.stats['dropped'] += 1
+                    if not queue and key not in self.active: del self.queues[key]
+                    return False
+                self.stats['dropped'] += 1
+        queue.append((time.monotonic(), fn, args))
+        self.pending += 1; self.stats['submitted'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.pending)
+        self._schedule_locked(key)
+        self.cond.notify()
+        return True
+
+    def _schedule_locked(self, key):
+        if key not in self.active and key not in self.scheduled: self.scheduled.add(key); self.ready.append(key)
+
+    def _worker_loop(self):
+        while True:
+            try: self._run_next()
+            except Exception as e: logging.error(f"[Dispatcher] Worker error: {e}", exc_info=True)
+
+    def _run_next(self):
+        with self.cond:
+            while not self.ready: self.cond.wait()
+            key = self.ready.popleft(); self.scheduled.discard(key)
+            if not (queue := self.queues.get(key)):
+                if key not in self.active: self.queues.pop(key, None)
+                return
+            enqueued_at, fn, args = queue.popleft()
+            self.pending -= 1; self.active.add(key)
+            self.cond.notify_all()
+        started = time.monotonic()
+        context = log_context.set((key[0], key[1] if isinstance(key[1], int) else None) if isinstance(key, tuple) and len(key) > 1 else (None, None))
+        try: fn(*args)
+        except Exception as e:
+            logging.error(f"[Dispatcher] Error handling job for {key}: {e}", exc_info=True)
+            with self.cond: self.stats['errors'] += 1
+        finally:
+            log_context.reset(context)
+            finished = time.monotonic()
+            with self.cond:
+                self.active.discard(key)
+                if self.queues.get(key): self._schedule_locked(key)
+                else: self.queues.pop(key, None)
+                run_ms = (finished - started) * 1000
+                self.stats['handled'] += 1
+                self.stats['wait_total_ms'] += (started - enqueued_at) * 1000
+                self.stats['run_total_ms'] += run_ms
+                self.stats['run_max_ms'] = max(self.stats['run_max_ms'], run_ms)
+                if self.ready: self.cond.notify()
+
+dispatcher = Dispatcher(Config.DISPATCHER_WORKERS, Config.DISPATCHER_QUEUE_PER_ROOM, Config.DISPATCHER_MAX_PENDING, Config.DISPATCHER_OVERFLOW_POLICY)
+
+# ========================================================================================
+# === TIMER SCHEDULER ====================================================================
+# ========================================================================================
+# All delayed actions share one scheduler: a heap on one thread (threaded engine) or the event loop (asyncio).
+class TimerHandle:
+    __slots__ = ('when', 'fire_at', 'key', 'fn', 'args', 'cancelled', 'done', 'scheduler', 'loop_handle')
+    def __init__(self, scheduler, delay, key, fn, args):
+        self.when, self.fire_at = time.monotonic() + delay, time.time() + delay
+        self.key, self.fn, self.args, self.scheduler = key, fn, args, scheduler
+        self.cancelled = self.done = False
+        self.loop_handle = None
+    def cancel(self): self.scheduler.cancel(self)
+    def __lt__(self, other): return self.when < other.when
+
+class TimerScheduler(abc.ABC):
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.live, self.keyed = set(), {}
+        self.stats = {'scheduled': 0, 'fired': 0, 'cancelled': 0, 'max_lag_ms': 0.0}
+
+    def call_later(self, delay, fn, *args, key=None):
+        handle = TimerHandle(self, max(0.0, delay), key, fn, args)
+        with self.lock:
+            self.live.add(handle); self.stats['scheduled'] += 1
+            if key is not None: self.keyed[key] = handle
+            self._arm_locked(handle)
+        return handle
+
+    def cancel(self, handle):
+        with self.lock:
+            if handle.cancelled or handle.done: return
+            handle.cancelled = True; self.stats['cancelled'] += 1
+            self._forget_locked(handle)
+            self._disarm_locked(handle)
+
+    def clear(self):
+        with self.lock: handles = list(self.live)
+        for handle in handles: self.cancel(handle)
+
+    def pending_count(self):
+        with self.lock: return len(self.live)
+
+    def next_fire(self, key):
+        with self.lock:
+            handle = self.keyed.get(key)
+            return handle.fire_at if handle else None
+
+    def snapshot(self):
+        with self.lock:
+            snap = dict(self.stats, pending=len(self.live))
+            snap['next_fire_at'] = min((h.fire_at for h in self.live), default=None)
+        return snap
+
+    def _forget_locked(self, handle):
+        self.live.discard(handle)
+        if handle.key is not None and self.keyed.get(handle.key) is handle: del self.keyed[handle.key]
+
+    def _claim(self, handle):
+        with self.lock:
+            if handle.cancelled or handle.done: return False
+            handle.done = True; self.stats['fired'] += 1
+            self.stats['max_lag_ms'] = max(self.stats['max_lag_ms'], (time.monotonic() - handle.when) * 1000)
+            self._forget_locked(handle)
+            return True
+
+    @abc.abstractmethod
+    def _arm_locked(self, handle): ...
+    def _disarm_locked(self, handle): pass
+
+class HeapScheduler(TimerScheduler):
+    def __init__(self):
+        super().__init__()
+        self.heap, self.thread = [], None
+
+    def start(self):
+        with self.lock:
+            if not self.thread or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="timer-scheduler", daemon=True); self.thread.start()
+
+    def _arm_locked(self, handle):
+        heapq.heappush(self.heap, handle)
+        if self.heap[0] is handle: self.lock.notify()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while True:
+                    while self.heap and (self.heap[0].cancelled or self.heap[0].done): heapq.heappop(self.heap)
+                    timeout = (self.heap[0].when - time.monotonic()) if self.heap else None
+                    if timeout is not None and timeout <= 0: break
+                    self.lock.wait(timeout)
+                handle = heapq.heappop(self.heap)
+            if self._claim(handle):
+                dispatcher.submit(handle.key or ('timer', id(handle)), handle.fn, *handle.args, bounded=False)
+
+class LoopScheduler(TimerScheduler):
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def _arm_locked(self, handle):
+        if not self.loop.is_closed(): self.loop.call_soon_threadsafe(self._arm_on_loop, handle)
+
+    def _arm_on_loop(self, handle):
+        if handle.cancelled: return
+        handle.loop_handle = self.loop.call_later(max(0.0, handle.when - time.monotonic()), self._fire, handle)
+
+    def _disarm_locked(self, handle):
+        if not self.loop.is_closed(): self.loop.call_soon_threadsafe(lambda: handle.loop_handle and handle.loop_handle.cancel())
+
+    def _fire(self, handle):
+        if not self._claim(handle): return
+        try: handle.fn(*handle.args)
+        except Exception as e: logging.error(f"[Scheduler] Error in timer callback {handle.fn.__name__}: {e}", exc_info=True)
+
+timer_scheduler = HeapScheduler()
+
+# ========================================================================================
+# === OUTBOUND WRITER ====================================================================
+# ========================================================================================
+# One writer thread sends every frame except login: answers, then control, then replies, paced by a token
+# bucket and a per-room gap. Buffered while offline; messages with the same coalesce key replace each other.
+SEND_PRIORITY_ANSWER, SEND_PRIORITY_CONTROL, SEND_PRIORITY_REPLY = 0, 1, 2
+
+class OutboundMessage:
+    __slots__ = ('priority', 'room_id', 'payload', 'enqueued_at', 'expires_at', 'coalesce_key', 'on_sent')
+    def __init__(self, priority, payload, ttl, coalesce_key, on_sent=None):
+        self.priority, self.room_id, self.payload, self.coalesce_key, self.on_sent = priority, payload.get('roomid'), payload, coalesce_key, on_sent
+        self.enqueued_at = time.monotonic(); self.expires_at = self.enqueued_at + ttl
+
+class OutboundWriter:
+    def __init__(self, rate_per_second, burst, room_min_interval, max_queued):
+        self.rate, self.burst, self.room_min_interval, self.max_queued = rate_per_second, burst, room_min_interval, max_queued
+        self.cond = threading.Condition()
+        self.queues = [deque() for _ in (SEND_PRIORITY_ANSWER, SEND_PRIORITY_CONTROL, SEND_PRIORITY_REPLY)]
+        self.coalesced, self.room_next_send = {}, {}
+        self.tokens, self.last_refill = float(burst), time.monotonic()
+        self.online, self.thread = False, None
+        self.stats = {'queued': 0, 'sent': 0, 'expired': 0, 'coalesced': 0, 'overflow': 0, 'errors': 0,
+                      'latency_total_ms': 0.0, 'latency_max_ms': 0.0}
+
+    def start(self):
+        with self.cond:
+            if not self.thread or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="outbound-writer", daemon=True); self.thread.start()
+
+    def enqueue(self, payload, priority=SEND_PRIORITY_CONTROL, coalesce_key=None, on_sent=None):
+        ttl = Config.SEND_ANSWER_TTL_SECONDS if priority == SEND_PRIORITY_ANSWER else Config.SEND_TTL_SECONDS
+        with self.cond:
+            if coalesce_key is not None and (queued := self.coalesced.get(coalesce_key)):
+                queued.payload, queued.expires_at = payload, time.monotonic() + ttl
+                if on_sent: queued.on_sent = on_sent
+                self.stats['coalesced'] += 1; return
+            if self.depth_locked() >= self.max_queued and not self._evict_locked(priority):
+                self.stats['overflow'] += 1; return
+            message = OutboundMessage(priority, payload, ttl, coalesce_key, on_sent)
+            self.queues[priority].append(message)
+            if coalesce_key is not None: self.coalesced[coalesce_key] = message
+            self.stats['queued'] += 1
+            self.cond.notify()
+        if not self.online and priority == SEND_PRIORITY_ANSWER: logging.warning("Warning: WebSocket is not connected. Answer buffered.", extra={'category': 'WS'})
+
+    def set_online(self, online):
+        with self.cond:
+            self.online = online
+            self.cond.notify()
+
+    def clear(self):
+        with self.cond:
+            for queue in self.queues: queue.clear()
+            self.coalesced.clear(); self.room_next_send.clear()
+
+    def depth_locked(self): return sum(len(queue) for queue in self.queues)
+
+    def snapshot(self):
+        with self.cond:
+            snap = dict(self.stats, depth=self.depth_locked(), online=self.online,
+                        depth_by_priority=[len(queue) for queue in self.queues])
+        snap['avg_latency_ms'] = snap['latency_total_ms'] / snap['sent'] if snap['sent'] else 0.0
+        return snap
+
+    def _evict_locked(self, priority):
+        for queue in reversed(self.queues[priority:]):
+            if queue:
+                self._forget_locked(queue.popleft()); self.stats['overflow'] += 1
+                return True
+        return False
+
+    def _forget_locked(self, message):
+        if message.coalesce_key is not None and self.coalesced.get(message.coalesce_key) is message: del self.coalesced[message.coalesce_key]
+
+    def _take_locked(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate); self.last_refill = now
+        wait = None
+        if self.tokens < 1: wait = (1 - self.tokens) / self.rate
+        for queue in self.queues:
+            index = 0
+            while index < len(queue):
+                message = queue[index]
+                if message.expires_at <= now:
+                    del queue[index]; self._forget_locked(message); self.stats['expired'] += 1
+                    continue
+                room_ready_at = self.room_next_send.get(message.room_id, 0) if message.room_id is not None else 0
+                if room_ready_at <= now and self.tokens >= 1:
+                    del queue[index]; self._forget_locked(message)
+                    self.tokens -= 1
+                    if message.room_id is not None: self.room_next_send[message.room_id] = now + self.room_min_interval
+                    return message, None
+                ready_in = max(room_ready_at - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0)
+                wait = ready_in if wait is None else min(wait, ready_in)
+                index += 1
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    message, wait = self._take_locked(time.monotonic()) if self.online else (None, None)
+                    if message: break
+                    self.cond.wait(wait)
+            try:
+                bot_state.ws_instance.send(json.dumps(message.payload))
+                latency_ms = (time.monotonic() - message.enqueued_at) * 1000
+                with self.cond:
+                    self.stats['sent'] += 1; self.stats['latency_total_ms'] += latency_ms
+                    self.stats['latency_max_ms'] = max(self.stats['latency_max_ms'], latency_ms)
+            except Exception as e:
+                logging.error(f"Error sending message: {e}", extra={'category': 'WS'})
+                with self.cond: self.stats['errors'] += 1
+                continue
+            if message.on_sent:
+                try: message.on_sent()
+                except Exception as e: logging.error(f"Error in on_sent callback: {e}", exc_info=True, extra={'category': 'WS'})
+
+outbound = OutboundWriter(Config.SEND_GLOBAL_RATE_PER_SECOND, Config.SEND_GLOBAL_BURST, Config.SEND_ROOM_MIN_INTERVAL_SECONDS, Config.SEND_QUEUE_MAX)
+
 # ========================================================================================
 # === DATABASE & BACKGROUND TASKS ========================================================
 # ========================================================================================
+# --- Local state tier --- SQLite (WAL) serves all roam reads; Supabase is an async replica, only read to seed an empty store.
+class LocalStore:
+    # The file is opened on first use (start_bot_logic), so web workers that only talk to a
+    # supervisor never create it.
+    def __init__(self, path):
+        self.path, self.lock, self.open_lock, self.db = path, threading.Lock(), threading.Lock(), None
+        self.seed_attempted = False
+
+    @property
+    def conn(self): return self.db or self.open()
+
+    def open(self):
+        with self.open_lock:
+            if self.db is None:
+                db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                db.execute("PRAGMA journal_mode=WAL"); db.execute("PRAGMA synchronous=NORMAL")
+                db.execute("CREATE TABLE IF NOT EXISTS visited_rooms (room_name TEXT PRIMARY KEY, visited_at REAL NOT NULL)")
+                db.execute("CREATE TABLE IF NOT EXISTS roam_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, room_name TEXT NOT NULL, prize_won TEXT, roam_time REAL NOT NULL)")
+                db.execute("CREATE INDEX IF NOT EXISTS roam_logs_time ON roam_logs (roam_time)")
+                db.execute("CREATE TABLE IF NOT EXISTS bot_kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                self.db = db
+                logging.info(f"[DB] Opened local store at {self.path}.")
+        return self.db
+
+    def get_value(self, key):
+        with self.lock: row = self.conn.execute("SELECT value FROM bot_kv WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_value(self, key, value):
+        with self.lock: self.conn.execute("INSERT INTO bot_kv (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    def load_visited(self):
+        with self.lock: return dict(self.conn.execute("SELECT room_name, visited_at FROM visited_rooms").fetchall())
+
+    def upsert_visited(self, rows):
+        with self.lock:
+            self.conn.executemany("INSERT INTO visited_rooms (room_name, visited_at) VALUES (?, ?) "
+                                  "ON CONFLICT(room_name) DO UPDATE SET visited_at = MAX(visited_at, excluded.visited_at)", rows)
+
+    def delete_visited(self, room_names):
+        with self.lock: self.conn.executemany("DELETE FROM visited_rooms WHERE room_name = ?", [(r,) for r in room_names])
+
+    def insert_roam_logs(self, rows):
+        with self.lock: self.conn.executemany("INSERT INTO roam_logs (room_name, prize_won, roam_time) VALUES (?, ?, ?)", rows)
+
+    def record_roam(self, room_name, prize_won, roam_ts):
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("INSERT INTO visited_rooms (room_name, visited_at) VALUES (?, ?) "
+                              "ON CONFLICT(room_name) DO UPDATE SET visited_at = excluded.visited_at", (room_name, roam_ts))
+            self.conn.execute("INSERT INTO roam_logs (room_name, prize_won, roam_time) VALUES (?, ?, ?)", (room_name, prize_won, roam_ts))
+
+    def recent_roam_logs(self, limit):
+        with self.lock:
+            return self.conn.execute("SELECT room_name, prize_won, roam_time FROM roam_logs ORDER BY roam_time DESC LIMIT ?", (limit,)).fetchall()
+
+    def roam_log_summary(self):
+        with self.lock:
+            return self.conn.execute("SELECT room_name, COUNT(*), SUM(prize_won != 'nothing'), MAX(CASE WHEN prize_won != 'nothing' THEN roam_time END) "
+                                     "FROM roam_logs GROUP BY room_name").fetchall()
+
+    def delete_roam_logs_before(self, cutoff_ts):
+        with self.lock: return self.conn.execute("DELETE FROM roam_logs WHERE roam_time < ?", (cutoff_ts,)).rowcount
+
+local_store = LocalStore(Config.LOCAL_DB_PATH)
+
+def seed_local_store_from_supabase():
+    local_store.seed_attempted = True
+    try:
+        logging.info("[DB] Local store is empty. Seeding it from Supabase...")
+        visited = timed_supabase_call('seed_visited', supabase.table('visited_rooms').select("room_name, visited_at")).data or []
+        logs = timed_supabase_call('seed_logs', supabase.table('roam_logs').select("room_name, prize_won, roam_time").order("roam_time", desc=True).limit(Config.ROAM_LOG_SEED_LIMIT)).data or []
+    except Exception as e:
+        logging.error(f"[DB] Error seeding local store from Supabase: {e}"); return {}
+    visited_rows = [(item['room_name'], datetime.fromisoformat(item['visited_at']).timestamp()) for item in visited]
+    local_store.upsert_visited(visited_rows)
+    local_store.insert_roam_logs([(log['room_name'], log['prize_won'], datetime.fromisoformat(log['roam_time']).timestamp()) for log in reversed(logs)])
+    logging.info(f"[DB] Seeded local store with {len(visited_rows)} visited rooms and {len(logs)} roam logs.")
+    return dict(visited_rows)
+
 def load_visited_rooms_from_db():
-    if not supabase: return
-    with bot_state.roam_lock:
-        try:
-            logging.info("[DB] Loading visited rooms from Supabase...")
-            response = supabase.table('visited_rooms').select("room_name, visited_at").execute()
-            if response.data:
-                now = time.time()
-                for item in response.data:
-                    room_name = item['room_name']
-                    visited_at_dt = datetime.fromisoformat(item['visited_at'])
-                    visited_at_ts = visited_at_dt.timestamp()
-
-                    if now - visited_at_ts > Config.ROAMER_VISITED_EXPIRY_SECONDS:
-                        supabase.table('visited_rooms').delete().eq('room_name', room_name).execute()
-                    else:
-                        bot_state.visited_roam_rooms[room_name] = visited_at_ts
-                logging.info(f"[DB] Loaded {len(bot_state.visited_roam_rooms)} non-expired rooms into memory.")
-        except Exception as e:
-            logging.error(f"[DB] Error loading visited rooms: {e}")
+    visited = local_store.load_visited()
+    if not visited and supabase and not local_store.seed_attempted: visited = seed_local_store_from_supabase()
+    now = time.time()
+    expired = [r for r, ts in visited.items() if now - ts > Config.ROAMER_VISITED_EXPIRY_SECONDS]
+    if not roam_selector.seeded: roam_selector.seed(local_store.roam_log_summary())
+    if not roam_log.seeded: roam_log.seed(local_store.recent_roam_logs(Config.ROAM_LOG_BUFFER_SIZE))
+    room_directory.load_visited((room_name, ts) for room_name, ts in visited.items() if room_name not in expired)
+    loaded = room_directory.snapshot()['visited']
+    if expired: local_store.delete_visited(expired); roam_writer.delete_visited(expired)
+    logging.info(f"[DB] Loaded {loaded} non-expired rooms into memory ({len(expired)} expired).")
+
+# --- Write-behind buffer --- Roam mutations are batched to Supabase by one thread; failed batches retry with backoff.
+class RoamWriteBehind:
+    def __init__(self, batch_size, interval):
+        self.batch_size, self.interval = batch_size, interval
+        self.cond, self.flush_lock = threading.Condition(), threading.Lock()
+        self.upserts, self.deletes, self.log_rows = {}, set(), []
+        self.oldest_pending_at, self.thread = None, None
+        self.stats = {'flushes': 0, 'failures': 0, 'rows_written': 0, 'dropped_logs': 0}
+
+    def start(self):
+        if not supabase: return
+        with self.cond:
+            if not self.thread or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True); self.thread.start()
+
+    def record_roam(self, room_name, prize_won, roam_ts):
+        if not supabase: return
+        roam_time_iso = datetime.fromtimestamp(roam_ts, tz=timezone.utc).isoformat()
+        with self.cond:
+            self.deletes.discard(room_name); self.upserts[room_name] = roam_time_iso
+            self.log_rows.append({'room_name': room_name, 'prize_won': prize_won, 'roam_time': roam_time_iso})
+            self._pending_changed_locked()
+
+    def delete_visited(self, room_names):
+        if not supabase or not room_names: return
+        with self.cond:
+            for room_name in room_names: self.upserts.pop(room_name, None); self.deletes.add(room_name)
+            self._pending_changed_locked()
+
+    def pending_locked(self): return len(self.upserts) + len(self.deletes) + len(self.log_rows)
+
+    def snapshot(self):
+        with self.cond: return dict(self.stats, pending=self.pending_locked())
+
+    def flush(self):
+        with self.flush_lock:
+            with self.cond:
+                upserts, deletes, log_rows = self.upserts, self.deletes, self.log_rows
+                self.upserts, self.deletes, self.log_rows, self.oldest_pending_at = {}, set(), [], None
+            if not (upserts or deletes or log_rows) or not supabase: return True
+            try:
+                if deletes: timed_supabase_call('delete_visited', supabase.table('visited_rooms').delete().in_('room_name', sorted(deletes)))
+                if upserts: timed_supabase_call('upsert_visited', supabase.table('visited_rooms').upsert([{'room_name': r, 'visited_at': ts} for r, ts in upserts.items()]))
+                if log_rows: timed_supabase_call('insert_logs', supabase.table('roam_logs').insert(log_rows))
+            except Exception as e:
+                logging.error(f"[DB] Write-behind flush failed ({len(upserts)} upserts, {len(deletes)} deletes, {len(log_rows)} logs): {e}")
+                with self.cond:
+                    self.stats['failures'] += 1
+                    for room_name in deletes:
+                        if room_name not in self.upserts: self.deletes.add(room_name)
+                    for room_name, ts in upserts.items():
+                        if room_name not in self.deletes: self.upserts.setdefault(room_name, ts)
+                    self.log_rows[:0] = log_rows
+                    self._pending_changed_locked(notify=False)
+                return False
+            with self.cond:
+                self.stats['flushes'] += 1; self.stats['rows_written'] += len(upserts) + len(deletes) + len(log_rows)
+            return True
+
+    def _pending_changed_locked(self, notify=True):
+        overflow = len(self.log_rows) - Config.DB_MAX_PENDING_LOGS
+        if overflow > 0: del self.log_rows[:overflow]; self.stats['dropped_logs'] += overflow
+        if self.oldest_pending_at is None and self.pending_locked(): self.oldest_pending_at = time.monotonic()
+        if notify and self.pending_locked() >= self.batch_size: self.cond.notify()
+
+    def _run(self):
+        retry_delay = 0
+        while True:
+            with self.cond:
+                while True:
+                    pending = self.pending_locked()
+                    if pending >= self.batch_size: break
+                    if pending and time.monotonic() - self.oldest_pending_at >= self.interval: break
+                    self.cond.wait((self.oldest_pending_at + self.interval - time.monotonic()) if pending else None)
+            if self.flush(): retry_delay = 0
+            else:
+                retry_delay = min(max(retry_delay * 2, Config.DB_RETRY_INITIAL_SECONDS), Config.DB_RETRY_MAX_SECONDS)
+                logging.warning(f"[DB] Retrying write-behind flush in {retry_delay}s.")
+                time.sleep(retry_delay)
+
+roam_writer = RoamWriteBehind(Config.DB_FLUSH_BATCH_SIZE, Config.DB_FLUSH_INTERVAL_SECONDS)
 
 def cleanup_old_logs():
     logging.info("[DB] Log cleanup thread started.")
     while not bot_state.stop_bot_event.is_set():
         try:
+            local_store.delete_roam_logs_before(time.time() - Config.ROAMER_VISITED_EXPIRY_SECONDS)
             if supabase:
                 expire_time = datetime.now(timezone.utc) - timedelta(seconds=Config.ROAMER_VISITED_EXPIRY_SECONDS)
-                supabase.table('roam_logs').delete().lt('roam_time', expire_time.isoformat()).execute()
+                timed_supabase_call('cleanup_logs', supabase.table('roam_logs').delete().lt('roam_time', expire_time.isoformat()))
             bot_state.stop_bot_event.wait(Config.LOG_CLEANUP_INTERVAL_SECONDS)
         except Exception as e:
             logging.error(f"[DB] Error in log cleanup thread: {e}", exc_info=True)
@@ -146,6 +969,217 @@ def cleanup_old_logs():
 # ========================================================================================
 # === SPIN ROAMER 2.0 LOGIC ==============================================================
 # ========================================================================================
+# --- Room directory --- Every listed or visited room. Available rooms sit in an indexed list for O(1) picks;
+# listing and visit deadlines share one min-heap.
+class RoomEntry:
+    __slots__ = ('name', 'user_count', 'seen_at', 'visited_at', 'in_flight', 'queued')
+    def __init__(self, name):
+        self.name, self.user_count, self.seen_at, self.visited_at, self.in_flight = name, 0, None, None, False
+        self.queued = set() # deadline kinds that currently have a heap item
+
+class RoomDirectory:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries, self.heap = {}, []
+        self.available, self.available_pos = [], {}
+        self.excluded, self.visited_count = set(), 0
+        self.stats = {'listed': 0, 'unlisted': 0, 'visits_expired': 0}
+
+    def set_excluded(self, room_names):
+        with self.lock:
+            self.excluded = {name.strip().lower() for name in room_names if name.strip()}
+            for key in list(self.entries): self._reindex_locked(key)
+
+    def observe(self, rooms):
+        now = time.time()
+        with self.lock:
+            for name, user_count in rooms:
+                key = name.lower()
+                if not (entry := self.entries.get(key)): entry = self.entries[key] = RoomEntry(name); self.stats['listed'] += 1
+                entry.name, entry.user_count, entry.seen_at = name, user_count, now
+                self._schedule_locked(key, 'seen', now + Config.ROOM_DIRECTORY_TTL_SECONDS)
+                self._reindex_locked(key)
+
+    def load_visited(self, rows):
+        with self.lock:
+            for name, visited_at in rows: self._mark_visited_locked(name, visited_at, keep_latest=True)
+
+    def begin_roam(self, name):
+        with self.lock:
+            key = name.lower()
+            if not (entry := self.entries.get(key)): entry = self.entries[key] = RoomEntry(name)
+            if entry.in_flight: return False
+            entry.in_flight = True; self._reindex_locked(key)
+            return True
+
+    def end_roam(self, name, visited_at=None):
+        with self.lock:
+            if entry := self.entries.get(name.lower()): entry.in_flight = False
+            if visited_at is not None: self._mark_visited_locked(name, visited_at)
+            else: self._reindex_locked(name.lower()); self._drop_if_idle_locked(name.lower())
+
+    def is_in_flight(self, name):
+        with self.lock: return bool((entry := self.entries.get(name.lower())) and entry.in_flight)
+
+    def expire(self):
+        # Returns the names whose visits lapsed, so the caller can delete them from storage.
+        now, expired = time.time(), []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, kind, key = heapq.heappop(self.heap)
+                if not (entry := self.entries.get(key)): continue
+                entry.queued.discard(kind)
+                if kind == 'visit' and entry.visited_at is not None:
+                    if (deadline := entry.visited_at + Config.ROAMER_VISITED_EXPIRY_SECONDS) > now: self._schedule_locked(key, kind, deadline); continue
+                    entry.visited_at = None; self.visited_count -= 1; self.stats['visits_expired'] += 1; expired.append(entry.name)
+                elif kind == 'seen' and entry.seen_at is not None:
+                    if (deadline := entry.seen_at + Config.ROOM_DIRECTORY_TTL_SECONDS) > now: self._schedule_locked(key, kind, deadline); continue
+                    entry.seen_at = None; self.stats['unlisted'] += 1
+                self._reindex_locked(key); self._drop_if_idle_locked(key)
+        return expired
+
+    def pick(self):
+        with self.lock: return self.entries[random.choice(self.available)].name if self.available else None
+
+    def sample(self, k):
+        with self.lock: return [self.entries[key].name for key in random.sample(self.available, min(k, len(self.available)))]
+
+    def available_among(self, keys):
+        with self.lock: return [self.entries[key].name for key in keys if key in self.available_pos]
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, rooms=len(self.entries), available=len(self.available), visited=self.visited_count,
+                        in_flight=sum(1 for e in self.entries.values() if e.in_flight), heap=len(self.heap))
+
+    def _mark_visited_locked(self, name, visited_at, keep_latest=False):
+        key = name.lower()
+        if not (entry := self.entries.get(key)): entry = self.entries[key] = RoomEntry(name)
+        if entry.visited_at is None: self.visited_count += 1
+        elif keep_latest: visited_at = max(visited_at, entry.visited_at)
+        entry.visited_at = visited_at
+        self._schedule_locked(key, 'visit', visited_at + Config.ROAMER_VISITED_EXPIRY_SECONDS)
+        self._reindex_locked(key)
+
+    def _schedule_locked(self, key, kind, deadline):
+        entry = self.entries[key]
+        if kind not in entry.queued: entry.queued.add(kind); heapq.heappush(self.heap, (deadline, kind, key))
+
+    def _reindex_locked(self, key):
+        entry = self.entries.get(key)
+        want = bool(entry and entry.seen_at is not None and entry.user_count > 0 and entry.visited_at is None
+                    and not entry.in_flight and key not in self.excluded)
+        if want and key not in self.available_pos:
+            self.available_pos[key] = len(self.available); self.available.append(key)
+        elif not want and (pos := self.available_pos.pop(key, None)) is not None:
+            last = self.available.pop()
+            if last != key: self.available[pos] = last; self.available_pos[last] = pos
+
+    def _drop_if_idle_locked(self, key):
+        entry = self.entries.get(key)
+        if entry and entry.seen_at is None and entry.visited_at is None and not entry.in_flight:
+            del self.entries[key] # any heap items for it are skipped when they surface
+
+room_directory = RoomDirectory()
+
+# --- Target selection --- Per-room yield stats; ROAMER_SELECTION=bandit Thompson-samples the best-known rooms
+# plus a few random explorers by Beta(prizes + recency + 1, misses + 1).
+class RoomYield:
+    __slots__ = ('roams', 'prizes', 'join_failures', 'last_prize', 'last_prize_at')
+    def __init__(self):
+        self.roams = self.prizes = self.join_failures = 0
+        self.last_prize, self.last_prize_at = None, None
+
+    def mean(self): return (self.prizes + 1) / (self.roams + self.join_failures + 2)
+
+class RoamSelector:
+    def __init__(self):
+        self.lock, self.rooms, self.seeded = threading.Lock(), {}, False
+        self.index = [] # keys of the top ROAMER_SELECTION_INDEX_SIZE rooms with a prize, by posterior mean
+        self.stats = {'picks': 0, 'roams': 0, 'prizes': 0}
+
+    def _reindex_locked(self):
+        self.index = [key for key, _ in heapq.nlargest(Config.ROAMER_SELECTION_INDEX_SIZE, ((k, y) for k, y in self.rooms.items() if y.prizes), key=lambda kv: kv[1].mean())]
+
+    def seed(self, rows):
+        with self.lock:
+            self.seeded = True
+            for room_name, roams, prizes, last_prize_at in rows:
+                y = self.rooms.setdefault(room_name.lower(), RoomYield())
+                y.roams += roams; y.prizes += prizes or 0
+                if last_prize_at and (y.last_prize_at or 0) < last_prize_at: y.last_prize_at = last_prize_at
+            self._reindex_locked()
+        logging.info(f"[Roamer] Seeded yield stats for {len(self.rooms)} rooms from roam_logs.")
+
+    def record(self, room_name, prize_won):
+        with self.lock:
+            y = self.rooms.setdefault(room_name.lower(), RoomYield())
+            y.roams += 1; self.stats['roams'] += 1
+            if prize_won != "nothing": y.prizes += 1; y.last_prize, y.last_prize_at = prize_won, time.time(); self.stats['prizes'] += 1
+            self._reindex_locked()
+
+    def record_join_failure(self, room_name):
+        with self.lock: self.rooms.setdefault(room_name.lower(), RoomYield()).join_failures += 1; self._reindex_locked()
+
+    def score(self, room_name, now=None):
+        y = self.rooms.get(room_name.lower())
+        if not y: return random.betavariate(1, 1)
+        recency = 0.5 ** ((((now or time.time()) - y.last_prize_at) / 86400) / Config.ROAMER_PRIZE_HALF_LIFE_DAYS) if y.last_prize_at else 0.0
+        return random.betavariate(y.prizes + recency + 1, y.roams - y.prizes + y.join_failures + 1)
+
+    def choose(self):
+        if Config.ROAMER_SELECTION != "bandit": return room_directory.pick()
+        with self.lock: index = list(self.index)
+        candidates = dict.fromkeys(room_directory.available_among(index) + room_directory.sample(Config.ROAMER_SELECTION_EXPLORERS))
+        if not candidates: return None
+        with self.lock:
+            self.stats['picks'] += 1; now = time.time()
+            return max(candidates, key=lambda name: self.score(name, now))
+
+    def totals(self, top):
+        with self.lock:
+            return [(key, y.prizes, y.roams, y.last_prize) for key, y in sorted(self.rooms.items(), key=lambda kv: (-kv[1].prizes, -kv[1].roams))[:top]]
+
+    def snapshot(self, top=3):
+        with self.lock:
+            roams = sum(y.roams for y in self.rooms.values()); prizes = sum(y.prizes for y in self.rooms.values())
+            best = sorted(((y.prizes / y.roams, y.prizes, y.roams, key) for key, y in self.rooms.items() if y.roams), reverse=True)[:top]
+            return dict(self.stats, rooms=len(self.rooms), prize_rate=prizes / roams if roams else 0.0, best=[(key, p, r) for _, p, r, key in best])
+
+roam_selector = RoamSelector()
+
+# --- Roam log --- Recent results in a ring buffer plus hourly buckets for the last 24h, seeded from the local store.
+class RoamLog:
+    def __init__(self, size):
+        self.lock, self.seeded = threading.Lock(), False
+        self.entries, self.hourly = deque(maxlen=size), deque(maxlen=24) # hourly: [hour_start, roams, prizes]
+
+    def seed(self, rows):
+        self.seeded = True
+        for room_name, prize_won, roam_ts in reversed(rows): self.record(room_name, prize_won, roam_ts)
+
+    def record(self, room_name, prize_won, roam_ts):
+        hour, won = int(roam_ts // 3600) * 3600, prize_won != "nothing"
+        with self.lock:
+            self.entries.append((room_name, prize_won, roam_ts))
+            for bucket in reversed(self.hourly):
+                if bucket[0] == hour: bucket[1] += 1; bucket[2] += won; return
+                if bucket[0] < hour: break
+            if not self.hourly or self.hourly[-1][0] < hour: self.hourly.append([hour, 1, int(won)])
+
+    def recent(self, limit):
+        with self.lock: return list(self.entries)[-limit:][::-1]
+
+    def snapshot(self, top=5):
+        since = time.time() - 24 * 3600
+        with self.lock: hourly = [tuple(b) for b in self.hourly if b[0] + 3600 > since]
+        roams, prizes = sum(b[1] for b in hourly), sum(b[2] for b in hourly)
+        hours = max(1.0, (time.time() - hourly[0][0]) / 3600) if hourly else 1.0
+        return {'roams_24h': roams, 'prizes_24h': prizes, 'win_rate': prizes / roams if roams else 0.0,
+                'prizes_per_hour': prizes / hours, 'hourly': hourly, 'top_rooms': roam_selector.totals(top)}
+
+roam_log = RoamLog(Config.ROAM_LOG_BUFFER_SIZE)
+
 def extract_prize(text, bot_username):
     text_lower = text.lower()
     bot_username_lower = bot_username.lower()
@@ -159,136 +1193,477 @@ def extract_prize(text, bot_username):
     return None
 
 # --- STABILITY FIX --- Entire function is now wrapped in a try...except block
-def perform_roam_action(target_room):
+# Runs on the engine's event loop; several roams may be in flight, each listening on its own room ID.
+async def perform_roam_action(target_room):
+    if not room_directory.begin_roam(target_room):
+        logging.warning(f"[Roamer] A roam to '{target_room}' is already in progress. Skipping."); return
+    with bot_state.roam_lock: bot_state.roam_launches.append(time.time())
+    visited_at, join_future = None, None
     try:
         logging.info(f"[Roamer] Starting roam action for: '{target_room}'")
-        join_room(target_room, source="roamer")
-        
-        roam_room_id = None
-        for _ in range(10): # Wait up to 10 seconds for room ID
-            roam_room_id = bot_state.room_name_to_id.get(target_room.lower())
-            if roam_room_id: break
-            time.sleep(1)
-        
-        if not roam_room_id:
-            logging.error(f"[Roamer Action] Failed to get room ID for '{target_room}'. Aborting this roam.")
+        join_future = join_room(target_room, source="roamer")
+        try: roam_room_id = await asyncio.shield(asyncio.wrap_future(join_future)) # shielded: a cancelled roam still learns the room ID to leave
+        except JoinError as e:
+            roam_selector.record_join_failure(target_room)
+            logging.error(f"[Roamer Action] Failed to join '{target_room}': {e}. Aborting this roam.")
             return
 
-        bot_state.listening_for_prize_in_room = roam_room_id
-        bot_state.last_prize_won, bot_state.prize_found_event = None, threading.Event()
-        
-        reply_to_room(roam_room_id, Config.SPIN_COMMAND)
-        got_prize = bot_state.prize_found_event.wait(timeout=Config.ROAMER_LISTEN_SECONDS)
-        prize_won = bot_state.last_prize_won if got_prize else "nothing"
-
-        bot_state.listening_for_prize_in_room = None
-        bot_state.prize_found_event = None
+        prize_future, room = concurrent.futures.Future(), bot_state.rooms.get(roam_room_id)
+        if room: room.prize_future = prize_future
+        try:
+            reply_to_room(roam_room_id, Config.SPIN_COMMAND, SEND_PRIORITY_CONTROL)
+            prize_won = await asyncio.wait_for(asyncio.wrap_future(prize_future), timeout=Config.ROAMER_LISTEN_SECONDS)
+        except asyncio.TimeoutError:
+            prize_won = "nothing"
+        finally:
+            if room and room.prize_future is prize_future: room.prize_future = None
 
-        time.sleep(Config.ROAMER_PAUSE_SECONDS)
-        leave_room(roam_room_id)
-        
-        current_time_ts = time.time()
-        current_time_iso = datetime.fromtimestamp(current_time_ts, tz=timezone.utc).isoformat()
-        
-        with bot_state.roam_lock:
-            bot_state.visited_roam_rooms[target_room] = current_time_ts
-            if supabase:
-                supabase.table('visited_rooms').upsert({'room_name': target_room, 'visited_at': current_time_iso}).execute()
-                supabase.table('roam_logs').insert({'room_name': target_room, 'prize_won': prize_won, 'roam_time': current_time_iso}).execute()
+        await asyncio.sleep(Config.ROAMER_PAUSE_SECONDS)
+        visited_at = current_time_ts = time.time()
+        roam_selector.record(target_room, prize_won)
+        roam_log.record(target_room, prize_won, current_time_ts)
+        local_store.record_roam(target_room, prize_won, current_time_ts)
+        roam_writer.record_roam(target_room, prize_won, current_time_ts)
         
         logging.info(f"[Roamer Action] Roam to '{target_room}' complete. Prize: {prize_won}.")
 
     except Exception as e:
         logging.error(f"[Roamer Action] CRITICAL ERROR during roam to '{target_room}': {e}", exc_info=True)
         # This will now log the error without crashing the bot
+    finally:
+        # Also runs when !roamer off or a bot stop cancels the task; a roam cancelled mid-join
+        # stays in flight until the join resolves so the room is left and never warm-saved.
+        def finish(future):
+            if future and not future.cancelled() and future.exception() is None: leave_room(future.result())
+            room_directory.end_roam(target_room, visited_at)
+        if join_future and not join_future.done(): join_future.add_done_callback(finish)
+        else: finish(join_future)
 
-def roamer_logic():
-    logging.info("[Roamer] Spin Roamer 2.0 thread started.")
-    while not bot_state.stop_roamer_event.is_set():
-        try:
-            interval = random.randint(Config.ROAMER_INTERVAL_MIN_SECONDS, Config.ROAMER_INTERVAL_MAX_SECONDS)
-            logging.info(f"[Roamer] Next roam scheduled in {interval/60:.1f} minutes.")
-            bot_state.stop_roamer_event.wait(interval)
-            if bot_state.stop_roamer_event.is_set(): break
-
-            target_room = None
-            with bot_state.roam_lock:
-                now = time.time()
-                expired_rooms = [r for r, ts in bot_state.visited_roam_rooms.items() if now - ts > Config.ROAMER_VISITED_EXPIRY_SECONDS]
-                for room_name in expired_rooms:
-                    del bot_state.visited_roam_rooms[room_name]
-                    if supabase:
-                        supabase.table('visited_rooms').delete().eq('room_name', room_name).execute()
-                
-                startup_rooms = {name.strip().lower() for name in Config.ROOMS_TO_JOIN.split(',')}
-                available = list(bot_state.roamable_rooms - set(bot_state.visited_roam_rooms.keys()) - startup_rooms)
-                if not available:
-                    logging.warning("[Roamer] No new rooms to roam. Waiting for next cycle.")
-                    continue
-                target_room = random.choice(available)
+def roam_budget():
+    # (launches left in the rolling hour, seconds until one frees up when none are left)
+    with bot_state.roam_lock:
+        now, launches = time.time(), bot_state.roam_launches
+        while launches and now - launches[0] >= 3600: launches.popleft()
+        left = Config.ROAMER_HOURLY_BUDGET - len(launches)
+        return left, 0 if left > 0 else launches[0] + 3600 - now
 
-            if target_room:
-                perform_roam_action(target_room)
+def pick_roam_target():
+    if expired_rooms := room_directory.expire(): local_store.delete_visited(expired_rooms); roam_writer.delete_visited(expired_rooms)
+    return roam_selector.choose()
 
-        except Exception as e:
-            logging.error(f"[Roamer] Error in main roamer loop: {e}", exc_info=True)
-            time.sleep(60)
-    logging.info("[Roamer] Spin Roamer thread stopped.")
+# Every ROAMER_INTERVAL_* seconds, fills each free ROAMER_CONCURRENCY slot with a roam, within
+# ROAMER_HOURLY_BUDGET launches (including !roamnow) in any rolling hour.
+async def roamer_logic():
+    logging.info(f"[Roamer] Spin Roamer 2.0 task started (concurrency {Config.ROAMER_CONCURRENCY}, budget {Config.ROAMER_HOURLY_BUDGET}/h).")
+    slots, tasks = asyncio.Semaphore(max(1, Config.ROAMER_CONCURRENCY)), set()
+    def on_roam_done(task): tasks.discard(task); slots.release()
+    try:
+        while not bot_state.stop_roamer_event.is_set():
+            try:
+                interval = random.randint(Config.ROAMER_INTERVAL_MIN_SECONDS, Config.ROAMER_INTERVAL_MAX_SECONDS)
+                logging.info(f"[Roamer] Next roam scheduled in {interval/60:.1f} minutes.")
+                await asyncio.sleep(interval)
+                if bot_state.stop_roamer_event.is_set(): break
+                budget_left, wait = roam_budget()
+                if wait:
+                    logging.info(f"[Roamer] Hourly budget of {Config.ROAMER_HOURLY_BUDGET} roams used. Resuming in {wait/60:.1f} minutes.")
+                    await asyncio.sleep(wait); continue
+
+                launched = set()
+                while budget_left > 0 and not slots.locked():
+                    if not (target_room := pick_roam_target()) or target_room in launched: break
+                    await slots.acquire()
+                    task = asyncio.ensure_future(perform_roam_action(target_room))
+                    tasks.add(task); task.add_done_callback(on_roam_done)
+                    launched.add(target_room); budget_left -= 1
+                    await asyncio.sleep(0) # let the roam mark its room in flight before the next pick
+                if launched: logging.info(f"[Roamer] Launched {len(launched)} roams ({len(tasks)}/{Config.ROAMER_CONCURRENCY} in flight).")
+                elif slots.locked(): logging.info("[Roamer] All roam slots are busy. Waiting for next cycle.")
+                else: logging.warning("[Roamer] No new rooms to roam. Waiting for next cycle.")
+
+            except Exception as e:
+                logging.error(f"[Roamer] Error in main roamer loop: {e}", exc_info=True)
+                await asyncio.sleep(60)
+    finally:
+        for task in list(tasks): task.cancel()
+        logging.info("[Roamer] Spin Roamer task stopped.")
 
 # ========================================================================================
 # === CYCLE MODE LOGIC ===================================================================
 # ========================================================================================
-def schedule_next_break(room_id):
-    if room_id not in bot_state.cycle_timers or bot_state.stop_bot_event.is_set(): return
+# Timers carry the RoomState itself: a room that was torn down has cycle_phase None, so a
+# late timer for it is a no-op without another registry lookup.
+def schedule_next_break(room):
+    if room.cycle_phase is None or bot_state.stop_bot_event.is_set(): return
     start_command = random.choice(Config.CYCLE_START_COMMANDS)
-    reply_to_room(room_id, start_command)
-    logging.info(f"[Cycle] Break ended. Sending START command '{start_command}' to room '{bot_state.room_id_to_name.get(room_id)}'.")
+    reply_to_room(room.room_id, start_command, SEND_PRIORITY_CONTROL, coalesce_key=('cycle', room.room_id))
+    logging.info(f"[Cycle] Break ended. Sending START command '{start_command}' to room '{room.name}'.")
     work_duration = random.randint(Config.CYCLE_WORK_MIN_SECONDS, Config.CYCLE_WORK_MAX_SECONDS)
-    bot_state.work_end_times[room_id] = time.time() + work_duration
-    bot_state.break_end_times.pop(room_id, None)
-    logging.info(f"[Cycle] Room '{bot_state.room_id_to_name.get(room_id)}': Working for {work_duration/60:.1f} minutes.")
-    timer = threading.Timer(work_duration, take_a_break, args=[room_id])
-    bot_state.cycle_timers[room_id] = timer
-    timer.start()
-def take_a_break(room_id):
-    if room_id not in bot_state.cycle_timers or bot_state.stop_bot_event.is_set(): return
+    room.cycle_phase = 'work'
+    logging.info(f"[Cycle] Room '{room.name}': Working for {work_duration/60:.1f} minutes.")
+    room.cycle_timer = bot_state.engine.call_later(work_duration, take_a_break, room, key=('cycle', room.room_id))
+def take_a_break(room):
+    if room.cycle_phase is None or bot_state.stop_bot_event.is_set(): return
     stop_command = random.choice(Config.CYCLE_STOP_COMMANDS)
-    reply_to_room(room_id, stop_command)
-    logging.info(f"[Cycle] Starting break. Sending STOP command '{stop_command}' to room '{bot_state.room_id_to_name.get(room_id)}'.")
+    reply_to_room(room.room_id, stop_command, SEND_PRIORITY_CONTROL, coalesce_key=('cycle', room.room_id))
+    logging.info(f"[Cycle] Starting break. Sending STOP command '{stop_command}' to room '{room.name}'.")
     break_duration = random.randint(Config.CYCLE_BREAK_MIN_SECONDS, Config.CYCLE_BREAK_MAX_SECONDS)
-    bot_state.break_end_times[room_id] = time.time() + break_duration
-    bot_state.work_end_times.pop(room_id, None)
-    logging.info(f"[Cycle] Room '{bot_state.room_id_to_name.get(room_id)}': On break for {break_duration:.1f} seconds.")
-    timer = threading.Timer(break_duration, schedule_next_break, args=[room_id])
-    bot_state.cycle_timers[room_id] = timer
-    timer.start()
+    room.cycle_phase = 'break'
+    logging.info(f"[Cycle] Room '{room.name}': On break for {break_duration:.1f} seconds.")
+    room.cycle_timer = bot_state.engine.call_later(break_duration, schedule_next_break, room, key=('cycle', room.room_id))
 def start_cycle_for_room(room_id, show_message=True):
-    if room_id in bot_state.cycle_timers: return
-    bot_state.cycle_timers[room_id] = None
-    schedule_next_break(room_id)
+    if not (room := bot_state.rooms.get(room_id)) or room.cycle_phase is not None: return
+    room.cycle_phase = 'work'
+    schedule_next_break(room)
     if show_message: reply_to_room(room_id, "✅ Cycle mode activated.")
-def stop_cycle_for_room(room_id, show_message=True):
-    if room_id in bot_state.cycle_timers:
-        timer = bot_state.cycle_timers.pop(room_id)
-        if timer: timer.cancel()
-    bot_state.break_end_times.pop(room_id, None)
-    bot_state.work_end_times.pop(room_id, None)
+def stop_cycle_for_room(room_id, show_message=True, immediate=False):
+    # immediate: bypass the outbound writer, whose queue is dropped right after when the bot stops
+    if room := bot_state.rooms.get(room_id): room.stop_cycle()
     start_command = random.choice(Config.CYCLE_START_COMMANDS)
-    reply_to_room(room_id, start_command)
-    if show_message: logging.info(f"[Cycle] Cycle mode stopped for room '{bot_state.room_id_to_name.get(room_id)}'.")
+    if immediate: send_ws_message_now({"handler": "chatroommessage", "type": "text", "roomid": room_id, "text": start_command})
+    else: reply_to_room(room_id, start_command, SEND_PRIORITY_CONTROL, coalesce_key=('cycle', room_id))
+    if show_message: logging.info(f"[Cycle] Cycle mode stopped for room '{room.name if room else room_id}'.")
+
+# ========================================================================================
+# === PROFILER ===========================================================================
+# ========================================================================================
+# Samples every thread's stack via sys._current_frames(); frames blocked in stdlib waits count as idle.
+# Reports are saved under PROFILE_DIR for download from the panel.
+PROFILE_IDLE_FUNCTIONS = {os.path.join(os.path.dirname(threading.__file__), module): frozenset(names) for module, names in { # stdlib file -> blocking calls
+    'threading.py': ('wait', 'wait_for', '_wait_for_tstate_lock'), 'queue.py': ('get',), 'selectors.py': ('select',),
+    'socket.py': ('accept', 'readinto'), 'ssl.py': ('read', 'recv', 'recv_into')}.items()}
+PROFILE_NAME_RE = re.compile(r'profile-\d{8}-\d{6}\.txt')
+
+def format_code(code, lineno=None):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{lineno or code.co_firstlineno})"
+
+def process_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): return int(line.split()[1]) / 1024
+    except OSError: pass
+    return None
+
+class SamplingProfiler:
+    def __init__(self):
+        self.lock, self.running = threading.Lock(), None # (started_at, seconds) while a window is open
+
+    def run(self, seconds, interval):
+        with self.lock:
+            if self.running: raise RuntimeError(f"a {self.running[1]}s profile started {time.time() - self.running[0]:.0f}s ago is still running")
+            self.running = (time.time(), seconds)
+        try: return self._sample(seconds, interval)
+        finally:
+            with self.lock: self.running = None
+
+    def _sample(self, seconds, interval):
+        own, sweeps, idle = threading.get_ident(), 0, 0
+        self_counts, total_counts, thread_samples, thread_busy = Counter(), Counter(), Counter(), Counter()
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        deadline = started + seconds
+        while (now := time.perf_counter()) < deadline:
+            sweeps += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own: continue
+                thread_samples[ident] += 1
+                if frame.f_code.co_name in PROFILE_IDLE_FUNCTIONS.get(frame.f_code.co_filename, ()): idle += 1; continue
+                thread_busy[ident] += 1; self_counts[frame.f_code] += 1
+                seen, depth = set(), 0
+                while frame is not None and depth < 64:
+                    seen.add(frame.f_code); frame = frame.f_back; depth += 1
+                total_counts.update(seen)
+            time.sleep(max(0.0, interval - (time.perf_counter() - now)))
+        elapsed = time.perf_counter() - started
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        return {"seconds": elapsed, "sweeps": sweeps, "samples": sum(thread_samples.values()), "idle": idle,
+                "overhead": (time.thread_time() - cpu_started) / elapsed if elapsed else 0.0,
+                "threads": [(names.get(ident, f"thread-{ident}"), count, thread_busy[ident]) for ident, count in thread_samples.most_common()],
+                "hot": self_counts.most_common(25), "cumulative": total_counts.most_common(25)}
+
+profiler = SamplingProfiler()
+
+def thread_inventory(depth=3):
+    frames, rows = sys._current_frames(), []
+    for thread in threading.enumerate():
+        stack, frame = [], frames.get(thread.ident)
+        while frame is not None and len(stack) < depth: stack.append(format_code(frame.f_code, frame.f_lineno)); frame = frame.f_back
+        rows.append((thread.name, thread.ident, thread.daemon, stack))
+    return rows
+
+def bot_state_sizes():
+    rows = []
+    for name, value in vars(bot_state).items():
+        if isinstance(value, RoomRegistry):
+            rows.append((f"bot_state.{name}", len(value), sys.getsizeof(value.by_id) + sys.getsizeof(value.by_name) + sum(sys.getsizeof(room) for room in value.rooms())))
+        elif isinstance(value, (dict, list, set, frozenset, deque)): rows.append((f"bot_state.{name}", len(value), sys.getsizeof(value)))
+    scheduler = bot_state.engine.scheduler if bot_state.engine else None
+    directory = room_directory.snapshot()
+    rows += [("dispatcher queue", dispatcher.snapshot()['depth'], None), ("outbound queue", outbound.snapshot()['depth'], None),
+             ("pending joins", join_tracker.snapshot()['pending'], None), ("timers", scheduler.pending_count() if scheduler else 0, None),
+             ("room_directory rooms", directory['rooms'], None), ("room_directory heap", directory['heap'], None),
+             ("roam_selector rooms", roam_selector.snapshot()['rooms'], None), ("roam_log entries", len(roam_log.entries), None),
+             ("solver_cache entries", solver_cache.snapshot()['size'], None), ("db write-behind", roam_writer.snapshot()['pending'], None),
+             ("log queue", log_listener.queue.qsize() if log_listener else 0, None)]
+    return rows
+
+def format_profile_report(result):
+    busy = result['samples'] - result['idle']
+    lines = [f"{Config.BOT_USERNAME} profile, {datetime.now().isoformat(timespec='seconds')}",
+             f"window {result['seconds']:.1f}s, {result['sweeps']} sweeps every {Config.PROFILE_INTERVAL_MS}ms, {result['samples']} thread samples "
+             f"({busy} busy, {result['idle']} idle), profiler overhead {result['overhead']:.1%} of one core", ""]
+    lines.append("== Threads (samples, busy) ==")
+    lines += [f"{busy_count / count:>6.0%} busy  {count:>6}  {name}" for name, count, busy_count in result['threads']]
+    lines += ["", "== Hot functions (self, share of busy samples) =="]
+    lines += [f"{count / busy:>6.1%}  {count:>6}  {format_code(code)}" for code, count in result['hot']] if busy else ["(no busy samples)"]
+    lines += ["", "== Cumulative (on stack, share of busy samples) =="]
+    lines += [f"{count / busy:>6.1%}  {count:>6}  {format_code(code)}" for code, count in result['cumulative']] if busy else ["(no busy samples)"]
+    lines += ["", "== Thread inventory =="]
+    for name, ident, daemon, stack in thread_inventory():
+        lines.append(f"{name} (ident {ident}{', daemon' if daemon else ''})")
+        lines += [f"    {entry}" for entry in stack]
+    rss = process_rss_mb()
+    lines += ["", f"== Memory (RSS {f'{rss:.1f} MB' if rss is not None else 'n/a'}) =="]
+    lines += [f"{name:<28} {length:>8}" + (f"  {size:,} bytes (shallow)" if size is not None else "") for name, length, size in bot_state_sizes()]
+    return "\n".join(lines) + "\n"
+
+def list_profile_reports():
+    try: names = sorted((name for name in os.listdir(Config.PROFILE_DIR) if PROFILE_NAME_RE.fullmatch(name)), reverse=True)
+    except FileNotFoundError: return []
+    return [{"name": name, "bytes": os.path.getsize(os.path.join(Config.PROFILE_DIR, name))} for name in names]
+
+def read_profile_report(name):
+    if not PROFILE_NAME_RE.fullmatch(name or ""): raise FileNotFoundError(name)
+    with open(os.path.join(Config.PROFILE_DIR, name), 'r', encoding='utf-8') as f: return f.read()
+
+def run_profile(seconds):
+    result = profiler.run(seconds, Config.PROFILE_INTERVAL_MS / 1000.0)
+    report, name = format_profile_report(result), f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(Config.PROFILE_DIR, name), 'w', encoding='utf-8') as f: f.write(report)
+    for old in list_profile_reports()[Config.PROFILE_KEEP:]: os.remove(os.path.join(Config.PROFILE_DIR, old['name']))
+    busy = result['samples'] - result['idle']
+    logging.info(f"[Profiler] {result['seconds']:.1f}s profile saved as {name} ({result['samples']} samples, {result['overhead']:.1%} overhead).")
+    return {"name": name, "report": report, "samples": result['samples'], "overhead": result['overhead'],
+            "hot": [[format_code(code), count / busy] for code, count in result['hot'][:10]] if busy else []}
+
+# ========================================================================================
+# === SUPERVISOR & IPC ===================================================================
+# ========================================================================================
+# With BOT_SUPERVISOR_SOCKET set the bot runs in `python app.py supervisor` and the panel talks to it
+# over a Unix socket, one JSON request and response per line.
+class SupervisorUnavailable(ConnectionError): pass
+SUPERVISOR_ERRORS = {"RuntimeError": RuntimeError, "FileNotFoundError": FileNotFoundError} # raised again on the client side as themselves
+
+def roamstats_payload():
+    stats = roam_log.snapshot(top=20)
+    stats['recent'] = [{"room": room_name, "prize": prize_won, "time": roam_ts} for room_name, prize_won, roam_ts in roam_log.recent(50)]
+    stats['top_rooms'] = [{"room": room_name, "prizes": prizes, "roams": roams, "last_prize": last_prize} for room_name, prizes, roams, last_prize in stats['top_rooms']]
+    stats['hourly'] = [{"hour": hour, "roams": roams, "prizes": prizes} for hour, roams, prizes in stats['hourly']]
+    return stats
+
+SUPERVISOR_OPS = {
+    "start": lambda: (start_bot_logic(), bot_status_text())[1],
+    "stop": lambda: (stop_bot_logic(), bot_status_text())[1],
+    "status": lambda: build_status_snapshot(),
+    "roamstats": roamstats_payload,
+    "metrics": render_metrics,
+    "profile": lambda seconds=Config.PROFILE_DEFAULT_SECONDS: run_profile(int(seconds)),
+    "profiles": list_profile_reports,
+    "profile_file": lambda name=None: read_profile_report(name),
+    "logging": lambda level=None, category=None: (level and log_control.set_level(level, category or None), log_control.snapshot())[1],
+}
+
+class LocalBotControl:
+    mode = "in-process"
+    def call(self, op, **params): return SUPERVISOR_OPS[op](**params)
+    def start(self): return self.call("start")
+    def stop(self): return self.call("stop")
+    def status(self): return self.call("status")
+    def roamstats(self): return self.call("roamstats")
+    def metrics(self): return self.call("metrics")
+    def logging_levels(self, level=None, category=None): return self.call("logging", level=level, category=category)
+    def profile(self, seconds): return self.call("profile", seconds=seconds)
+    def profiles(self): return self.call("profiles")
+    def profile_file(self, name): return self.call("profile_file", name=name)
+
+class SupervisorClient(LocalBotControl):
+    mode = "supervisor"
+    def __init__(self, path): self.path = path
+    def call(self, op, **params):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(Config.SUPERVISOR_TIMEOUT_SECONDS + float(params.get("seconds") or 0)); sock.connect(self.path)
+                sock.sendall(json.dumps({"op": op, "params": params}).encode() + b"\n")
+                with sock.makefile("rb") as reader: line = reader.readline()
+        except OSError as e: raise SupervisorUnavailable(f"bot supervisor not reachable at {self.path}: {e}") from e
+        if not line: raise SupervisorUnavailable("bot supervisor closed the connection")
+        response = json.loads(line)
+        if not response.get("ok"): raise SUPERVISOR_ERRORS.get(response.get("kind"), SupervisorUnavailable)(response.get("error", "supervisor error"))
+        return response["result"]
+
+class SupervisorRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line); op = message.get("op")
+                if op not in SUPERVISOR_OPS: response = {"ok": False, "error": f"unknown op {op!r}"}
+                else: response = {"ok": True, "result": SUPERVISOR_OPS[op](**(message.get("params") or {}))}
+            except Exception as e:
+                expected = type(e).__name__ in SUPERVISOR_ERRORS
+                logging.log(logging.WARNING if expected else logging.ERROR, f"[Supervisor] Error handling IPC request: {e}", exc_info=not expected)
+                response = {"ok": False, "error": str(e), "kind": type(e).__name__}
+            self.wfile.write(json.dumps(response, default=str).encode() + b"\n"); self.wfile.flush()
+
+class SupervisorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def run_supervisor():
+    path = Config.BOT_SUPERVISOR_SOCKET
+    if not path: logging.critical("🔴 BOT_SUPERVISOR_SOCKET must be set to run the supervisor."); return
+    if os.path.exists(path): os.unlink(path)
+    server = SupervisorServer(path, SupervisorRequestHandler)
+    os.chmod(path, 0o600)
+    def shutdown(signum, frame): threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, shutdown); signal.signal(signal.SIGINT, shutdown)
+    logging.info(f"--- Bot supervisor for {Config.BOT_USERNAME} listening on {path} ---")
+    if Config.BOT_AUTOSTART: start_bot_logic()
+    try: server.serve_forever()
+    finally:
+        stop_bot_logic(keep_rooms=True); server.server_close()
+        if os.path.exists(path): os.unlink(path)
+        logging.info("--- Bot supervisor stopped. ---")
+
+bot_control = SupervisorClient(Config.BOT_SUPERVISOR_SOCKET) if Config.BOT_SUPERVISOR_SOCKET else LocalBotControl()
 
 # ========================================================================================
 # === WEB APP & BOT LIFECYCLE ============================================================
 # ========================================================================================
 app = Flask(__name__)
 app.secret_key = Config.FLASK_SECRET_KEY
+
+# --- Status feed --- One cached JSON snapshot, rebuilt at most every STATUS_REFRESH_SECONDS while someone watches.
+def bot_status_text():
+    if not (bot_thread and bot_thread.is_alive()): return "Stopped"
+    return "Running and Connected" if bot_state.is_connected else "Running but Disconnected"
+
+def build_status_snapshot():
+    scheduler = bot_state.engine.scheduler if bot_state.engine else None
+    rooms = bot_state.rooms.snapshot()
+    for room in rooms:
+        fire_at = scheduler.next_fire(('cycle', room["id"])) if scheduler and room["cycle"] else None
+        room["cycle_next_in"] = max(0, round(fire_at - time.time())) if fire_at else None
+    directory = room_directory.snapshot()
+    with bot_state.roam_lock: launched = sum(1 for ts in bot_state.roam_launches if time.time() - ts < 3600)
+    return {"bot": Config.BOT_USERNAME, "status": bot_status_text(), "connected": bot_state.is_connected,
+            "engine": bot_state.engine.name if bot_state.engine else None, "reconnects": bot_state.reconnects, "rooms": sorted(rooms, key=lambda r: r["name"].lower()),
+            "roamer": {"active": bot_state.is_roamer_active, "in_flight": directory['in_flight'], "available": directory['available'], "rooms": directory['rooms'],
+                       "visited": directory['visited'], "launched_last_hour": launched, "hourly_budget": Config.ROAMER_HOURLY_BUDGET},
+            "queues": {"dispatcher": dispatcher.snapshot()['depth'], "outbound": outbound.snapshot()['depth'], "timers": scheduler.pending_count() if scheduler else 0,
+                       "joins": join_tracker.snapshot()['pending'], "db_pending": roam_writer.snapshot()['pending'] if supabase else None},
+            "startup": startup_profile.snapshot()}
+
+class StatusFeed:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version, self.payload, self.fingerprint, self.built_at, self.clients, self.thread = 0, None, None, 0.0, 0, None
+        self.refreshing = False
+
+    def current(self):
+        with self.cond: stale = self.payload is None or time.monotonic() - self.built_at >= Config.STATUS_REFRESH_SECONDS
+        if stale: self.refresh()
+        with self.cond:
+            self.cond.wait_for(lambda: self.payload is not None, Config.SUPERVISOR_TIMEOUT_SECONDS) # first snapshot built by another reader
+            return self.version, self.payload or json.dumps({"status": "Unavailable (status not ready)"})
+
+    def stream(self):
+        self.current()
+        with self.cond:
+            self.clients += 1
+            if not self.thread or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._publish, name="status-publisher", daemon=True); self.thread.start()
+        try:
+            seen, deadline = None, time.monotonic() + Config.STATUS_STREAM_MAX_SECONDS
+            yield "retry: 1000\n\n"
+            while (remaining := deadline - time.monotonic()) > 0:
+                with self.cond:
+                    if seen == self.version: self.cond.wait(min(Config.STATUS_KEEPALIVE_SECONDS, remaining))
+                    version, payload = self.version, self.payload
+                if version != seen: seen = version; yield f"data: {payload}\n\n"
+                else: yield ": keep-alive\n\n"
+        finally:
+            with self.cond: self.clients -= 1
+
+    def refresh(self):
+        # The status call may be a supervisor round trip, so it runs outside the lock; readers
+        # keep getting the previous snapshot meanwhile and only one refresh runs at a time.
+        with self.cond:
+            if self.refreshing: return
+            self.refreshing = True
+        snapshot = None
+        try:
+            try: snapshot = bot_control.status()
+            except SupervisorUnavailable as e: snapshot = {"status": f"Unavailable ({e})"}
+        finally:
+            with self.cond:
+                self.refreshing = False
+                if snapshot is not None:
+                    if (fingerprint := json.dumps(snapshot, sort_keys=True, default=str)) != self.fingerprint:
+                        self.fingerprint, self.version = fingerprint, self.version + 1
+                        self.payload = json.dumps(dict(snapshot, updated_at=time.time()), default=str)
+                    self.built_at = time.monotonic()
+                self.cond.notify_all()
+
+    def _publish(self):
+        while True:
+            with self.cond:
+                if not self.clients: self.thread = None; return
+            self.refresh()
+            time.sleep(Config.STATUS_REFRESH_SECONDS)
+
+status_feed = StatusFeed()
+
+MetricCallback("howdies_inbound_frames_total", "Inbound frames, by handler.", "counter", lambda: {h or "unknown": n for h, n in list(frame_counts.items())}, label="handler")
+MetricCallback("howdies_inbound_frames_skipped_total", "Inbound frames dropped before decoding, by handler.", "counter", lambda: {h or "unknown": n for h, n in list(frame_skipped.items())}, label="handler")
+MetricCallback("howdies_inbound_bytes_total", "Inbound frame bytes, by handler.", "counter", lambda: {h or "unknown": n for h, n in list(frame_bytes.items())}, label="handler")
+MetricCallback("howdies_reconnects_total", "Reconnect attempts since the process started.", "counter", lambda: bot_state.reconnects)
+MetricCallback("howdies_connected", "1 while the WebSocket is connected.", "gauge", lambda: int(bot_state.is_connected))
+MetricCallback("howdies_threads", "Live Python threads.", "gauge", threading.active_count)
+MetricCallback("howdies_startup_seconds", "Seconds from process start to each startup milestone.", "gauge", startup_profile.snapshot, label="phase")
+MetricCallback("howdies_log_records_discarded_total", "Log records not written, by reason.", "counter",
+               lambda: {reason: log_control.stats[reason] for reason in ('dropped', 'sampled_out', 'rate_limited')}, label="reason")
+MetricCallback("howdies_cycle_timers_active", "Rooms with cycle mode running.", "gauge", lambda: sum(1 for room in bot_state.rooms.rooms() if room.cycle_phase))
+MetricCallback("howdies_roamable_rooms", "Rooms currently available to roam.", "gauge", lambda: room_directory.snapshot()['available'])
+MetricCallback("howdies_known_rooms", "Rooms tracked by the room directory.", "gauge", lambda: room_directory.snapshot()['rooms'])
+MetricCallback("howdies_queue_depth", "Pending items per internal queue.", "gauge", lambda: {
+    "dispatcher": dispatcher.snapshot()['depth'], "outbound": outbound.snapshot()['depth'], "joins": join_tracker.snapshot()['pending'],
+    "timers": bot_state.engine.scheduler.pending_count() if bot_state.engine else 0, "db_write_behind": roam_writer.snapshot()['pending']}, label="queue")
+
 LOGIN_TEMPLATE = """
 <!DOCTYPE html>
 <html><head><title>Login</title><style>body{font-family:sans-serif;background:#121212;color:#e0e0e0;display:flex;justify-content:center;align-items:center;height:100vh;margin:0;}.login-box{background:#1e1e1e;padding:40px;border-radius:8px;box-shadow:0 4px 8px rgba(0,0,0,0.3);width:300px;}h2{color:#bb86fc;text-align:center;}.input-group{margin-bottom:20px;}input{width:100%;padding:10px;border:1px solid #333;border-radius:4px;background:#2a2a2a;color:#e0e0e0;box-sizing: border-box;}.btn{width:100%;padding:10px;border:none;border-radius:4px;background:#03dac6;color:#121212;font-size:16px;cursor:pointer;}.flash{padding:10px;background:#cf6679;color:#121212;border-radius:4px;margin-bottom:15px;text-align:center;}</style></head><body><div class="login-box"><h2>Control Panel Login</h2>{% with messages = get_flashed_messages() %}{% if messages %}<div class="flash">{{ messages[0] }}</div>{% endif %}{% endwith %}<form method="post"><div class="input-group"><input type="text" name="username" placeholder="Username" required></div><div class="input-group"><input type="password" name="password" placeholder="Password" required></div><button type="submit" class="btn">Login</button></form></div></body></html>
 """
 DASHBOARD_TEMPLATE = """
 <!DOCTYPE html>
-<html><head><title>{{ bot_name }} Dashboard</title><meta http-equiv="refresh" content="10"><style>body{font-family:sans-serif;background:#121212;color:#e0e0e0;margin:0;padding:40px;text-align:center;}.container{max-width:800px;margin:auto;background:#1e1e1e;padding:20px;border-radius:8px;box-shadow:0 4px 8px rgba(0,0,0,0.3);}h1{color:#bb86fc;}.status{padding:15px;border-radius:5px;margin-top:20px;font-weight:bold;}.running{background:#03dac6;color:#121212;}.stopped{background:#cf6679;color:#121212;}.buttons{margin-top:30px;}.btn{padding:12px 24px;border:none;border-radius:5px;font-size:16px;cursor:pointer;margin:5px;text-decoration:none;color:#121212;display:inline-block;}.btn-start{background-color:#03dac6;}.btn-stop{background-color:#cf6679;}.btn-logout{background-color:#666;color:#fff;position:absolute;top:20px;right:20px;}</style></head><body><a href="/logout" class="btn btn-logout">Logout</a><div class="container"><h1>{{ bot_name }} Dashboard</h1><div class="status {{ 'running' if 'Running' in bot_status else 'stopped' }}">Bot Status: {{ bot_status }}</div><div class="buttons"><a href="/start" class="btn btn-start">Start Bot</a><a href="/stop" class="btn btn-stop">Stop Bot</a></div></div></body></html>
+<html><head><title>{{ bot_name }} Dashboard</title><style>body{font-family:sans-serif;background:#121212;color:#e0e0e0;margin:0;padding:40px;text-align:center;}.container{max-width:800px;margin:auto;background:#1e1e1e;padding:20px;border-radius:8px;box-shadow:0 4px 8px rgba(0,0,0,0.3);}h1{color:#bb86fc;}.status{padding:15px;border-radius:5px;margin-top:20px;font-weight:bold;}.running{background:#03dac6;color:#121212;}.stopped{background:#cf6679;color:#121212;}.buttons{margin-top:30px;}.btn{padding:12px 24px;border:none;border-radius:5px;font-size:16px;cursor:pointer;margin:5px;text-decoration:none;color:#121212;display:inline-block;}.btn-start{background-color:#03dac6;}.btn-stop{background-color:#cf6679;}.btn-logout{background-color:#666;color:#fff;position:absolute;top:20px;right:20px;}table{width:100%;border-collapse:collapse;margin-top:20px;}td,th{padding:6px;border-bottom:1px solid #333;text-align:left;}th{color:#bb86fc;}.muted{color:#888;font-size:13px;margin-top:10px;}</style></head><body><a href="/logout" class="btn btn-logout">Logout</a><div class="container"><h1>{{ bot_name }} Dashboard</h1><div id="status" class="status {{ 'running' if 'Running' in bot_status else 'stopped' }}">Bot Status: {{ bot_status }}</div><div class="buttons"><a href="/start" class="btn btn-start">Start Bot</a><a href="/stop" class="btn btn-stop">Stop Bot</a></div><form method="post" action="/api/logging" class="muted">Log level <select name="level"><option>DEBUG</option><option selected>INFO</option><option>WARNING</option><option>ERROR</option><option>default</option></select> for <input name="category" placeholder="all categories" size="12"> <button type="submit">Set</button> <span id="loglevels"></span></form><div class="muted">Profile all threads: <a href="/profile?seconds=10">10s</a> · <a href="/profile?seconds={{ profile_max }}">{{ profile_max }}s</a> <span id="profiles"></span></div><table><tbody id="summary"></tbody></table><table><thead><tr><th>Room</th><th>Quiz</th><th>Cycle</th></tr></thead><tbody id="rooms"></tbody></table><div id="updated" class="muted"></div></div>
+<script>
+function row(cells, tag){const tr=document.createElement('tr');cells.forEach(c=>{const td=document.createElement(tag||'td');td.textContent=c;tr.appendChild(td);});return tr;}
+function render(s){
+  const st=document.getElementById('status');st.textContent='Bot Status: '+s.status;st.className='status '+(s.status.indexOf('Running')>=0?'running':'stopped');
+  if(!s.queues){document.getElementById('summary').replaceChildren();document.getElementById('rooms').replaceChildren();return;}
+  const q=s.queues,r=s.roamer;
+  document.getElementById('summary').replaceChildren(
+    row(['Roamer',(r.active?'ON':'OFF')+' — '+r.in_flight+' in flight, '+r.available+'/'+r.rooms+' rooms available, '+r.launched_last_hour+'/'+r.hourly_budget+' this hour'],'td'),
+    row(['Queues','dispatcher '+q.dispatcher+', outbound '+q.outbound+', timers '+q.timers+', joins '+q.joins+(q.db_pending===null?'':', db '+q.db_pending)]),
+    row(['Connection',(s.connected?'connected':'disconnected')+' ('+s.engine+' engine), '+s.reconnects+' reconnects']));
+  document.getElementById('rooms').replaceChildren(...s.rooms.map(x=>row([x.name,x.quiz||'-',x.cycle?(x.cycle+(x.cycle_next_in!==null?' ('+x.cycle_next_in+'s)':'')):'-'])));
+  document.getElementById('updated').textContent='Updated '+new Date(s.updated_at*1000).toLocaleTimeString();
+}
+fetch('/api/status').then(r=>r.json()).then(render);
+fetch('/profiles').then(r=>r.json()).then(p=>{if(!Array.isArray(p)||!p.length)return;const el=document.getElementById('profiles');el.append(' · saved: ');p.slice(0,5).forEach((x,i)=>{const a=document.createElement('a');a.href='/profiles/'+x.name;a.textContent=x.name.slice(8,23);el.append(i?', ':'',a);});});
+fetch('/api/logging').then(r=>r.json()).then(l=>{if(l.level)document.getElementById('loglevels').textContent='(now '+l.level+Object.entries(l.categories).map(([c,v])=>', '+c+' '+v).join('')+')';});
+if(window.EventSource){new EventSource('/api/status/stream').onmessage=e=>render(JSON.parse(e.data));}
+</script></body></html>
 """
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -302,34 +1677,106 @@ def logout(): session.pop('logged_in', None); return redirect(url_for('login'))
 @app.route('/')
 def home():
     if not session.get('logged_in'): return redirect(url_for('login'))
-    global bot_thread; status = "Stopped"
-    if bot_thread and bot_thread.is_alive(): status = "Running and Connected" if bot_state.is_connected else "Running but Disconnected"
-    return render_template_string(DASHBOARD_TEMPLATE, bot_name=Config.BOT_USERNAME, bot_status=status)
+    return render_template_string(DASHBOARD_TEMPLATE, bot_name=Config.BOT_USERNAME, bot_status=json.loads(status_feed.current()[1])['status'], profile_max=Config.PROFILE_MAX_SECONDS)
+@app.route('/api/status')
+def status_route():
+    if not session.get('logged_in'): return jsonify({"error": "unauthorized"}), 401
+    return status_feed.current()[1], 200, {"Content-Type": "application/json"}
+@app.route('/api/status/stream')
+def status_stream_route():
+    if not session.get('logged_in'): return jsonify({"error": "unauthorized"}), 401
+    return Response(stream_with_context(status_feed.stream()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+@app.route('/api/roamstats')
+def roamstats_route():
+    if not session.get('logged_in'): return jsonify({"error": "unauthorized"}), 401
+    try: return jsonify(bot_control.roamstats())
+    except SupervisorUnavailable as e: return jsonify({"error": str(e)}), 503
+@app.route('/metrics')
+def metrics_route():
+    if not session.get('logged_in') and request.args.get('key') != Config.UPTIME_SECRET_KEY: return "unauthorized\n", 401
+    try: return bot_control.metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    except SupervisorUnavailable as e: return f"{e}\n", 503
+@app.route('/api/logging', methods=['GET', 'POST'])
+def logging_route():
+    if not session.get('logged_in'): return jsonify({"error": "unauthorized"}), 401
+    params = request.get_json(silent=True) or request.form if request.method == 'POST' else {}
+    try: levels = bot_control.logging_levels(params.get('level') or None, (params.get('category') or '').strip() or None)
+    except (ValueError, SupervisorUnavailable) as e:
+        if request.form: flash(str(e)); return redirect(url_for('home'))
+        return jsonify({"error": str(e)}), 400
+    if request.form: return redirect(url_for('home'))
+    return jsonify(levels)
+@app.route('/profile')
+def profile_route():
+    if not session.get('logged_in'): return redirect(url_for('login'))
+    try: seconds = int(request.args.get('seconds', Config.PROFILE_DEFAULT_SECONDS))
+    except ValueError: return "seconds must be a whole number\n", 400
+    if not 1 <= seconds <= Config.PROFILE_MAX_SECONDS: return f"seconds must be between 1 and {Config.PROFILE_MAX_SECONDS}\n", 400
+    try: result = bot_control.profile(seconds)
+    except SupervisorUnavailable as e: return f"{e}\n", 503
+    except RuntimeError as e: return f"{e}\n", 409
+    return Response(result['report'], mimetype="text/plain", headers={"Content-Disposition": f"attachment; filename={result['name']}"})
+@app.route('/profiles')
+def profiles_route():
+    if not session.get('logged_in'): return jsonify({"error": "unauthorized"}), 401
+    try: return jsonify(bot_control.profiles())
+    except SupervisorUnavailable as e: return jsonify({"error": str(e)}), 503
+@app.route('/profiles/<name>')
+def profile_file_route(name):
+    if not session.get('logged_in'): return redirect(url_for('login'))
+    try: report = bot_control.profile_file(name)
+    except FileNotFoundError: return "not found\n", 404
+    except SupervisorUnavailable as e: return f"{e}\n", 503
+    return Response(report, mimetype="text/plain", headers={"Content-Disposition": f"attachment; filename={name}"})
 @app.route('/start')
 def start_bot_route():
     if (uptime_key := request.args.get('key')) and uptime_key == Config.UPTIME_SECRET_KEY:
-        start_bot_logic(); return "Bot start initiated by uptime service."
+        try: bot_control.start(); return "Bot start initiated by uptime service."
+        except SupervisorUnavailable as e: return f"{e}\n", 503
     if not session.get('logged_in'): return redirect(url_for('login'))
-    start_bot_logic(); return redirect(url_for('home'))
+    try: bot_control.start()
+    except SupervisorUnavailable as e: flash(str(e))
+    return redirect(url_for('home'))
 @app.route('/stop')
 def stop_bot_route():
     if not session.get('logged_in'): return redirect(url_for('login'))
-    stop_bot_logic(); return redirect(url_for('home'))
+    try: bot_control.stop()
+    except SupervisorUnavailable as e: flash(str(e))
+    return redirect(url_for('home'))
 def start_bot_logic():
     global bot_thread
     if not bot_thread or not bot_thread.is_alive():
         logging.info("WEB PANEL: Received request to start the bot.")
+        startup_profile.mark('bot_start')
         bot_state.stop_bot_event.clear()
-        bot_thread = threading.Thread(target=connect_to_howdies, daemon=True); bot_thread.start()
+        local_store.open()
+        dispatcher.start()
+        outbound.start()
+        roam_writer.start()
+        solver_cache.load()
+        room_directory.set_excluded(Config.ROOMS_TO_JOIN.split(','))
+        bot_state.resume_snapshot.clear(); bot_state.token_rejected, bot_state.reconnect_delay = False, Config.INITIAL_RECONNECT_DELAY
+        if Config.WARM_START: load_warm_state()
+        bot_state.engine = create_engine()
+        bot_thread = threading.Thread(target=bot_state.engine.run, name=f"bot-{bot_state.engine.name}", daemon=True); bot_thread.start()
         if not bot_state.log_cleanup_thread or not bot_state.log_cleanup_thread.is_alive():
-            bot_state.log_cleanup_thread = threading.Thread(target=cleanup_old_logs, daemon=True); bot_state.log_cleanup_thread.start()
-def stop_bot_logic():
+            bot_state.log_cleanup_thread = threading.Thread(target=cleanup_old_logs, name="db-log-cleanup", daemon=True); bot_state.log_cleanup_thread.start()
+def stop_bot_logic(keep_rooms=False):
+    # keep_rooms: a supervisor shutting down (host sleep, redeploy) rejoins the current rooms
+    # on the next start; a stop from the panel starts over from ROOMS_TO_JOIN.
     global bot_thread
     if bot_thread and bot_thread.is_alive():
         logging.info("WEB PANEL: Received request to stop the bot.")
+        if Config.WARM_START: save_warm_state(keep_rooms)
         if bot_state.is_roamer_active: handle_roamer_command('off', None)
         bot_state.stop_bot_event.set()
-        for room_id in list(bot_state.cycle_timers.keys()): stop_cycle_for_room(room_id)
+        for room in bot_state.rooms.rooms():
+            if room.cycle_phase: stop_cycle_for_room(room.room_id, immediate=True)
+        dispatcher.clear()
+        outbound.clear(); outbound.set_online(False); join_tracker.fail_all("bot stopped")
+        if bot_state.engine: bot_state.engine.scheduler.clear()
+        solver_cache.save()
+        roam_writer.flush()
         if bot_state.ws_instance:
             try: bot_state.ws_instance.close()
             except Exception: pass
@@ -340,25 +1787,31 @@ def stop_bot_logic():
 # ========================================================================================
 def load_masters():
     masters_str = Config.MASTERS_LIST
-    if masters_str: bot_state.masters = [name.strip().lower() for name in masters_str.split(',')]
+    if masters_str: bot_state.masters = frozenset(name.strip().lower() for name in masters_str.split(',') if name.strip())
     logging.info(f"✅ Loaded {len(bot_state.masters)} masters from .env.")
-def send_ws_message(payload):
+def send_ws_message(payload, priority=SEND_PRIORITY_CONTROL, coalesce_key=None, on_sent=None): outbound.enqueue(payload, priority, coalesce_key, on_sent)
+def send_ws_message_now(payload):
     if bot_state.is_connected and bot_state.ws_instance:
         try:
             bot_state.ws_instance.send(json.dumps(payload))
-        except Exception as e: logging.error(f"Error sending message: {e}")
-    else: logging.warning("Warning: WebSocket is not connected.")
-def reply_to_room(room_id, text): send_ws_message({"handler": "chatroommessage", "type": "text", "roomid": room_id, "text": text})
+        except Exception as e: logging.error(f"Error sending message: {e}", extra={'category': 'WS'})
+    else: logging.warning("Warning: WebSocket is not connected.", extra={'category': 'WS'})
+def reply_to_room(room_id, text, priority=SEND_PRIORITY_REPLY, coalesce_key=None):
+    if coalesce_key is None and priority == SEND_PRIORITY_REPLY: coalesce_key = ('reply', room_id, text)
+    send_ws_message({"handler": "chatroommessage", "type": "text", "roomid": room_id, "text": text}, priority, coalesce_key)
 def leave_room(room_id):
     send_ws_message({"handler": "leaveroom", "roomid": room_id})
-    if room_name := bot_state.room_id_to_name.pop(room_id, None):
-        bot_state.room_name_to_id.pop(room_name.lower(), None)
-def send_delayed_quiz_answer(room_id, answer_text):
+    bot_state.rooms.remove(room_id)
+def send_delayed_quiz_answer(room_id, answer_text, received_at=None):
     if bot_state.stop_bot_event.is_set(): return
     delay_ms = random.randint(Config.QUIZ_ANSWER_DELAY_MIN_MS, Config.QUIZ_ANSWER_DELAY_MAX_MS)
-    time.sleep(delay_ms / 1000.0)
-    if not bot_state.stop_bot_event.is_set(): reply_to_room(room_id, answer_text)
+    bot_state.engine.call_later(delay_ms / 1000.0, deliver_quiz_answer, room_id, answer_text, received_at, key=('answer', room_id))
+def deliver_quiz_answer(room_id, answer_text, received_at=None):
+    if bot_state.stop_bot_event.is_set(): return
+    reply_to_room(room_id, answer_text, SEND_PRIORITY_ANSWER)
+    if received_at is not None: quiz_answer_seconds.observe(time.monotonic() - received_at)
 def get_token():
+    import requests
     logging.info("🔑 Acquiring login token...")
     if not Config.BOT_PASSWORD: logging.critical("🔴 CRITICAL: BOT_PASSWORD not set!"); return None
     try:
@@ -368,46 +1821,220 @@ def get_token():
         if token: logging.info("✅ Token acquired."); return token
         else: logging.error(f"🔴 Failed to get token: {response.text}"); return None
     except requests.RequestException as e: logging.critical(f"🔴 Error fetching token: {e}"); return None
-def join_room(room_name, source=None): send_ws_message({"handler": "joinchatroom", "name": room_name, "roomPassword": "", "__source": source})
-def join_startup_rooms():
-    logging.info("Joining startup rooms...")
-    time.sleep(1)
-    if not (rooms_str := Config.ROOMS_TO_JOIN):
+
+# --- Room joins --- join_room() returns a Future for the room ID, settled by the joinchatroom reply or a timeout.
+class JoinError(Exception): pass
+
+class JoinTracker:
+    def __init__(self):
+        self.lock, self.pending = threading.Lock(), {} # room_name.lower() -> [timer, [futures], sent_at]
+        self.stats = {'requested': 0, 'joined': 0, 'failed': 0, 'timed_out': 0}
+
+    def join(self, room_name, source=None):
+        key, future = room_name.lower(), concurrent.futures.Future()
+        if room := bot_state.rooms.find(key):
+            future.set_result(room.room_id); return future
+        with self.lock:
+            if entry := self.pending.get(key): entry[1].append(future); return future
+            entry = self.pending[key] = [None, [future], time.monotonic()]; self.stats['requested'] += 1
+        send_ws_message({"handler": "joinchatroom", "name": room_name, "roomPassword": "", "__source": source}, on_sent=lambda: self.sent(key, entry))
+        # The reply timeout starts when the writer sends the frame (sent); until then this backstop
+        # covers a frame that expires or is evicted in the writer queue.
+        timer = bot_state.engine.call_later(Config.SEND_TTL_SECONDS + Config.JOIN_TIMEOUT_SECONDS, self.expire, key)
+        with self.lock:
+            if self.pending.get(key) is entry and entry[0] is None: entry[0] = timer
+            else: timer.cancel()
+        return future
+
+    def sent(self, key, entry):
+        timer = bot_state.engine.call_later(Config.JOIN_TIMEOUT_SECONDS, self.expire, key)
+        with self.lock:
+            if self.pending.get(key) is not entry: return timer.cancel()
+            previous, entry[0], entry[2] = entry[0], timer, time.monotonic()
+        if previous: previous.cancel()
+
+    def _pop(self, key):
+        with self.lock:
+            if key is None: # a nameless error reply is only attributable while a single join is pending
+                if len(self.pending) != 1:
+                    if self.pending: logging.warning(f"[Join] Join error without a room name while {len(self.pending)} joins are pending; leaving them to the timeout.")
+                    return None
+                key = next(iter(self.pending))
+            entry = self.pending.pop(key, None)
+        if not entry: return None
+        if entry[0]: entry[0].cancel()
+        return entry
+
+    def _settle(self, futures, result=None, error=None):
+        for future in futures:
+            if future.done(): continue
+            try: future.set_exception(error) if error else future.set_result(result)
+            except concurrent.futures.InvalidStateError: pass
+
+    def resolve(self, room_name, room_id):
+        if entry := self._pop(room_name.lower()):
+            self.stats['joined'] += 1; join_rtt_seconds.observe(time.monotonic() - entry[2]); self._settle(entry[1], result=room_id)
+
+    def fail(self, room_name, reason):
+        if entry := self._pop(room_name.lower() if room_name else None):
+            self.stats['failed'] += 1; self._settle(entry[1], error=JoinError(reason))
+
+    def expire(self, key):
+        if entry := self._pop(key):
+            self.stats['timed_out'] += 1; self._settle(entry[1], error=JoinError(f"no reply within {Config.JOIN_TIMEOUT_SECONDS}s"))
+
+    def fail_all(self, reason):
+        with self.lock: keys = list(self.pending)
+        for key in keys:
+            if entry := self._pop(key): self._settle(entry[1], error=JoinError(reason))
+
+    def snapshot(self):
+        with self.lock: return dict(self.stats, pending=len(self.pending))
+
+join_tracker = JoinTracker()
+
+def join_room(room_name, source=None): return join_tracker.join(room_name, source)
+def report_join_result(room_id, room_name, future):
+    try: future.result()
+    except JoinError as e: reply_to_room(room_id, f"❌ Could not join '{room_name}': {e}")
+
+# --- Session resume --- On a drop, rooms and their modes are snapshotted by name and rejoined through
+# a pipelined queue after the next login.
+def snapshot_session():
+    snapshot = bot_state.resume_snapshot
+    for room in bot_state.rooms.detach_all():
+        if not (room.prize_future or room_directory.is_in_flight(room.name)): # roam visits are not resumed
+            snapshot[room.name] = {'quiz': room.quiz_bot, 'cycle': room.cycle_phase is not None}
+        room.stop_cycle()
+    if snapshot: logging.info(f"[Session] Snapshotted {len(snapshot)} rooms for resume.")
+
+def restore_room_modes(room_name, room_id):
+    if not (modes := bot_state.resume_snapshot.pop(room_name, None)): return
+    if modes['quiz'] and (room := bot_state.rooms.get(room_id)): room.quiz_bot = modes['quiz']
+    if modes['cycle']: start_cycle_for_room(room_id, show_message=False)
+    if modes['quiz'] or modes['cycle']: logging.info(f"[Session] Restored {'quiz' if modes['quiz'] else ''}{' & ' if modes['quiz'] and modes['cycle'] else ''}{'cycle' if modes['cycle'] else ''} mode in '{room_name}'.")
+
+async def resume_session():
+    started = time.monotonic()
+    startup_rooms = [name.strip() for name in Config.ROOMS_TO_JOIN.split(',') if name.strip()]
+    room_names, seen = [], set()
+    for room_name in startup_rooms + list(bot_state.resume_snapshot):
+        if room_name.lower() not in seen: seen.add(room_name.lower()); room_names.append(room_name)
+    if not room_names:
         logging.info("No startup rooms defined in ROOMS_TO_JOIN."); return
-    for room_name in [name.strip() for name in rooms_str.split(',')]:
-        if bot_state.stop_bot_event.is_set(): break
-        if room_name: time.sleep(Config.ROOM_JOIN_DELAY_SECONDS); join_room(room_name, source='startup_join')
-    if not bot_state.stop_bot_event.is_set(): logging.info("✅ Finished joining startup rooms.")
+    logging.info(f"[Session] Joining {len(room_names)} rooms ({len(startup_rooms)} startup, {len(room_names) - len(startup_rooms)} resumed)...")
+    pending = []
+    for room_name in room_names:
+        if bot_state.stop_bot_event.is_set(): return
+        pending.append((room_name, join_room(room_name, source='startup_join')))
+        await asyncio.sleep(Config.ROOM_JOIN_DELAY_SECONDS)
+    joined = failed = 0
+    for room_name, future in pending:
+        try: room_id = await asyncio.wrap_future(future)
+        except JoinError as e:
+            failed += 1; bot_state.resume_snapshot.pop(room_name, None)
+            logging.warning(f"⚠️ Could not join '{room_name}': {e}"); continue
+        joined += 1; restore_room_modes(room_name, room_id)
+    downtime = f", {time.time() - bot_state.disconnected_at:.1f}s after the drop" if bot_state.disconnected_at else ""
+    bot_state.last_resume = {'joined': joined, 'failed': failed, 'seconds': time.monotonic() - started}
+    bot_state.disconnected_at = None
+    logging.info(f"✅ Session ready: {joined} rooms joined, {failed} failed in {bot_state.last_resume['seconds']:.1f}s{downtime}.")
+    if 'session_ready' not in startup_profile.marks:
+        startup_profile.mark('session_ready'); logging.info(f"[Startup] {startup_profile.summary()}")
+    schedule_warm_state_save()
+
+def next_reconnect_delay():
+    bot_state.reconnects += 1
+    if bot_state.token_rejected and bot_state.warm_token: # a stale saved token is not a server problem: refresh and retry at once
+        bot_state.warm_token = False; return 0.0
+    delay = random.uniform(0.5, 1.0) * bot_state.reconnect_delay
+    bot_state.reconnect_delay = min(bot_state.reconnect_delay * 2, Config.MAX_RECONNECT_DELAY)
+    return delay
+
+def is_auth_rejection(error):
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status in (401, 403)
+
+def session_ws_url():
+    if not bot_state.token or bot_state.token_rejected:
+        if bot_state.token_rejected: logging.info("[Session] Token was rejected. Refreshing it...")
+        if not (token := get_token()): return None
+        bot_state.token, bot_state.token_rejected = token, False
+    startup_profile.mark('token')
+    return f"{Config.WS_URL}?token={bot_state.token}"
+
+# --- Warm start --- The token and current rooms are saved locally, so a restart can skip the login API.
+def save_warm_state(keep_rooms=True):
+    rooms = dict(bot_state.resume_snapshot) # rooms not yet rejoined after a drop
+    if keep_rooms:
+        for room in bot_state.rooms.rooms():
+            if not (room.prize_future or room_directory.is_in_flight(room.name)): rooms[room.name] = {'quiz': room.quiz_bot, 'cycle': room.cycle_phase is not None}
+    else: rooms = {}
+    try: local_store.set_value('warm_state', json.dumps({'token': bot_state.token, 'saved_at': time.time(), 'rooms': rooms}))
+    except sqlite3.Error as e: logging.error(f"[Startup] Could not save warm-start state: {e}")
+
+def schedule_warm_state_save():
+    if Config.WARM_START: dispatcher.submit(('db', 'warm'), save_warm_state)
+
+def load_warm_state():
+    try: state = json.loads(local_store.get_value('warm_state') or 'null')
+    except (sqlite3.Error, ValueError) as e: logging.error(f"[Startup] Could not read warm-start state: {e}"); return
+    if not state: return
+    if (age := time.time() - state.get('saved_at', 0)) > Config.WARM_START_MAX_AGE_SECONDS:
+        logging.info(f"[Startup] Warm-start state is {age / 3600:.1f}h old. Starting cold."); return
+    if state.get('token') and not bot_state.token: bot_state.token, bot_state.warm_token = state['token'], True
+    for room_name, modes in (state.get('rooms') or {}).items(): bot_state.resume_snapshot.setdefault(room_name, modes)
+    startup_profile.mark('warm_state')
+    logging.info(f"[Startup] Warm start from {age:.0f}s-old state: {'saved token, ' if state.get('token') else ''}{len(state.get('rooms') or {})} rooms to rejoin.")
 
 # --- COMMAND HANDLERS ---
 def handle_help(room_id):
-    help_text = (
-        "🤖 **ArcadeBot Help Menu** 🤖\n"
-        "-----------------------------------\n"
-        "**General:** `!j <room>`\n"
-        "**Master-Only:** `!status`, `!quiz on|off`, `!cycle on|off`, `!delay [min] [max]`\n"
-        "**Roamer:** `!roamer on|off`, `!roamlog`, `!roamnow <room>`"
-    )
-    reply_to_room(room_id, help_text)
+    sections = {}
+    for spec in COMMANDS.values():
+        if spec.usage: sections.setdefault(spec.section, []).append(spec.usage)
+    help_lines = ["🤖 **ArcadeBot Help Menu** 🤖", "-----------------------------------"]
+    help_lines += [f"**{section}:** {', '.join(usages)}" for section, usages in sections.items()]
+    reply_to_room(room_id, "\n".join(help_lines))
+def handle_profile_command(args, room_id):
+    try: seconds = int(args[0]) if args else Config.PROFILE_DEFAULT_SECONDS
+    except ValueError: return reply_to_room(room_id, "Usage: `!profile <seconds>`")
+    if not 1 <= seconds <= Config.PROFILE_MAX_SECONDS: return reply_to_room(room_id, f"❌ Error: Profile window must be 1-{Config.PROFILE_MAX_SECONDS}s.")
+    if profiler.running: return reply_to_room(room_id, "ℹ️ A profile is already running.")
+    reply_to_room(room_id, f"⏱️ Profiling all threads for {seconds}s...")
+    def run(): # off the dispatcher: a worker must not sit out the whole window
+        try: result = run_profile(seconds)
+        except (RuntimeError, OSError) as e: return reply_to_room(room_id, f"❌ Profile failed: {e}")
+        lines = [f"--- Profile ({seconds}s, {result['samples']} samples, {result['overhead']:.1%} overhead) ---"]
+        lines += [f"• {share:.0%} {function}" for function, share in result['hot'][:5]] or ["• No busy samples: the bot was idle."]
+        lines.append(f"Saved as `{result['name']}` (download it from the panel).")
+        reply_to_room(room_id, "\n".join(lines))
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+def handle_join_command(args, room_id):
+    if not args: return reply_to_room(room_id, "Usage: `!j <room>`")
+    room_name = " ".join(args)
+    join_room(room_name).add_done_callback(lambda future: report_join_result(room_id, room_name, future))
 # --- NEW --- Unified status command
 def handle_status_command(room_id):
     status_lines = ["🤖 **Bot Status Report** 🤖"]
     # Roamer Status
     roamer_status = "ON" if bot_state.is_roamer_active else "OFF"
-    with bot_state.roam_lock: visited_count = len(bot_state.visited_roam_rooms)
-    status_lines.append(f"--- Global ---\n• Roamer: **{roamer_status}** (Visited {visited_count}/24h)")
+    r, c = room_directory.snapshot(), solver_cache.snapshot()
+    status_lines.append(f"--- Global ---\n• Roamer: **{roamer_status}** (Visited {r['visited']}/24h, {r['in_flight']} in flight)")
+    status_lines.append(f"• Rooms: {len(bot_state.rooms)} joined, Solver Cache: {c['hit_rate']:.0%} hit rate ({c['hits']} hits / {c['misses']} misses)")
+    scheduler = bot_state.engine.scheduler if bot_state.engine else None
     # Per-Room Status
-    room_name = bot_state.room_id_to_name.get(room_id, "this room")
-    status_lines.append(f"--- Status for '{room_name}' ---")
-    if (quiz_bot := bot_state.quiz_solvers.get(room_id)):
-        status_lines.append(f"• Quiz Solver: **ON** (for *{quiz_bot}*)")
+    room = bot_state.rooms.get(room_id)
+    status_lines.append(f"--- Status for '{room.name if room else 'this room'}' ---")
+    if room and room.quiz_bot:
+        status_lines.append(f"• Quiz Solver: **ON** (for *{room.quiz_bot}*)")
     else: status_lines.append("• Quiz Solver: **OFF**")
-    if room_id in bot_state.cycle_timers:
-        now = time.time()
-        if (break_end := bot_state.break_end_times.get(room_id)) and now < break_end:
-            status_lines.append(f"• Cycle Mode: **ON** (On Break for {break_end - now:.0f}s)")
-        elif (work_end := bot_state.work_end_times.get(room_id)) and now < work_end:
-            status_lines.append(f"• Cycle Mode: **ON** (Working for {(work_end - now) / 60:.1f} more mins)")
+    if room and room.cycle_phase:
+        phase, fire_at = room.cycle_phase, scheduler.next_fire(('cycle', room_id)) if scheduler else None
+        remaining = (fire_at - time.time()) if fire_at else 0
+        if phase == 'break' and remaining > 0:
+            status_lines.append(f"• Cycle Mode: **ON** (On Break for {remaining:.0f}s)")
+        elif phase == 'work' and remaining > 0:
+            status_lines.append(f"• Cycle Mode: **ON** (Working for {remaining / 60:.1f} more mins)")
         else: status_lines.append("• Cycle Mode: **ON** (Transitioning)")
     else: status_lines.append("• Cycle Mode: **OFF**")
     reply_to_room(room_id, "\n".join(status_lines))
@@ -415,54 +2042,57 @@ def handle_status_command(room_id):
 def handle_roamnow_command(args, room_id):
     if not args: return reply_to_room(room_id, "Usage: `!roamnow <room_name>`")
     target_room = " ".join(args)
+    if room_directory.is_in_flight(target_room): return reply_to_room(room_id, f"ℹ️ A roam to '{target_room}' is already in progress.")
     reply_to_room(room_id, f"✅ Forcing a roam to '{target_room}'.")
-    threading.Thread(target=perform_roam_action, args=(target_room,), daemon=True).start()
+    bot_state.engine.spawn(perform_roam_action, target_room)
 def handle_roamer_command(sub_command, room_id):
     if sub_command == 'on':
         if bot_state.is_roamer_active:
             if room_id: reply_to_room(room_id, "ℹ️ Spin Roamer is already running.")
         else:
             bot_state.stop_roamer_event.clear()
-            bot_state.roamer_thread = threading.Thread(target=roamer_logic, daemon=True)
-            bot_state.roamer_thread.start(); bot_state.is_roamer_active = True
+            bot_state.roamer_task = bot_state.engine.spawn(roamer_logic); bot_state.is_roamer_active = True
             if room_id: reply_to_room(room_id, "✅ Spin Roamer 2.0 activated.")
     elif sub_command == 'off':
         if not bot_state.is_roamer_active:
             if room_id: reply_to_room(room_id, "ℹ️ Spin Roamer is not running.")
         else:
             bot_state.stop_roamer_event.set()
-            if bot_state.roamer_thread: bot_state.roamer_thread.join(timeout=5)
-            bot_state.is_roamer_active, bot_state.roamer_thread = False, None
+            if bot_state.roamer_task: bot_state.roamer_task.cancel()
+            bot_state.is_roamer_active, bot_state.roamer_task = False, None
             if room_id: reply_to_room(room_id, "✅ Spin Roamer deactivated.")
     else:
         if room_id: reply_to_room(room_id, "Usage: `!roamer on|off`")
 
 def handle_roamlog_command(room_id):
-    if not supabase: return reply_to_room(room_id, "❌ Database not configured. Cannot fetch roam logs.")
-    try:
-        response = supabase.table('roam_logs').select("room_name, prize_won, roam_time").order("roam_time", desc=True).limit(10).execute()
-        if not response.data: return reply_to_room(room_id, "No spin activity recorded.")
-        log_strings = ["--- Spin Roamer Log (Last 10) ---"]
-        for log in response.data:
-            timestamp = datetime.fromisoformat(log['roam_time']).strftime('%I:%M %p')
-            log_strings.append(f"• `[{timestamp}]` in **{log['room_name']}**: Won _{log['prize_won']}_")
-        reply_to_room(room_id, "\n".join(log_strings))
-    except Exception as e:
-        logging.error(f"[DB] Error fetching roam log: {e}", exc_info=True)
-        reply_to_room(room_id, "❌ Error fetching logs from the database.")
+    if not (logs := roam_log.recent(10)): return reply_to_room(room_id, "No spin activity recorded.")
+    log_strings = ["--- Spin Roamer Log (Last 10) ---"]
+    for room_name, prize_won, roam_ts in logs:
+        timestamp = datetime.fromtimestamp(roam_ts, tz=timezone.utc).strftime('%I:%M %p')
+        log_strings.append(f"• `[{timestamp}]` in **{room_name}**: Won _{prize_won}_")
+    reply_to_room(room_id, "\n".join(log_strings))
+def handle_roamstats_command(room_id):
+    stats = roam_log.snapshot()
+    lines = ["--- Spin Roamer Stats (24h) ---",
+             f"• Roams: {stats['roams_24h']}, prizes: {stats['prizes_24h']} ({stats['win_rate']:.0%} win rate, {stats['prizes_per_hour']:.1f}/hour)"]
+    for room_name, prizes, roams, last_prize in stats['top_rooms']:
+        lines.append(f"• **{room_name}**: {prizes}/{roams} won" + (f", last _{last_prize}_" if last_prize else ""))
+    reply_to_room(room_id, "\n".join(lines))
 
 def handle_quiz_command(sub_command, args, room_id):
+    if not (room := bot_state.rooms.get(room_id)): return logging.warning(f"[Quiz] Ignoring !quiz for unknown room {room_id}.")
     if sub_command == 'on':
         if not args: return reply_to_room(room_id, "Usage: `!quiz on <bot_username>`")
-        quiz_bot_username = args[0].lower(); bot_state.quiz_solvers[room_id] = quiz_bot_username
+        quiz_bot_username = args[0].lower(); room.quiz_bot = quiz_bot_username
         start_cycle_for_room(room_id, show_message=False)
         reply_to_room(room_id, f"✅ Quiz solver & Cycle mode enabled for '{quiz_bot_username}'.")
+        schedule_warm_state_save()
     elif sub_command == 'off':
-        if room_id in bot_state.quiz_solvers:
+        if room.quiz_bot:
             stop_cycle_for_room(room_id, show_message=False)
-            del bot_state.quiz_solvers[room_id]
-            if room_id in bot_state.processed_question_ids: del bot_state.processed_question_ids[room_id]
+            room.quiz_bot = room.last_question_id = None
             reply_to_room(room_id, "✅ Quiz solver & Cycle mode disabled.")
+            schedule_warm_state_save()
         else: reply_to_room(room_id, "ℹ️ Quiz solver is not active in this room.")
     else: reply_to_room(room_id, "Usage: `!quiz on <bot>` or `!quiz off`")
 def handle_delay_command(args, room_id):
@@ -479,162 +2109,602 @@ def handle_delay_command(args, room_id):
         reply_to_room(room_id, f"✅ Delay updated to `{n_min}ms - {n_max}ms`.")
     except ValueError: reply_to_room(room_id, "❌ Error: Invalid numbers.")
 def handle_cycle_command(sub_command, room_id):
+    room = bot_state.rooms.get(room_id)
     if sub_command == 'on':
-        if room_id not in bot_state.quiz_solvers: reply_to_room(room_id, "ℹ️ Quiz must be on to start cycle manually.")
-        elif room_id in bot_state.cycle_timers: reply_to_room(room_id, "ℹ️ Cycle already on.")
-        else: start_cycle_for_room(room_id)
+        if not (room and room.quiz_bot): reply_to_room(room_id, "ℹ️ Quiz must be on to start cycle manually.")
+        elif room.cycle_phase: reply_to_room(room_id, "ℹ️ Cycle already on.")
+        else: start_cycle_for_room(room_id); schedule_warm_state_save()
     elif sub_command == 'off':
-        if room_id not in bot_state.cycle_timers: reply_to_room(room_id, "ℹ️ Cycle not active.")
-        else: stop_cycle_for_room(room_id); reply_to_room(room_id, "✅ Cycle mode deactivated.")
+        if not (room and room.cycle_phase): reply_to_room(room_id, "ℹ️ Cycle not active.")
+        else: stop_cycle_for_room(room_id); reply_to_room(room_id, "✅ Cycle mode deactivated."); schedule_warm_state_save()
     else: reply_to_room(room_id, "Usage: `!cycle on|off`")
 
-def process_command(sender, room_id, message_text):
-    try: parts = shlex.split(message_text.strip())
-    except ValueError: parts = message_text.strip().split()
-    command, args = parts[0][1:].lower(), parts[1:]
-    is_master = sender['name'].lower() in bot_state.masters
-    if command == 'help': handle_help(room_id)
-    elif command == 'j':
-        if args: join_room(" ".join(args))
-        else: reply_to_room(room_id, "Usage: `!j <room>`")
-    elif is_master:
-        if command == 'status': handle_status_command(room_id)
-        elif command == 'quiz': handle_quiz_command(args[0] if args else '', args[1:], room_id)
-        elif command == 'delay': handle_delay_command(args, room_id)
-        elif command == 'cycle': handle_cycle_command(args[0] if args else '', room_id)
-        elif command == 'roamer': handle_roamer_command(args[0] if args else '', room_id)
-        elif command == 'roamlog': handle_roamlog_command(room_id)
-        elif command == 'roamnow': handle_roamnow_command(args, room_id)
+# ========================================================================================
+# === COMMAND ROUTER =====================================================================
+# ========================================================================================
+# route_command drops unknown, unauthorized and rate-limited commands on the frame thread; accepted ones
+# run on the dispatcher. COMMANDS also generates !help.
+class CommandSpec:
+    __slots__ = ('name', 'run', 'usage', 'section', 'master_only', 'cost')
+    def __init__(self, name, run, usage, section, master_only=True, cost=1.0):
+        self.name, self.run, self.usage, self.section, self.master_only, self.cost = name, run, usage, section, master_only, cost
+
+class KeyedRateLimiter:
+    # One token bucket per key, created full on first use. Buckets that have refilled are
+    # pruned once the table grows past max_keys, so a stream of new senders stays bounded.
+    def __init__(self, rate_per_minute, burst, max_keys=4096):
+        self.rate, self.burst, self.max_keys = rate_per_minute / 60.0, float(burst), max_keys
+        self.lock, self.buckets = threading.Lock(), {} # key -> [tokens, last_refill]
+        self.stats = {'allowed': 0, 'limited': 0}
+
+    def allow(self, key, cost=1.0):
+        now = time.monotonic()
+        with self.lock:
+            if (bucket := self.buckets.get(key)) is None:
+                if len(self.buckets) >= self.max_keys: self._prune_locked(now)
+                bucket = self.buckets[key] = [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate); bucket[1] = now
+            if bucket[0] < cost: self.stats['limited'] += 1; return False
+            bucket[0] -= cost; self.stats['allowed'] += 1
+            return True
+
+    def _prune_locked(self, now):
+        for key, (tokens, last_refill) in list(self.buckets.items()):
+            if tokens + (now - last_refill) * self.rate >= self.burst: del self.buckets[key]
+
+    def snapshot(self):
+        with self.lock: return {'keys': len(self.buckets), **self.stats}
+
+def split_command_args(arg_text):
+    try: return shlex.split(arg_text)
+    except ValueError: return arg_text.split()
+
+def split_subcommand(arg_text):
+    args = split_command_args(arg_text)
+    return (args[0] if args else ''), args[1:]
+
+COMMANDS = {spec.name: spec for spec in (
+    CommandSpec('help', lambda room_id, arg_text: handle_help(room_id), None, 'General', master_only=False),
+    CommandSpec('j', lambda room_id, arg_text: handle_join_command(split_command_args(arg_text), room_id), "`!j <room>`", 'General', master_only=False, cost=2.0),
+    CommandSpec('status', lambda room_id, arg_text: handle_status_command(room_id), "`!status`", 'Master-Only'),
+    CommandSpec('quiz', lambda room_id, arg_text: handle_quiz_command(*split_subcommand(arg_text), room_id), "`!quiz on|off`", 'Master-Only'),
+    CommandSpec('cycle', lambda room_id, arg_text: handle_cycle_command(split_subcommand(arg_text)[0], room_id), "`!cycle on|off`", 'Master-Only'),
+    CommandSpec('profile', lambda room_id, arg_text: handle_profile_command(split_command_args(arg_text), room_id), "`!profile <seconds>`", 'Master-Only'),
+    CommandSpec('delay', lambda room_id, arg_text: handle_delay_command(split_command_args(arg_text), room_id), "`!delay [min] [max]`", 'Master-Only'),
+    CommandSpec('roamer', lambda room_id, arg_text: handle_roamer_command(split_subcommand(arg_text)[0], room_id), "`!roamer on|off`", 'Roamer'),
+    CommandSpec('roamlog', lambda room_id, arg_text: handle_roamlog_command(room_id), "`!roamlog`", 'Roamer'),
+    CommandSpec('roamstats', lambda room_id, arg_text: handle_roamstats_command(room_id), "`!roamstats`", 'Roamer'),
+    CommandSpec('roamnow', lambda room_id, arg_text: handle_roamnow_command(split_command_args(arg_text), room_id), "`!roamnow <room>`", 'Roamer'),
+)}
+user_command_limiter = KeyedRateLimiter(Config.COMMAND_USER_RATE_PER_MINUTE, Config.COMMAND_USER_BURST)
+room_command_limiter = KeyedRateLimiter(Config.COMMAND_ROOM_RATE_PER_MINUTE, Config.COMMAND_ROOM_BURST)
+
+def route_command(sender, room_id, message_text):
+    if not (head := message_text[1:].split(None, 1)): return False
+    name, arg_text = head[0].lower(), (head[1] if len(head) > 1 else '')
+    if (spec := COMMANDS.get(name)) is None:
+        command_counter.inc('other'); command_rejections.inc('unknown'); return False
+    command_counter.inc(name)
+    is_master = str(sender['name']).lower() in bot_state.masters
+    if spec.master_only and not is_master: command_rejections.inc('not_master'); return False
+    if not is_master and not (user_command_limiter.allow(sender['id'], spec.cost) and room_command_limiter.allow(room_id, spec.cost)):
+        command_rejections.inc('rate_limited')
+        logging.debug(f"[Commands] Rate limited !{name} from '{sender['name']}' in room {room_id}.")
+        return False
+    dispatcher.submit(('cmd', room_id), run_command, spec, room_id, arg_text)
+    return True
+
+def run_command(spec, room_id, arg_text):
+    started = time.perf_counter()
+    try: spec.run(room_id, arg_text)
+    finally: command_seconds.observe(time.perf_counter() - started, spec.name)
+
+# ========================================================================================
+# === INBOUND FRAME CLASSIFIER ===========================================================
+# ========================================================================================
+# Frames we have no use for (pings, presence, chat in idle rooms) are dropped by a regex peek before json_loads.
+FRAME_HANDLER_RE = re.compile(r'"handler"\s*:\s*"([^"]*)"')
+FRAME_FIELD_RES = {field: re.compile(r'"%s"\s*:\s*("?)([^",}\s]*)\1' % field) for field in ('roomid', 'userid')}
+FRAME_COMMAND_TEXT_RE = re.compile(r'"text"\s*:\s*"\s*!')
+HANDLED_FRAME_TYPES = {"login", "chatroomplus", "joinchatroom", "userkicked", "chatroommessage"}
+frame_counts, frame_skipped, frame_bytes = Counter(), Counter(), Counter()
+
+def peek_frame_handler(message_str):
+    match = FRAME_HANDLER_RE.search(message_str, 0, Config.FRAME_PEEK_CHARS) or FRAME_HANDLER_RE.search(message_str)
+    return match.group(1) if match else None
+
+def peek_frame_field(message_str, field):
+    if not (match := FRAME_FIELD_RES[field].search(message_str)): return None
+    quoted, raw = match.groups()
+    if quoted: return raw
+    try: return int(raw)
+    except ValueError: return raw
+
+def should_decode_frame(handler, message_str):
+    if handler not in HANDLED_FRAME_TYPES: return False
+    if handler == "userkicked": return str(peek_frame_field(message_str, 'userid')) == str(bot_state.bot_user_id)
+    if handler == "chatroommessage":
+        room = bot_state.rooms.get(peek_frame_field(message_str, 'roomid'))
+        return ((room is not None and (room.quiz_bot is not None or room.prize_future is not None))
+                or FRAME_COMMAND_TEXT_RE.search(message_str) is not None)
+    return True
 
 # ========================================================================================
 # === WEBSOCKET HANDLERS & MAIN ==========================================================
 # ========================================================================================
 def on_open(ws):
     logging.info("🚀 WebSocket connection opened. Logging in...")
-    bot_state.is_connected = True; bot_state.reconnect_delay = Config.INITIAL_RECONNECT_DELAY
-    send_ws_message({"handler": "login", "username": Config.BOT_USERNAME, "password": Config.BOT_PASSWORD, "token": bot_state.token})
+    bot_state.is_connected = True; startup_profile.mark('connected')
+    send_ws_message_now({"handler": "login", "username": Config.BOT_USERNAME, "password": Config.BOT_PASSWORD, "token": bot_state.token})
 def on_message(ws, message_str):
-    if '"handler":"ping"' in message_str: return
+    started, context = time.perf_counter(), log_context.set((None, None))
+    try: handle_frame(message_str)
+    finally:
+        on_message_seconds.observe(time.perf_counter() - started); log_context.reset(context)
+def handle_frame(message_str):
+    handler = peek_frame_handler(message_str)
+    frame_counts[handler] += 1; frame_bytes[handler] += len(message_str)
+    if not should_decode_frame(handler, message_str):
+        frame_skipped[handler] += 1; return
     try:
-        data = json.loads(message_str)
+        data = json_loads(message_str)
         handler = data.get("handler")
+        log_context.set((handler, data.get('roomid')))
         if handler == "login" and data.get("status") == "success":
             bot_state.bot_user_id = data.get('userID')
             logging.info(f"✅ Login successful! Bot ID: {bot_state.bot_user_id}.")
-            load_visited_rooms_from_db()
-            threading.Thread(target=join_startup_rooms, daemon=True).start()
+            bot_state.reconnect_delay = Config.INITIAL_RECONNECT_DELAY; startup_profile.mark('logged_in')
+            outbound.set_online(True)
+            dispatcher.submit(('db', 'roam'), load_visited_rooms_from_db)
+            bot_state.engine.spawn(resume_session)
+            schedule_warm_state_save()
+        elif handler == "login":
+            logging.error(f"🔴 Login rejected: {data.get('message') or data.get('status')}. The token will be refreshed before reconnecting.")
+            bot_state.token_rejected = True; bot_state.engine.drop_connection()
         elif handler == "chatroomplus" and "data" in data:
-            with bot_state.roam_lock:
-                for room in data["data"]:
-                    if "name" in room and room.get("userCount", 0) > 0: bot_state.roamable_rooms.add(room["name"])
+            room_directory.observe((room["name"], room.get("userCount", 0)) for room in data["data"] if "name" in room)
         elif handler == "joinchatroom" and data.get("error") == 0:
             room_id, room_name = data.get('roomid'), data.get('name')
-            bot_state.room_id_to_name[room_id] = room_name; bot_state.room_name_to_id[room_name.lower()] = room_id
-            logging.info(f"✅ Joined room: '{room_name}' (ID: {room_id})")
+            bot_state.rooms.add(room_id, room_name)
+            logging.info(f"✅ Joined room: '{room_name}' (ID: {room_id})", extra={'category': 'Join'})
+            startup_profile.mark('first_join')
+            join_tracker.resolve(room_name, room_id)
+            if not room_directory.is_in_flight(room_name): schedule_warm_state_save()
+        elif handler == "joinchatroom":
+            reason = data.get('message') or data.get('reason') or f"error code {data.get('error')}"
+            logging.warning(f"⚠️ Join failed for '{data.get('name', '?')}': {reason}", extra={'category': 'Join'})
+            join_tracker.fail(data.get('name'), reason)
         elif handler == "userkicked" and data.get("userid") == bot_state.bot_user_id:
-            room_id = data.get('roomid')
-            if room_id in bot_state.quiz_solvers: del bot_state.quiz_solvers[room_id]
-            if room_id in bot_state.processed_question_ids: del bot_state.processed_question_ids[room_id]
-            if room_id in bot_state.cycle_timers: stop_cycle_for_room(room_id, show_message=False)
-            if room_name := bot_state.room_id_to_name.pop(room_id, None):
-                bot_state.room_name_to_id.pop(room_name.lower(), None)
+            if room := bot_state.rooms.remove(data.get('roomid')):
+                room_name = room.name; schedule_warm_state_save()
                 if room_name.lower() in {name.strip().lower() for name in Config.ROOMS_TO_JOIN.split(',')}:
-                    logging.warning(f"⚠️ Kicked from startup room '{room_name}'. Rejoining..."); time.sleep(Config.REJOIN_ON_KICK_DELAY_SECONDS)
-                    join_room(room_name, source='startup_join')
+                    logging.warning(f"⚠️ Kicked from startup room '{room_name}'. Rejoining...")
+                    bot_state.engine.call_later(Config.REJOIN_ON_KICK_DELAY_SECONDS, join_room, room_name, 'startup_join')
                 else: logging.warning(f"⚠️ Kicked from '{room_name}'. Not a startup room.")
         elif handler == "chatroommessage":
             room_id, text, user_id, username = data.get('roomid'), data.get('text', '').strip(), data.get('userid'), data.get('username')
-            if room_id == bot_state.listening_for_prize_in_room:
-                prize = extract_prize(text, Config.BOT_USERNAME)
-                if prize and bot_state.prize_found_event: bot_state.last_prize_won = prize; bot_state.prize_found_event.set()
+            room = bot_state.rooms.get(room_id)
+            if room and (prize_future := room.prize_future) and not prize_future.done():
+                if prize := extract_prize(text, Config.BOT_USERNAME):
+                    try: prize_future.set_result(prize)
+                    except concurrent.futures.InvalidStateError: pass
             if str(user_id) == str(bot_state.bot_user_id): return
-            if text.startswith('!'): threading.Thread(target=process_command, args=({'id': user_id, 'name': username}, room_id, text), daemon=True).start()
-            if room_id in bot_state.quiz_solvers: threading.Thread(target=process_quiz_message, args=(room_id, text, username), daemon=True).start()
-    except (json.JSONDecodeError, Exception) as e: logging.error(f"Error in on_message: {e}", exc_info=True)
-def on_error(ws, error): logging.error(f"--- WebSocket Error: {error} ---")
+            if text.startswith('!'): route_command({'id': user_id, 'name': username}, room_id, text)
+            if room and room.quiz_bot: dispatcher.submit(('quiz', room_id), process_quiz_message, room, text, username, time.monotonic())
+    except (ValueError, Exception) as e: logging.error(f"Error in on_message: {e}", exc_info=True, extra={'category': 'Frame'})
+def on_error(ws, error):
+    logging.error(f"--- WebSocket Error: {error} ---")
+    if is_auth_rejection(error): bot_state.token_rejected = True
 def on_close(ws, close_status_code, close_msg):
-    bot_state.is_connected = False
+    was_connected, bot_state.is_connected = bot_state.is_connected, False
+    outbound.set_online(False); join_tracker.fail_all("disconnected")
     if bot_state.stop_bot_event.is_set(): logging.info("--- Bot gracefully stopped by web panel. ---")
-    else:
-        logging.warning(f"--- WebSocket closed unexpectedly. Reconnecting in {bot_state.reconnect_delay}s... ---")
-        if not bot_state.stop_bot_event.is_set():
-          time.sleep(bot_state.reconnect_delay)
-          bot_state.reconnect_delay = min(bot_state.reconnect_delay * 2, Config.MAX_RECONNECT_DELAY)
-          # We don't call start_bot_logic() here, the main loop handles it.
+    elif was_connected:
+        bot_state.disconnected_at = bot_state.disconnected_at or time.time()
+        snapshot_session()
+# Reconnect backoff is applied exactly once, here (or in AsyncioEngine.main), never in on_close.
 def connect_to_howdies():
-    bot_state.token = get_token()
-    if not bot_state.token or bot_state.stop_bot_event.is_set():
-        logging.error("Could not get token or stop event was set."); bot_state.is_connected = False; return
-    ws_url = f"{Config.WS_URL}?token={bot_state.token}"
-    ws_app = websocket.WebSocketApp(ws_url, header=Config.BROWSER_HEADERS, on_open=on_open, on_message=on_message, on_error=on_error, on_close=on_close)
-    bot_state.ws_instance = ws_app
+    import websocket
     while not bot_state.stop_bot_event.is_set():
-        ws_app.run_forever(ping_interval=30, ping_timeout=10) # Added keep-alive pings
+        if not (ws_url := session_ws_url()):
+            if not bot_state.token: logging.error("Could not get token. Stopping."); break
+        else:
+            ws_app = websocket.WebSocketApp(ws_url, header=Config.BROWSER_HEADERS, on_open=on_open, on_message=on_message, on_error=on_error, on_close=on_close)
+            bot_state.ws_instance = ws_app
+            ws_app.run_forever(ping_interval=30, ping_timeout=10) # Added keep-alive pings
         if bot_state.stop_bot_event.is_set(): break
-        logging.info("WebSocket connection ended. Will try to reconnect if not stopped.")
-        time.sleep(bot_state.reconnect_delay)
+        delay = next_reconnect_delay()
+        logging.warning(f"--- WebSocket closed unexpectedly. Reconnecting in {delay:.1f}s... ---")
+        bot_state.stop_bot_event.wait(delay)
     bot_state.is_connected = False; bot_state.ws_instance = None
     logging.info("Bot's run_forever loop has ended.")
 
+# ========================================================================================
+# === BOT ENGINES ========================================================================
+# ========================================================================================
+# Both engines expose run(), call_later() and spawn(); Config.BOT_ENGINE picks one at startup.
+class ThreadedEngine:
+    name = "threaded"
+    def __init__(self):
+        self.scheduler = timer_scheduler
+        self.scheduler.start()
+    def run(self): connect_to_howdies()
+    def drop_connection(self):
+        if bot_state.ws_instance: bot_state.ws_instance.close()
+    def call_later(self, delay, fn, *args, key=None): return self.scheduler.call_later(delay, fn, *args, key=key)
+    def spawn(self, coro_fn, *args):
+        loop = asyncio.new_event_loop()
+        def run_loop():
+            asyncio.set_event_loop(loop)
+            try: loop.run_forever()
+            finally:
+                pending = asyncio.all_tasks(loop)
+                for task in pending: task.cancel()
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+                loop.close()
+        async def run_then_stop(): # stopping from the loop side lets a cancel() reach the task before the loop closes
+            try: return await coro_fn(*args)
+            finally: loop.stop()
+        threading.Thread(target=run_loop, name=f"task-{coro_fn.__name__}", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(run_then_stop(), loop)
+
+class AsyncioEngine:
+    name = "asyncio"
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.scheduler = LoopScheduler(self.loop)
+        self.ws, self.stopped, self.connect = None, None, None
+    def run(self):
+        try: from websockets.asyncio.client import connect as websockets_connect
+        except ImportError:
+            logging.critical("🔴 BOT_ENGINE=asyncio requires the 'websockets' package (pip install websockets)."); return
+        self.connect = websockets_connect
+        try: self.loop.run_until_complete(self.main())
+        finally:
+            bot_state.is_connected = False; bot_state.ws_instance = None
+            self.loop.close()
+            logging.info("Bot's asyncio loop has ended.")
+    async def main(self):
+        self.stopped = asyncio.Event()
+        bot_state.ws_instance = self
+        while not bot_state.stop_bot_event.is_set():
+            if not (ws_url := await asyncio.to_thread(session_ws_url)):
+                if not bot_state.token: logging.error("Could not get token. Stopping."); break
+            else:
+                try:
+                    async with self.connect(ws_url, origin=Config.BROWSER_HEADERS.get("Origin"), user_agent_header=Config.BROWSER_HEADERS.get("User-Agent"),
+                                                  ping_interval=30, ping_timeout=10) as ws:
+                        self.ws = ws
+                        on_open(self)
+                        async for message_str in ws: on_message(self, message_str)
+                except Exception as e: on_error(self, e)
+                self.ws = None
+                on_close(self, None, None)
+            if bot_state.stop_bot_event.is_set(): break
+            delay = next_reconnect_delay()
+            logging.warning(f"--- WebSocket closed unexpectedly. Reconnecting in {delay:.1f}s... ---")
+            try: await asyncio.wait_for(self.stopped.wait(), timeout=delay)
+            except asyncio.TimeoutError: pass
+    def send(self, text):
+        self.loop.call_soon_threadsafe(self._send_now, text)
+    def _send_now(self, text):
+        if self.ws: self.loop.create_task(self._send(self.ws, text))
+    async def _send(self, ws, text):
+        try: await ws.send(text)
+        except Exception as e: logging.error(f"Error sending message: {e}", extra={'category': 'WS'})
+    def close(self):
+        def close_now():
+            if self.stopped: self.stopped.set()
+            if self.ws: self.loop.create_task(self.ws.close())
+        if self.loop and not self.loop.is_closed(): self.loop.call_soon_threadsafe(close_now)
+    def drop_connection(self):
+        if self.loop and not self.loop.is_closed(): self.loop.call_soon_threadsafe(lambda: self.ws and self.loop.create_task(self.ws.close()))
+    def call_later(self, delay, fn, *args, key=None): return self.scheduler.call_later(delay, fn, *args, key=key)
+    def spawn(self, coro_fn, *args): return asyncio.run_coroutine_threadsafe(coro_fn(*args), self.loop)
+
+def create_engine():
+    engine = AsyncioEngine() if Config.BOT_ENGINE == "asyncio" else ThreadedEngine()
+    logging.info(f"⚙️ Using the {engine.name} bot engine.")
+    return engine
+
 # ========================================================================================
 # === QUIZ SOLVER LOGIC ==================================================================
 # ========================================================================================
+# Problems compile to closures over a restricted AST. Linear unknowns are solved exactly with Fractions,
+# anything else by a numeric root search whose result is verified exactly.
+class NonLinearError(ValueError): pass
+
+class LinearTerm:
+    __slots__ = ('a', 'b')
+    def __init__(self, a, b): self.a, self.b = a, b
+    @staticmethod
+    def make(a, b): return LinearTerm(a, b) if a else b
+    @staticmethod
+    def split(value): return (value.a, value.b) if isinstance(value, LinearTerm) else (0, value)
+    def __add__(self, other): a, b = LinearTerm.split(other); return LinearTerm.make(self.a + a, self.b + b)
+    __radd__ = __add__
+    def __sub__(self, other): a, b = LinearTerm.split(other); return LinearTerm.make(self.a - a, self.b - b)
+    def __rsub__(self, other): a, b = LinearTerm.split(other); return LinearTerm.make(a - self.a, b - self.b)
+    def __neg__(self): return LinearTerm(-self.a, -self.b)
+    def __pos__(self): return self
+    def __mul__(self, other):
+        if isinstance(other, LinearTerm): raise NonLinearError("product of unknowns")
+        return LinearTerm.make(self.a * other, self.b * other)
+    __rmul__ = __mul__
+    def __truediv__(self, other):
+        if isinstance(other, LinearTerm): raise NonLinearError("division by unknown")
+        return LinearTerm.make(self.a / other, self.b / other)
+    def __rtruediv__(self, other): raise NonLinearError("division by unknown")
+    def __pow__(self, other):
+        if other == 1: return self
+        if other == 0: return Fraction(1)
+        raise NonLinearError("power of unknown")
+    def __rpow__(self, other): raise NonLinearError("unknown exponent")
+    def __floordiv__(self, other): raise NonLinearError("floor division of unknown")
+    __rfloordiv__ = __mod__ = __rmod__ = __floordiv__
+
+def quiz_pow(base, exponent):
+    if isinstance(exponent, LinearTerm) or isinstance(base, LinearTerm): return base ** exponent
+    if exponent != int(exponent) or abs(exponent) > Config.QUIZ_MAX_EXPONENT: raise ValueError("unsupported exponent")
+    base = Fraction(base)
+    if max(base.numerator.bit_length(), base.denominator.bit_length()) * abs(int(exponent)) > Config.QUIZ_MAX_RESULT_BITS: raise ValueError("result too large")
+    return base ** int(exponent)
+
+QUIZ_BINARY_OPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+                   ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: quiz_pow}
+QUIZ_UNARY_OPS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+QUIZ_UNKNOWN = 'Q'
+
+def compile_quiz_node(node):
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        constant = Fraction(str(node.value))
+        return lambda q: constant
+    if isinstance(node, ast.Name) and node.id == QUIZ_UNKNOWN: return lambda q: q
+    if isinstance(node, ast.BinOp) and (op := QUIZ_BINARY_OPS.get(type(node.op))):
+        left, right = compile_quiz_node(node.left), compile_quiz_node(node.right)
+        return lambda q: op(left(q), right(q))
+    if isinstance(node, ast.UnaryOp) and (op := QUIZ_UNARY_OPS.get(type(node.op))):
+        operand = compile_quiz_node(node.operand)
+        return lambda q: op(operand(q))
+    raise ValueError(f"unsupported syntax: {type(node).__name__}")
+
+def compile_quiz_expression(expr_str):
+    if len(expr_str) > Config.QUIZ_MAX_EXPRESSION_LENGTH: raise ValueError("expression too long")
+    return compile_quiz_node(ast.parse(expr_str.strip(), mode='eval').body)
+
+def as_quiz_number(value):
+    value = Fraction(value)
+    return value.numerator if value.denominator == 1 else value
+
+def format_quiz_answer(answer):
+    if isinstance(answer, Fraction):
+        decimal = f"{float(answer):.4f}".rstrip('0').rstrip('.')
+        return decimal if Fraction(decimal) == answer else f"{answer.numerator}/{answer.denominator}"
+    return str(answer)
+
+def solve_quiz_numerically(left_fn, right_fn):
+    def residual(q):
+        try: return float(left_fn(q) - right_fn(q))
+        except (ArithmeticError, ValueError): return None
+    def is_exact_root(candidate):
+        try: return left_fn(candidate) == right_fn(candidate)
+        except (ArithmeticError, ValueError): return False
+    roots, previous = set(), None
+    for q in QUIZ_NUMERIC_GRID:
+        value = residual(q)
+        if value is None: previous = None; continue
+        if value == 0: roots.add(q)
+        elif previous and (previous[1] < 0) != (value < 0):
+            lo, hi, lo_val = previous[0], q, previous[1]
+            for _ in range(100):
+                mid = (lo + hi) / 2
+                mid_val = residual(mid)
+                if mid_val is None or mid_val == 0: break
+                if (lo_val < 0) == (mid_val < 0): lo, lo_val = mid, mid_val
+                else: hi = mid
+            roots.add((lo + hi) / 2)
+        previous = (q, value)
+    exact = set()
+    for root in roots:
+        for candidate in (Fraction(round(root)), Fraction(root).limit_denominator(1000)):
+            if is_exact_root(candidate): exact.add(candidate); break
+    if not exact: return None
+    return as_quiz_number(min(exact, key=lambda r: (abs(r), r < 0)))
+
+QUIZ_NUMERIC_GRID = sorted({0.0} | {sign * step for sign in (1, -1) for step in
+                            [i / 4 for i in range(1, 41)] + [float(i) for i in range(11, 101)] +
+                            [float(m * 10 ** e) for e in range(2, 7) for m in range(1, 10)]})
+
 def solve_math_problem(problem_str):
     try:
         problem_str = problem_str.replace('x', '*').replace('X', '*').replace('÷', '/').strip()
         if '=' not in problem_str: return None
         left, right = problem_str.split('=', 1)
-        safe_dict = {"__builtins__": {}}
-        if '?' in right: return int(eval(left, safe_dict, {}))
+        if '?' in right: return as_quiz_number(compile_quiz_expression(left)(None))
         if '?' in left:
-            right_val = int(eval(right, safe_dict, {}))
-            for i in range(-2000, 2000):
-                try:
-                    if int(eval(left.replace('?', str(i)), safe_dict, {})) == right_val: return i
-                except: continue
+            left_fn, right_fn = compile_quiz_expression(left.replace('?', QUIZ_UNKNOWN)), compile_quiz_expression(right)
+            try:
+                difference = left_fn(LinearTerm(Fraction(1), Fraction(0))) - right_fn(None)
+                return as_quiz_number(-difference.b / difference.a) if isinstance(difference, LinearTerm) else None
+            except NonLinearError:
+                return solve_quiz_numerically(left_fn, right_fn)
         return None
-    except Exception: return None
+    except (ValueError, TypeError, SyntaxError, ArithmeticError, RecursionError): return None
+
+# --- Solver cache --- LRU keyed on a canonical form, so "3 x ?" and "?*3" share an entry.
+QUIZ_OP_SYMBOLS = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.FloorDiv: '//', ast.Mod: '%', ast.Pow: '**'}
+
+def canonical_quiz_node(node):
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float): return str(Fraction(str(node.value)))
+    if isinstance(node, ast.Name) and node.id == QUIZ_UNKNOWN: return QUIZ_UNKNOWN
+    if isinstance(node, ast.UnaryOp) and type(node.op) in QUIZ_UNARY_OPS:
+        return f"({'-' if isinstance(node.op, ast.USub) else '+'}{canonical_quiz_node(node.operand)})"
+    if isinstance(node, ast.BinOp) and (symbol := QUIZ_OP_SYMBOLS.get(type(node.op))):
+        if isinstance(node.op, (ast.Add, ast.Mult)):
+            terms, stack = [], [node]
+            while stack:
+                current = stack.pop()
+                if isinstance(current, ast.BinOp) and type(current.op) is type(node.op): stack.extend((current.left, current.right))
+                else: terms.append(canonical_quiz_node(current))
+            return f"({symbol.join(sorted(terms))})"
+        return f"({canonical_quiz_node(node.left)}{symbol}{canonical_quiz_node(node.right)})"
+    raise ValueError(f"unsupported syntax: {type(node).__name__}")
+
+def normalize_quiz_problem(problem_str):
+    text = ''.join(problem_str.replace('x', '*').replace('X', '*').replace('÷', '/').split())
+    try: return '='.join(canonical_quiz_node(ast.parse(side.replace('?', QUIZ_UNKNOWN), mode='eval').body) for side in text.split('=', 1))
+    except (SyntaxError, ValueError, RecursionError): return text
+
+class SolverCache:
+    def __init__(self, max_size, path=None):
+        self.max_size, self.path = max_size, path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = self.unsaved = 0
+        self.loaded = False
+
+    def solve(self, problem_str):
+        key = normalize_quiz_problem(problem_str)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key); self.hits += 1
+                return self.entries[key]
+        answer = solve_math_problem(problem_str)
+        with self.lock:
+            self.misses += 1; self.unsaved += 1
+            self.entries[key] = answer
+            while len(self.entries) > self.max_size: self.entries.popitem(last=False); self.evictions += 1
+            save_due = self.path and self.unsaved >= Config.QUIZ_CACHE_SAVE_EVERY
+        if save_due: dispatcher.submit(('cache', 'save'), self.save)
+        return answer
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': (self.hits / lookups) if lookups else 0.0}
+
+    def load(self):
+        if self.loaded or not self.path: return
+        self.loaded = True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: stored = json.load(f)
+        except FileNotFoundError: return
+        except (OSError, ValueError) as e: logging.error(f"[Solver Cache] Could not load '{self.path}': {e}"); return
+        with self.lock:
+            for key, answer in stored.items():
+                self.entries[key] = as_quiz_number(Fraction(answer)) if answer is not None else None
+            while len(self.entries) > self.max_size: self.entries.popitem(last=False)
+        logging.info(f"[Solver Cache] Loaded {len(stored)} solved problems from '{self.path}'.")
+
+    def save(self):
+        if not self.path: return
+        with self.lock:
+            stored = {key: (str(answer) if answer is not None else None) for key, answer in self.entries.items()}
+            self.unsaved = 0
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(stored, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e: logging.error(f"[Solver Cache] Could not save '{self.path}': {e}")
+
+solver_cache = SolverCache(Config.QUIZ_CACHE_SIZE, Config.QUIZ_CACHE_FILE)
+
 def is_simple_equation(problem_str):
     problem_str = problem_str.strip()
     if '=' not in problem_str: return False
     if any(op in problem_str for op in ['+', '-', '*', '/']): return True
     if re.fullmatch(r'[\d\s\?]+', problem_str.replace('-', ' ')): return False
     return True
-def process_quiz_message(room_id, text, username):
-    if time.time() < bot_state.break_end_times.get(room_id, 0): return
-    quiz_bot_username = bot_state.quiz_solvers.get(room_id)
+# --- Quiz line classifier --- One literal-anchor regex pass per line; end of round > hint > question.
+# Extra quiz-bot formats can be added via QUIZ_PATTERNS_FILE (same keys as DEFAULT_QUIZ_PATTERNS).
+DEFAULT_QUIZ_PATTERNS = {
+    "end_of_round": ['The answer was', 'New Record', 'Lightning Fast', 'Hat-trick', 'Right Answer', 'Too Slow', 'Late', 'Super', 'Speedy'],
+    "hint": [{"anchor": "hint", "pattern": r'Hint\s*:\s*(.*)', "ignore_case": True}],
+    "question_id": [{"anchor": "#", "pattern": r'#(\d+)'}],
+    "problem": [r'\*\s*(?:M[аa]ths|Maths)\s*-\s*(.*?)\s*\*'],
+}
+
+class QuizLine:
+    __slots__ = ('kind', 'question_id', 'problem')
+    def __init__(self, kind, question_id=None, problem=None): self.kind, self.question_id, self.problem = kind, question_id, problem
+
+QUIZ_LINE_IGNORE, QUIZ_LINE_END_OF_ROUND = QuizLine('ignore'), QuizLine('end_of_round')
+
+class QuizClassifier:
+    def __init__(self, patterns):
+        self.anchors = {}
+        for phrase in patterns.get("end_of_round", []): self.anchors.setdefault(phrase, []).append(("end_of_round", None))
+        for kind in ("hint", "question_id"):
+            for rule in patterns.get(kind, []):
+                ignore_case = rule.get("ignore_case", False)
+                extractor = re.compile(rule["pattern"], re.IGNORECASE if ignore_case else 0)
+                spellings = {rule["anchor"].lower(), rule["anchor"].title(), rule["anchor"].upper()} if ignore_case else {rule["anchor"]}
+                for spelling in spellings: self.anchors.setdefault(spelling, []).append((kind, extractor))
+        self.regex = re.compile("|".join(re.escape(anchor) for anchor in sorted(self.anchors, key=len, reverse=True)))
+        self.problem_res = [re.compile(pattern, re.DOTALL) for pattern in patterns.get("problem", [])]
+
+    def classify(self, text):
+        hint = question_id = None
+        for match in self.regex.finditer(text):
+            for kind, extractor in self.anchors[match.group()]:
+                if kind == "end_of_round": return QUIZ_LINE_END_OF_ROUND
+                if (hint if kind == "hint" else question_id) is not None: continue
+                if not (found := extractor.match(text, match.start())): continue
+                if kind == "hint": hint = found.group(1).strip()
+                else: question_id = int(found.group(1))
+        if hint is not None: return QuizLine('hint', problem=hint)
+        if question_id is not None:
+            problem = next((found.group(1).strip() for regex in self.problem_res if (found := regex.search(text))), None)
+            return QuizLine('question', question_id, problem)
+        return QUIZ_LINE_IGNORE
+
+def load_quiz_patterns(path=None):
+    patterns = {kind: list(rules) for kind, rules in DEFAULT_QUIZ_PATTERNS.items()}
+    if not path: return patterns
+    try:
+        with open(path, 'r', encoding='utf-8') as f: extra = json.load(f)
+        for kind, rules in extra.items():
+            if kind in patterns: patterns[kind].extend(rules)
+            else: logging.warning(f"[Quiz] Unknown pattern kind '{kind}' in '{path}'.")
+        logging.info(f"[Quiz] Loaded extra quiz patterns from '{path}'.")
+    except (OSError, ValueError) as e: logging.error(f"[Quiz] Could not load quiz patterns from '{path}': {e}")
+    return patterns
+
+quiz_classifier = QuizClassifier(load_quiz_patterns(Config.QUIZ_PATTERNS_FILE))
+
+def process_quiz_message(room, text, username, received_at=None):
+    if room.cycle_phase == 'break': return
+    quiz_bot_username, room_id = room.quiz_bot, room.room_id
     if not (quiz_bot_username and username.lower() == quiz_bot_username.lower()): return
-    end_of_round_patterns = ['The answer was', 'New Record', 'Lightning Fast', 'Hat-trick', 'Right Answer', 'Too Slow', 'Late', 'Super', 'Speedy']
-    if any(pattern in text for pattern in end_of_round_patterns):
-        if room_id in bot_state.processed_question_ids: del bot_state.processed_question_ids[room_id]
+    line = quiz_classifier.classify(text)
+    if line.kind == 'end_of_round':
+        room.last_question_id = None
         return
-    hint_match = re.search(r'Hint\s*:\s*(.*)', text, re.IGNORECASE)
-    if hint_match:
-        problem = hint_match.group(1).strip()
-        answer = solve_math_problem(problem)
-        if answer is not None: threading.Thread(target=send_delayed_quiz_answer, args=(room_id, str(abs(answer))), daemon=True).start()
+    if line.kind == 'hint':
+        answer = solver_cache.solve(line.problem)
+        if answer is not None: send_delayed_quiz_answer(room_id, format_quiz_answer(abs(answer)), received_at)
         return
-    question_id_match = re.search(r'(?:Question\s*#|#)(\d+)', text)
-    if question_id_match:
-        question_id = int(question_id_match.group(1))
-        if bot_state.processed_question_ids.get(room_id) == question_id: return
-        bot_state.processed_question_ids[room_id] = question_id
-        problem_match = re.search(r'\*\s*(?:M[аa]ths|Maths)\s*-\s*(.*?)\s*\*', text, re.DOTALL)
-        if not problem_match: return
-        problem = problem_match.group(1).strip()
-        if is_simple_equation(problem):
-            answer = solve_math_problem(problem)
-            if answer is not None: threading.Thread(target=send_delayed_quiz_answer, args=(room_id, str(answer)), daemon=True).start()
-            else: reply_to_room(room_id, ".h")
-        else: reply_to_room(room_id, ".h")
+    if line.kind == 'question':
+        if room.last_question_id == line.question_id: return
+        room.last_question_id = line.question_id
+        if not line.problem: return
+        if is_simple_equation(line.problem):
+            answer = solver_cache.solve(line.problem)
+            if answer is not None: send_delayed_quiz_answer(room_id, format_quiz_answer(answer), received_at)
+            else: reply_to_room(room_id, ".h", SEND_PRIORITY_ANSWER)
+        else: reply_to_room(room_id, ".h", SEND_PRIORITY_ANSWER)
 
 # ========================================================================================
 # === MAIN EXECUTION BLOCK ===============================================================
 # ========================================================================================
 setup_logging()
 load_masters()
+startup_profile.mark('module_ready')
 
 if __name__ == "__main__":
-    logging.info(f"--- Starting Web Panel for {Config.BOT_USERNAME} ---")
-    logging.info(f"Open your browser to http://127.0.0.1:5000 to control the bot.")
-    app.run(host='0.0.0.0', port=5000)
+    if sys.argv[1:2] == ["supervisor"]: run_supervisor()
+    else:
+        logging.info(f"--- Starting Web Panel for {Config.BOT_USERNAME} ({bot_control.mode} bot) ---")
+        logging.info(f"Open your browser to http://127.0.0.1:5000 to control the bot.")
+        app.run(host='0.0.0.0', port=5000)
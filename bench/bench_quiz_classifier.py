@@ -0,0 +1,75 @@
+# ========================================================================================
+# === QUIZ LINE CLASSIFIER BENCHMARK =====================================================
+# ========================================================================================
+# Times the single-pass QuizClassifier against the previous sequence of checks over a
+# corpus of quiz-bot lines. Pass --corpus with one recorded line per entry (JSON list or a
+# text file with one line per row) to benchmark real traffic instead of the built-in sample.
+# Usage: python bench/bench_quiz_classifier.py [--corpus lines.txt] [--repeat N]
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app
+
+SAMPLE_CORPUS = [
+    "❓ Question #1841\n*Maths - 12 x 7 = ?*\nFirst to answer wins 10 points!",
+    "❓ Question #1842\n*Mаths - ? + 15 = 42*\nFirst to answer wins 10 points!",
+    "❓ Question #1843\n*Maths - 144 ÷ ? = 12*",
+    "❓ Question #1844\n*Science - What is the chemical symbol for gold?*",
+    "💡 Hint: 12 x 7 = ?",
+    "💡 Hint : ? + 15 = 42",
+    "⚡ Lightning Fast! yasin got it in 1.2s. The answer was 84",
+    "🎯 Right Answer! amiga +10 points",
+    "🐢 Too Slow! Nobody answered. The answer was 27",
+    "🏆 New Record! 5 in a row for yasin",
+    "🔥 Hat-trick for amiga!",
+    "Super! 3 answers in a row",
+    "Speedy answer from someone",
+    "Round 12 starting in 5 seconds...",
+    "Leaderboard: 1. yasin 120  2. amiga 95  3. bob 40",
+    "Type .h for a hint, .s to skip",
+]
+
+def legacy_classify(text):
+    end_of_round_patterns = ['The answer was', 'New Record', 'Lightning Fast', 'Hat-trick', 'Right Answer', 'Too Slow', 'Late', 'Super', 'Speedy']
+    if any(pattern in text for pattern in end_of_round_patterns): return ('end_of_round', None, None)
+    hint_match = re.search(r'Hint\s*:\s*(.*)', text, re.IGNORECASE)
+    if hint_match: return ('hint', None, hint_match.group(1).strip())
+    question_id_match = re.search(r'(?:Question\s*#|#)(\d+)', text)
+    if question_id_match:
+        problem_match = re.search(r'\*\s*(?:M[аa]ths|Maths)\s*-\s*(.*?)\s*\*', text, re.DOTALL)
+        return ('question', int(question_id_match.group(1)), problem_match.group(1).strip() if problem_match else None)
+    return ('ignore', None, None)
+
+def load_corpus(path):
+    if not path: return SAMPLE_CORPUS
+    with open(path, 'r', encoding='utf-8') as f: raw = f.read()
+    try: return json.loads(raw)
+    except ValueError: return [line for line in raw.splitlines() if line.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Quiz line classifier benchmark")
+    parser.add_argument("--corpus", help="JSON list or newline-separated file of recorded quiz lines")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    corpus = load_corpus(args.corpus)
+    mismatches = 0
+    for text in corpus:
+        line = app.quiz_classifier.classify(text)
+        if (line.kind, line.question_id, line.problem) != legacy_classify(text): mismatches += 1; print(f"MISMATCH: {text!r}")
+    results = {}
+    for name, classify in (("legacy", legacy_classify), ("classifier", app.quiz_classifier.classify)):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            for text in corpus: classify(text)
+        elapsed = time.perf_counter() - started
+        results[name] = elapsed / (args.repeat * len(corpus)) * 1e6
+        print(f"{name:<12}{results[name]:>8.2f} us/line {args.repeat * len(corpus) / elapsed:>12,.0f} lines/s")
+    print(f"speedup     {results['legacy'] / results['classifier']:>8.2f}x over {len(corpus)} lines, {mismatches} mismatches")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# ========================================================================================
+# === TRAFFIC REPLAY BENCHMARK ===========================================================
+# ========================================================================================
+# Runs the bot end to end against bench/fake_howdies.py: it logs in over HTTP, joins
+# --rooms rooms, turns the quiz solver on in each, then drives chat and quiz traffic at
+# --rate frames/s for --seconds. Traffic is synthetic by default; --corpus replays a JSONL
+# recording ({"t": seconds, "room": name or index, "username": ..., "text": ...} per line).
+# Reports inbound throughput, on_message cost, answer latency percentiles as seen by the
+# server, thread count and process memory (bot and fake server share the process).
+# Usage: python bench/bench_replay.py [--engine threaded|asyncio] [--rooms 20] [--rate 200]
+#        [--seconds 20] [--quiz-share 0.1] [--corpus traffic.jsonl] [--production-pacing]
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOCAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="bench-replay-"), "bot_state.db"))
+from fake_howdies import FakeHowdies, QUIZ_BOT
+import app
+
+CHAT_USERS = ["yasin", "amiga", "bob", "carol", "dave", "erin", "frank"]
+CHAT_LINES = ["hi all", "lol", "anyone up for a game?", "brb", "gg", "who's winning?", "nice one", "🔥🔥🔥", "good morning", "that was close"]
+
+def percentile(values, pct):
+    if not values: return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): return int(line.split()[1]) / 1024
+    except OSError: pass
+    return float('nan')
+
+def load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f: return [json.loads(line) for line in f if line.strip()]
+
+async def drive_synthetic(fake, rooms, rate, seconds, quiz_share):
+    interval, sent, deadline = 1.0 / rate, 0, time.perf_counter() + seconds
+    next_at = time.perf_counter()
+    while (now := time.perf_counter()) < deadline:
+        if now < next_at: await asyncio.sleep(next_at - now)
+        room = random.choice(rooms)
+        if random.random() < quiz_share:
+            await fake.end_round(room); await fake.ask_question(room)
+        else: await fake.say(room, random.choice(CHAT_USERS), random.choice(CHAT_LINES))
+        sent += 1; next_at += interval
+    return sent
+
+async def drive_corpus(fake, rooms, corpus, speed):
+    started, sent = time.perf_counter(), 0
+    for entry in corpus:
+        if (delay := entry.get("t", 0) / speed - (time.perf_counter() - started)) > 0: await asyncio.sleep(delay)
+        room_key = entry.get("room", 0)
+        room = rooms[room_key % len(rooms)] if isinstance(room_key, int) else fake.rooms.get(str(room_key).lower(), rooms[0])
+        text, username = entry["text"], entry.get("username", QUIZ_BOT)
+        line = app.quiz_classifier.classify(text)
+        if username == QUIZ_BOT and line.kind == 'question' and line.problem: await fake.ask_text(room, text, line.question_id)
+        else: await fake.say(room, username, text)
+        sent += 1
+    return sent
+
+def configure_bot(fake, args):
+    app.Config.LOGIN_URL, app.Config.WS_URL, app.Config.BOT_ENGINE = fake.login_url, fake.ws_url, args.engine
+    app.Config.ROOMS_TO_JOIN = ",".join(room.name for room in fake.rooms.values())
+    app.Config.QUIZ_ANSWER_DELAY_MIN_MS = app.Config.QUIZ_ANSWER_DELAY_MAX_MS = args.answer_delay_ms
+    app.Config.BOT_PASSWORD = app.Config.BOT_PASSWORD or "bench"
+    if not args.production_pacing:
+        app.outbound.rate, app.outbound.burst, app.outbound.room_min_interval, app.outbound.tokens = 10000.0, 10000, 0.0, 10000.0
+
+def on_message_totals():
+    series = app.on_message_seconds.series.get(None)
+    return (series[1], series[2]) if series else (0.0, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end replay benchmark against a fake Howdies server")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default=app.Config.BOT_ENGINE)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=200.0, help="synthetic frames per second across all rooms")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--quiz-share", type=float, default=0.1, help="fraction of synthetic frames that are quiz questions")
+    parser.add_argument("--corpus", help="JSONL recording to replay instead of synthetic traffic")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier for --corpus")
+    parser.add_argument("--answer-delay-ms", type=int, default=0, help="overrides QUIZ_ANSWER_DELAY_MIN/MAX_MS")
+    parser.add_argument("--production-pacing", action="store_true", help="keep the outbound writer's real rate limits")
+    args = parser.parse_args()
+    logging_level = app.logging.getLogger().level
+    app.logging.getLogger().setLevel(app.logging.WARNING)
+
+    fake = FakeHowdies(rooms=args.rooms).start()
+    configure_bot(fake, args)
+    app.start_bot_logic()
+    deadline = time.time() + 30
+    while len(app.bot_state.rooms) < args.rooms and time.time() < deadline: time.sleep(0.05)
+    if len(app.bot_state.rooms) < args.rooms: print(f"only {len(app.bot_state.rooms)}/{args.rooms} rooms joined; continuing")
+    for room in app.bot_state.rooms.rooms(): app.handle_quiz_command('on', [QUIZ_BOT], room.room_id)
+    time.sleep(0.5)
+
+    rooms = [room for room in fake.rooms.values() if room.members]
+    frames_before, (on_message_total, on_message_count) = sum(app.frame_counts.values()), on_message_totals()
+    fake.answer_latencies.clear(); stats_before = dict(fake.stats)
+    threads_peak, started = threading.active_count(), time.perf_counter()
+    if args.corpus: driver = fake.call(drive_corpus, fake, rooms, load_corpus(args.corpus), args.speed)
+    else: driver = fake.call(drive_synthetic, fake, rooms, args.rate, args.seconds, args.quiz_share)
+    while not driver.done():
+        threads_peak = max(threads_peak, threading.active_count()); time.sleep(0.1)
+    sent, elapsed = driver.result(), time.perf_counter() - started
+    time.sleep(1.0) # let in-flight answers land
+    frames = sum(app.frame_counts.values()) - frames_before
+    on_message_total, on_message_count = (after - before for after, before in zip(on_message_totals(), (on_message_total, on_message_count)))
+    delta = {key: fake.stats[key] - stats_before.get(key, 0) for key in fake.stats}
+    latencies_ms = [latency * 1000 for latency in fake.answer_latencies]
+    threads_now, rss_now = threading.active_count(), rss_mb()
+    app.stop_bot_logic(); fake.stop()
+    app.logging.getLogger().setLevel(logging_level)
+
+    print(f"engine       {args.engine}, {len(rooms)} rooms, {'corpus ' + args.corpus if args.corpus else f'synthetic {args.rate:.0f}/s, quiz share {args.quiz_share:.0%}'}")
+    print(f"traffic      {sent} lines driven in {elapsed:.1f}s, {frames} frames received by the bot ({frames / elapsed:,.0f}/s)")
+    if on_message_count: print(f"on_message   avg {on_message_total / on_message_count * 1e6:.1f} us over {on_message_count} frames")
+    print(f"answers      {delta['answers']} sent, {delta['correct']} correct, {delta['wrong']} wrong, {delta['hints']} hint requests")
+    print(f"latency ms   p50 {percentile(latencies_ms, 50):.1f}  p90 {percentile(latencies_ms, 90):.1f}  p99 {percentile(latencies_ms, 99):.1f}  max {max(latencies_ms, default=float('nan')):.1f}")
+    print(f"threads      {threads_now} at end, {threads_peak} peak")
+    print(f"memory       {rss_now:.1f} MB RSS, {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB peak (bot + fake server)")
+
+if __name__ == "__main__":
+    main()
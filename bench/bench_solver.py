@@ -0,0 +1,55 @@
+# ========================================================================================
+# === QUIZ SOLVER MICRO-BENCHMARK ========================================================
+# ========================================================================================
+# Compares the AST solver in app.py against the previous eval/brute-force implementation.
+# Usage: python bench/bench_solver.py [--repeat N]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app
+
+PROBLEMS = [
+    "3+4=?", "12 x 3 = ?", "144 ÷ 12 = ?", "25 - 7 x 2 = ?", "(8 + 2) x 5 = ?",
+    "? + 5 = 12", "3 x ? = 27", "? ÷ 4 = 25", "? - 9 = -3", "10 - ? = 15",
+    "2 x ? - 7 = 1993", "(? + 3) x 2 = 20", "? x ? = 49", "? x ? + 1 = 10", "100 ÷ ? = 4",
+]
+
+def legacy_solve_math_problem(problem_str):
+    try:
+        problem_str = problem_str.replace('x', '*').replace('X', '*').replace('÷', '/').strip()
+        if '=' not in problem_str: return None
+        left, right = problem_str.split('=', 1)
+        safe_dict = {"__builtins__": {}}
+        if '?' in right: return int(eval(left, safe_dict, {}))
+        if '?' in left:
+            right_val = int(eval(right, safe_dict, {}))
+            for i in range(-2000, 2000):
+                try:
+                    if int(eval(left.replace('?', str(i)), safe_dict, {})) == right_val: return i
+                except: continue
+        return None
+    except Exception: return None
+
+def time_solver(solver, problem, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat): answer = solver(problem)
+    return (time.perf_counter() - started) / repeat * 1e6, answer
+
+def main():
+    parser = argparse.ArgumentParser(description="Quiz solver micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(f"{'problem':<24}{'legacy us':>12}{'ast us':>12}{'speedup':>10}  {'legacy':>8}{'ast':>8}")
+    total_legacy = total_new = 0.0
+    for problem in PROBLEMS:
+        legacy_us, legacy_answer = time_solver(legacy_solve_math_problem, problem, args.repeat)
+        new_us, new_answer = time_solver(app.solve_math_problem, problem, args.repeat)
+        total_legacy += legacy_us; total_new += new_us
+        print(f"{problem:<24}{legacy_us:>12.1f}{new_us:>12.1f}{legacy_us / new_us:>9.1f}x  {str(legacy_answer):>8}{str(new_answer):>8}")
+    print(f"{'TOTAL':<24}{total_legacy:>12.1f}{total_new:>12.1f}{total_legacy / total_new:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
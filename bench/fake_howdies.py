@@ -0,0 +1,221 @@
+# ========================================================================================
+# === FAKE HOWDIES SERVER ================================================================
+# ========================================================================================
+# A local stand-in for api.howdies.app (POST /api/login) and app.howdies.app (WebSocket).
+# It speaks the handlers the bot uses: login, chatroomplus, joinchatroom, leaveroom,
+# chatroommessage and userkicked. Rooms have scripted quiz-bot and spin-bot users, and every
+# quiz answer the bot sends is checked and timed against the question that asked for it.
+# Used by bench_replay.py; run it on its own to point a real bot at it:
+# Usage: python bench/fake_howdies.py [--port 8765] [--rooms 20] [--quiz-interval 10]
+#        then start the bot with LOGIN_URL and WS_URL set to the printed values.
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from websockets.asyncio.server import serve
+
+QUIZ_BOT, SPIN_BOT = "quizbot", "spinbot"
+
+class FakeRoom:
+    def __init__(self, room_id, name, user_count):
+        self.id, self.name, self.user_count = room_id, name, user_count
+        self.members = set() # connections of the logged-in bot(s) in this room
+        self.question = None # (question_id, expected_answer, sent_at)
+
+class FakeHowdies:
+    def __init__(self, host="127.0.0.1", ws_port=0, http_port=0, rooms=20, bot_username="ArcadeBot"):
+        self.host, self.ws_port, self.http_port, self.bot_username = host, ws_port, http_port, bot_username
+        self.rooms = {}
+        for i in range(rooms): self.add_room(f"room{i}", random.randint(1, 40))
+        self.tokens, self.connections = set(), set()
+        self.question_ids = itertools.count(1000)
+        self.stats = {'logins': 0, 'rejected_logins': 0, 'joins': 0, 'frames_in': 0, 'frames_out': 0,
+                      'answers': 0, 'correct': 0, 'wrong': 0, 'hints': 0, 'spins': 0}
+        self.answer_latencies = []
+        self.reject_next_login = False
+        self.loop, self.ws_server, self.http_server = None, None, None
+
+    # --- lifecycle ---
+    def start(self):
+        ready = threading.Event()
+        def run():
+            self.loop = asyncio.new_event_loop(); asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start_ws()); ready.set()
+            self.loop.run_forever()
+        threading.Thread(target=run, name="fake-howdies-ws", daemon=True).start()
+        ready.wait()
+        self.http_server = ThreadingHTTPServer((self.host, self.http_port), self._http_handler())
+        self.http_port = self.http_server.server_address[1]
+        threading.Thread(target=self.http_server.serve_forever, name="fake-howdies-http", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.http_server: self.http_server.shutdown()
+        if self.loop:
+            async def close():
+                self.ws_server.close(); await self.ws_server.wait_closed()
+            asyncio.run_coroutine_threadsafe(close(), self.loop).result(timeout=5)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    @property
+    def login_url(self): return f"http://{self.host}:{self.http_port}/api/login"
+    @property
+    def ws_url(self): return f"ws://{self.host}:{self.ws_port}/"
+
+    async def _start_ws(self):
+        self.ws_server = await serve(self._handle, self.host, self.ws_port, process_request=self._dedupe_headers)
+        self.ws_port = self.ws_server.sockets[0].getsockname()[1]
+
+    @staticmethod
+    def _dedupe_headers(connection, request):
+        # websocket-client sends Origin twice when it is also passed in `header`; the real
+        # server tolerates that, websockets rejects it, so keep the first value.
+        for name in ("Origin", "User-Agent"):
+            if len(values := request.headers.get_all(name)) > 1:
+                del request.headers[name]; request.headers[name] = values[0]
+        return None
+
+    def _http_handler(self):
+        fake = self
+        class LoginHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try: body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError: body = {}
+                if self.path.rstrip("/") != "/api/login" or not body.get("username"): return self._reply(400, {"error": "bad request"})
+                token = f"fake-{body['username']}-{random.getrandbits(32):08x}"
+                fake.tokens.add(token)
+                self._reply(200, {"token": token})
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status); self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(data)))
+                self.end_headers(); self.wfile.write(data)
+            def log_message(self, *args): pass
+        return LoginHandler
+
+    # --- rooms and scripted users (call from any thread) ---
+    def add_room(self, name, user_count=5):
+        room = FakeRoom(len(self.rooms) + 1, name, user_count); self.rooms[name.lower()] = room
+        return room
+
+    def room(self, name): return self.rooms[name.lower()]
+
+    def call(self, fn, *args):
+        return asyncio.run_coroutine_threadsafe(fn(*args), self.loop)
+
+    async def say(self, room, username, text, user_id=None):
+        await self._broadcast(room, {"handler": "chatroommessage", "roomid": room.id, "userid": user_id or abs(hash(username)) % 100000,
+                                     "username": username, "text": text})
+
+    async def ask_question(self, room, a=None, b=None, op=None):
+        a, b, op = a or random.randint(2, 99), b or random.randint(2, 99), op or random.choice("+-x")
+        question_id, answer = next(self.question_ids), {"+": a + b, "-": a - b, "x": a * b}[op]
+        room.question = (question_id, str(answer), time.perf_counter())
+        await self.say(room, QUIZ_BOT, f"❓ Question #{question_id}\n*Maths - {a} {op} {b} = ?*\nFirst to answer wins 10 points!")
+        return question_id
+
+    async def ask_text(self, room, text, question_id, expected=None, username=QUIZ_BOT):
+        # Replayed question whose answer is unknown: answers are timed but not graded.
+        room.question = (question_id, expected, time.perf_counter())
+        await self.say(room, username, text)
+
+    async def end_round(self, room):
+        if room.question: await self.say(room, QUIZ_BOT, f"🐢 Too Slow! Nobody answered. The answer was {room.question[1] or '?'}"); room.question = None
+
+    async def kick(self, room):
+        for ws in list(room.members): await self._send(ws, {"handler": "userkicked", "roomid": room.id, "userid": ws.user_id})
+        room.members.clear()
+
+    async def drop_all(self):
+        for ws in list(self.connections): await ws.close()
+
+    async def send_room_list(self, ws=None):
+        frame = {"handler": "chatroomplus", "data": [{"name": r.name, "userCount": r.user_count} for r in self.rooms.values()]}
+        for target in ([ws] if ws else list(self.connections)): await self._send(target, frame)
+
+    # --- protocol ---
+    async def _handle(self, ws):
+        ws.user_id, ws.logged_in = None, False
+        self.connections.add(ws)
+        try:
+            async for message in ws:
+                self.stats['frames_in'] += 1
+                try: data = json.loads(message)
+                except ValueError: continue
+                await self._dispatch(ws, data)
+        finally:
+            self.connections.discard(ws)
+            for room in self.rooms.values(): room.members.discard(ws)
+
+    async def _dispatch(self, ws, data):
+        handler = data.get("handler")
+        if handler == "login":
+            token = ws.request.path.partition("token=")[2]
+            if self.reject_next_login or token not in self.tokens:
+                self.reject_next_login = False; self.stats['rejected_logins'] += 1
+                return await self._send(ws, {"handler": "login", "status": "error", "message": "invalid token"})
+            ws.user_id, ws.logged_in = 4242, True; self.stats['logins'] += 1
+            await self._send(ws, {"handler": "login", "status": "success", "userID": ws.user_id})
+            await self.send_room_list(ws)
+        elif not ws.logged_in: return
+        elif handler == "joinchatroom":
+            if not (room := self.rooms.get(str(data.get("name", "")).lower())):
+                return await self._send(ws, {"handler": "joinchatroom", "error": 1, "message": "Room not found"})
+            room.members.add(ws); self.stats['joins'] += 1
+            await self._send(ws, {"handler": "joinchatroom", "error": 0, "roomid": room.id, "name": room.name})
+        elif handler == "leaveroom":
+            for room in self.rooms.values():
+                if room.id == data.get("roomid"): room.members.discard(ws)
+        elif handler == "chatroommessage":
+            room = next((r for r in self.rooms.values() if r.id == data.get("roomid")), None)
+            if room and ws in room.members: await self._on_bot_message(ws, room, str(data.get("text", "")).strip())
+
+    async def _on_bot_message(self, ws, room, text):
+        if text == ".s":
+            self.stats['spins'] += 1
+            await self.say(room, SPIN_BOT, f"🎰 {self.bot_username} won {random.choice(['50 coins', 'a badge', '2x XP'])}!")
+        elif text == ".h" and room.question:
+            self.stats['hints'] += 1
+            await self.say(room, QUIZ_BOT, f"💡 Hint: {room.question[1]} = ?") # degenerate but solvable hint
+        elif room.question and text.lstrip("-").replace(".", "", 1).isdigit():
+            question_id, expected, sent_at = room.question
+            self.stats['answers'] += 1; self.answer_latencies.append(time.perf_counter() - sent_at)
+            if expected is None: room.question = None
+            elif text == expected:
+                self.stats['correct'] += 1; room.question = None
+                await self.say(room, QUIZ_BOT, f"🎯 Right Answer! {self.bot_username} +10 points")
+            else: self.stats['wrong'] += 1
+
+    async def _broadcast(self, room, frame):
+        for ws in list(room.members): await self._send(ws, frame)
+
+    async def _send(self, ws, frame):
+        try: await ws.send(json.dumps(frame)); self.stats['frames_out'] += 1
+        except Exception: pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Howdies server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="WebSocket port")
+    parser.add_argument("--http-port", type=int, default=8766, help="login endpoint port")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--quiz-interval", type=float, default=10.0, help="seconds between questions in each joined room (0 disables)")
+    args = parser.parse_args()
+    fake = FakeHowdies(args.host, args.port, args.http_port, args.rooms).start()
+    print(f"LOGIN_URL={fake.login_url}\nWS_URL={fake.ws_url}\nrooms: {', '.join(r.name for r in fake.rooms.values())}")
+    try:
+        while True:
+            time.sleep(args.quiz_interval or 60)
+            if not args.quiz_interval: continue
+            for room in list(fake.rooms.values()):
+                if room.members: fake.call(fake.end_round, room).result(); fake.call(fake.ask_question, room)
+            print(json.dumps(fake.stats))
+    except KeyboardInterrupt: fake.stop()
+
+if __name__ == "__main__":
+    main()
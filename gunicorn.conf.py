@@ -0,0 +1,5 @@
+# Picked up by a plain `gunicorn app:app`. The dashboard keeps a server-sent events stream
+# open (/api/status/stream), so workers need threads: with the default sync worker one open
+# tab would hold the only worker and queue every other panel request behind it.
+worker_class = "gthread"
+threads = 8
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def make(policy, per_key=2, max_pending=100):
+    return app.Dispatcher(2, per_key, max_pending, policy)
+
+
+def queued(dispatcher, key):
+    return [args[0] for _, _, args in dispatcher.queues.get(key, ())]
+
+
+def drain(dispatcher, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with dispatcher.cond:
+            if not dispatcher.pending and not dispatcher.active: return
+        time.sleep(0.01)
+    raise AssertionError("dispatcher did not drain")
+
+
+def test_drop_oldest_replaces_the_oldest_job_per_key():
+    dispatcher, noop = make('drop_oldest'), lambda n: None
+    assert all(dispatcher.submit('a', noop, n) for n in (1, 2, 3))
+    assert queued(dispatcher, 'a') == [2, 3]
+    assert dispatcher.stats['dropped'] == 1 and dispatcher.pending == 2
+
+
+def test_drop_oldest_never_queues_a_key_twice():
+    dispatcher, done = make('drop_oldest', per_key=1), []
+    for key in ('b', 'c', 'c', 'c'): dispatcher.submit(key, done.append, key)
+    assert list(dispatcher.ready) == ['b', 'c']
+    dispatcher.start(); drain(dispatcher)
+    assert sorted(done) == ['b', 'c']
+    assert dispatcher.snapshot()['workers'] == 2 and dispatcher.snapshot()['errors'] == 0
+
+
+def test_drop_oldest_at_the_global_limit():
+    dispatcher, noop = make('drop_oldest', per_key=5, max_pending=2), lambda n: None
+    assert dispatcher.submit('a', noop, 1) and dispatcher.submit('b', noop, 2)
+    assert not dispatcher.submit('c', noop, 3) # nothing of c's own to drop
+    assert dispatcher.submit('a', noop, 4)
+    assert queued(dispatcher, 'a') == [4] and queued(dispatcher, 'b') == [2] and 'c' not in dispatcher.queues
+    assert dispatcher.pending == 2 and list(dispatcher.ready) == ['a', 'b']
+
+
+def test_drop_newest_rejects_at_per_key_and_global_limits():
+    dispatcher, noop = make('drop_newest', per_key=2, max_pending=3), lambda n: None
+    assert [dispatcher.submit('a', noop, n) for n in (1, 2, 3)] == [True, True, False]
+    assert queued(dispatcher, 'a') == [1, 2]
+    assert dispatcher.submit('b', noop, 4) and not dispatcher.submit('c', noop, 5)
+    assert dispatcher.pending == 3 and dispatcher.stats['dropped'] == 2 and 'c' not in dispatcher.queues
+
+
+def test_block_waits_for_room_then_gives_up(monkeypatch):
+    monkeypatch.setattr(app.Config, 'DISPATCHER_BLOCK_TIMEOUT_SECONDS', 0.2)
+    dispatcher, release, done = make('block', per_key=1), threading.Event(), []
+    dispatcher.submit('a', lambda: release.wait(2))
+    dispatcher.start(); time.sleep(0.05) # the worker now holds a's job
+    assert dispatcher.submit('a', done.append, 1)
+    started = time.monotonic()
+    assert not dispatcher.submit('a', done.append, 2)
+    assert time.monotonic() - started >= 0.2
+    threading.Timer(0.05, release.set).start()
+    dispatcher.max_queue_per_key = 2
+    assert dispatcher.submit('a', done.append, 3)
+    drain(dispatcher)
+    assert done == [1, 3]
+
+
+def test_unbounded_jobs_bypass_the_limits():
+    dispatcher = make('drop_newest', per_key=1, max_pending=1)
+    noop = lambda n: None
+    assert dispatcher.submit('a', noop, 1)
+    assert not dispatcher.submit('a', noop, 2)
+    assert dispatcher.submit('a', noop, 3, bounded=False) and dispatcher.submit('b', noop, 4, bounded=False)
+    assert dispatcher.pending == 3
+
+
+def test_due_timers_run_when_the_dispatcher_is_full(monkeypatch):
+    dispatcher, release, fired = make('drop_newest', per_key=1, max_pending=1), threading.Event(), threading.Event()
+    monkeypatch.setattr(app, 'dispatcher', dispatcher)
+    dispatcher.submit('busy', release.wait, 2)
+    assert not dispatcher.submit('other', print)
+    scheduler = app.HeapScheduler(); scheduler.start()
+    scheduler.call_later(0.01, fired.set, key=('cycle', 1))
+    time.sleep(0.1); dispatcher.start(); release.set()
+    assert fired.wait(2) and dispatcher.stats['dropped'] == 1
+
+
+def test_workers_survive_failing_jobs_and_stale_ready_entries():
+    dispatcher, done = make('drop_oldest'), []
+    dispatcher.start()
+    with dispatcher.cond: dispatcher.ready.append('ghost'); dispatcher.cond.notify()
+    dispatcher.submit('a', lambda: 1 / 0)
+    dispatcher.submit('a', done.append, 'after')
+    drain(dispatcher)
+    assert done == ['after'] and dispatcher.snapshot()['workers'] == 2 and dispatcher.stats['errors'] == 1
+
+
+@pytest.mark.parametrize("policy", ['drop_oldest', 'drop_newest', 'block'])
+def test_each_key_runs_in_order(policy):
+    dispatcher, seen = make(policy, per_key=1000, max_pending=1000), {}
+    dispatcher.start()
+    for n in range(200): dispatcher.submit(n % 5, lambda key, n: seen.setdefault(key, []).append(n), n % 5, n)
+    drain(dispatcher)
+    assert all(values == sorted(values) and len(values) == 40 for values in seen.values())
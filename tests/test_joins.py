@@ -0,0 +1,44 @@
+import app
+
+
+class FakeTimer:
+    def __init__(self, delay, fn, args):
+        self.delay, self.fn, self.args, self.cancelled = delay, fn, args, False
+
+    def cancel(self): self.cancelled = True
+
+
+class FakeEngine:
+    def __init__(self): self.timers = []
+
+    def call_later(self, delay, fn, *args, key=None):
+        self.timers.append(FakeTimer(delay, fn, args)); return self.timers[-1]
+
+
+def setup(monkeypatch):
+    engine, sent = FakeEngine(), []
+    monkeypatch.setattr(app.bot_state, 'engine', engine)
+    monkeypatch.setattr(app, 'send_ws_message', lambda payload, priority=None, coalesce_key=None, on_sent=None: sent.append(on_sent))
+    return app.JoinTracker(), engine, sent
+
+
+def test_join_timeout_starts_when_the_frame_is_sent(monkeypatch):
+    tracker, engine, sent = setup(monkeypatch)
+    future = tracker.join('Lobby')
+    [backstop] = engine.timers
+    assert backstop.delay == app.Config.SEND_TTL_SECONDS + app.Config.JOIN_TIMEOUT_SECONDS
+    sent[0]()
+    assert backstop.cancelled and engine.timers[-1].delay == app.Config.JOIN_TIMEOUT_SECONDS
+    assert not future.done()
+    tracker.resolve('lobby', 7)
+    assert future.result() == 7 and engine.timers[-1].cancelled
+
+
+def test_join_sent_before_the_backstop_is_armed_keeps_the_send_timer(monkeypatch):
+    tracker, engine, _ = setup(monkeypatch)
+    monkeypatch.setattr(app, 'send_ws_message', lambda payload, priority=None, coalesce_key=None, on_sent=None: on_sent())
+    future = tracker.join('Lobby')
+    send_timer, backstop = engine.timers
+    assert backstop.cancelled and not send_timer.cancelled
+    send_timer.fn(*send_timer.args)
+    assert isinstance(future.exception(), app.JoinError)
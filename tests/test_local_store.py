@@ -0,0 +1,95 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+class FakeQuery:
+    def __init__(self, replica, table):
+        self.replica, self.table, self.calls = replica, table, []
+
+    def __getattr__(self, name):
+        def step(*args, **kwargs):
+            self.calls.append((name, args))
+            return self
+        return step
+
+    def execute(self):
+        self.replica.executed.append((self.table, self.calls))
+        if self.replica.fail: raise ConnectionError("replica down")
+        return SimpleNamespace(data=self.replica.rows.get(self.table, []))
+
+
+class FakeSupabase:
+    def __init__(self, rows=None):
+        self.rows, self.executed, self.fail = rows or {}, [], False
+
+    def __bool__(self): return True
+
+    def table(self, name): return FakeQuery(self, name)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    local = app.LocalStore(str(tmp_path / "bot_state.db"))
+    monkeypatch.setattr(app, "local_store", local)
+    return local
+
+
+def test_store_opens_lazily(tmp_path):
+    path = tmp_path / "lazy.db"
+    local = app.LocalStore(str(path))
+    assert not path.exists()
+    local.set_value("k", "v")
+    assert path.exists() and local.get_value("k") == "v"
+
+
+def test_reads_are_served_locally(store, monkeypatch):
+    monkeypatch.setattr(app, "supabase", FakeSupabase())
+    now = time.time()
+    store.record_roam("lobby", "50 coins", now - 10)
+    store.record_roam("arcade", "nothing", now)
+    assert store.load_visited() == {"lobby": now - 10, "arcade": now}
+    assert [row[0] for row in store.recent_roam_logs(10)] == ["arcade", "lobby"]
+    assert sorted(row[:3] for row in store.roam_log_summary()) == [("arcade", 1, 0), ("lobby", 1, 1)]
+    assert app.supabase.executed == []
+
+
+def test_empty_store_is_seeded_from_replica(store, monkeypatch):
+    visited_at = "2026-01-02T03:04:05+00:00"
+    replica = FakeSupabase({"visited_rooms": [{"room_name": "lobby", "visited_at": visited_at}],
+                            "roam_logs": [{"room_name": "lobby", "prize_won": "a badge", "roam_time": visited_at}]})
+    monkeypatch.setattr(app, "supabase", replica)
+    seeded = app.seed_local_store_from_supabase()
+    expected_ts = app.datetime.fromisoformat(visited_at).timestamp()
+    assert seeded == {"lobby": expected_ts}
+    assert store.load_visited() == {"lobby": expected_ts}
+    assert store.recent_roam_logs(5) == [("lobby", "a badge", expected_ts)]
+    assert store.seed_attempted
+
+
+def test_write_behind_replicates_in_one_batch(monkeypatch):
+    replica = FakeSupabase()
+    monkeypatch.setattr(app, "supabase", replica)
+    writer = app.RoamWriteBehind(batch_size=100, interval=60)
+    writer.record_roam("lobby", "50 coins", 1000.0)
+    writer.record_roam("arcade", "nothing", 1001.0)
+    writer.delete_visited(["old"])
+    assert writer.flush()
+    assert [(table, calls[0][0]) for table, calls in replica.executed] == [("visited_rooms", "delete"), ("visited_rooms", "upsert"), ("roam_logs", "insert")]
+    assert len(replica.executed[2][1][0][1][0]) == 2
+    assert writer.snapshot()["pending"] == 0 and writer.snapshot()["rows_written"] == 5
+
+
+def test_failed_flush_keeps_rows_for_retry(monkeypatch):
+    replica = FakeSupabase()
+    monkeypatch.setattr(app, "supabase", replica)
+    writer = app.RoamWriteBehind(batch_size=100, interval=60)
+    writer.record_roam("lobby", "50 coins", 1000.0)
+    replica.fail = True
+    assert not writer.flush()
+    assert writer.snapshot()["pending"] == 2
+    replica.fail = False
+    assert writer.flush() and writer.snapshot()["pending"] == 0
@@ -0,0 +1,51 @@
+import time
+from collections import Counter
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    rooms = app.RoomDirectory()
+    rooms.observe((f"room{i}", 10) for i in range(200))
+    monkeypatch.setattr(app, "room_directory", rooms)
+    monkeypatch.setattr(app.Config, "ROAMER_SELECTION", "bandit")
+    return rooms
+
+
+def test_proven_rooms_are_always_candidates(directory):
+    selector = app.RoamSelector()
+    for _ in range(10):
+        for name in ("room7", "room42", "room99"): selector.record(name, "50 coins")
+    for i in range(100, 200): selector.record(f"room{i}", "nothing")
+    picks = Counter(selector.choose() for _ in range(500))
+    assert picks["room7"] + picks["room42"] + picks["room99"] > 400
+    assert set(selector.index) == {"room7", "room42", "room99"}
+
+
+def test_index_skips_unavailable_rooms(directory):
+    selector = app.RoamSelector()
+    for _ in range(5): selector.record("room3", "a badge")
+    directory.begin_roam("room3")
+    assert all(selector.choose() != "room3" for _ in range(100))
+
+
+def test_index_is_bounded_and_ordered_by_posterior_mean(directory, monkeypatch):
+    monkeypatch.setattr(app.Config, "ROAMER_SELECTION_INDEX_SIZE", 2)
+    selector = app.RoamSelector()
+    selector.seed([("a", 10, 1, None), ("b", 4, 3, None), ("c", 2, 2, None), ("d", 5, 0, None)])
+    assert selector.index == ["c", "b"]
+    selector.record_join_failure("c"); selector.record_join_failure("c"); selector.record_join_failure("c")
+    assert selector.index == ["b", "c"]
+
+
+def test_recent_prizes_score_higher(directory):
+    selector = app.RoamSelector()
+    for name in ("fresh", "stale"): selector.record(name, "50 coins"); selector.record(name, "nothing")
+    selector.rooms["stale"].last_prize_at = time.time() - 90 * 86400
+    now = time.time()
+    fresh = sum(selector.score("fresh", now) for _ in range(4000)) / 4000
+    stale = sum(selector.score("stale", now) for _ in range(4000)) / 4000
+    assert fresh > stale + 0.05
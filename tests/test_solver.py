@@ -0,0 +1,65 @@
+import time
+from fractions import Fraction
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("problem, expected", [
+    ("12 + 30 = ?", 42),
+    ("7 x 6 = ?", 42),
+    ("84 ÷ 2 = ?", 42),
+    ("2 ** 10 = ?", 1024),
+    ("? + 5 = 12", 7),
+    ("3 * ? - 4 = 11", 5),
+    ("(? + 2) / 4 = 3", 10),
+    ("-? = 9", -9),
+])
+def test_linear_and_arithmetic(problem, expected):
+    assert app.solve_math_problem(problem) == expected
+
+
+@pytest.mark.parametrize("problem, expected", [
+    ("? ** 2 = 49", 7),
+    ("? * ? + 1 = 65", 8),
+    ("100 / ? = 4", 25),
+    ("? ** 3 = 1000", 10),
+])
+def test_non_linear(problem, expected):
+    assert app.solve_math_problem(problem) == expected
+
+
+def test_fractional_answers():
+    assert app.solve_math_problem("1 / 4 = ?") == Fraction(1, 4)
+    assert app.format_quiz_answer(app.solve_math_problem("1 / 4 = ?")) == "0.25"
+    assert app.format_quiz_answer(app.solve_math_problem("1 / 3 = ?")) == "1/3"
+    assert app.format_quiz_answer(app.solve_math_problem("3 * ? = 2")) == "2/3"
+
+
+@pytest.mark.parametrize("problem", [
+    "no equals sign",
+    "1 + = ?",
+    "__import__('os') = ?",
+    "? + ? * ? = ?",
+    "1 / 0 = ?",
+    "2 ** 65 = ?",
+    "2 ** 0.5 = ?",
+    "1 + " * 60 + "1 = ?",
+])
+def test_rejected_input(problem):
+    assert app.solve_math_problem(problem) is None
+
+
+def test_nested_powers_are_bounded():
+    started = time.perf_counter()
+    assert app.solve_math_problem("((((9**64)**64)**64)**64) = ?") is None
+    assert time.perf_counter() - started < 0.5
+    assert app.solve_math_problem("(2**32)**2 = ?") == 2 ** 64
+
+
+def test_cache_normalizes_equivalent_problems():
+    cache = app.SolverCache(8)
+    assert cache.solve("3 x ? = 12") == 4
+    assert cache.solve("?*3=12") == 4
+    assert (cache.hits, cache.misses) == (1, 1)